@@ -137,8 +137,49 @@ class preprocessor(object):
 		srctext.truncate()
 		return srctext.getvalue()
 
-	# 查找单一文件的头文件引用情况
+	# 查找单一文件的头文件引用情况：只用正则扫描注释、字符串和预处理行，
+	# 跳过注释和字符串中的 #include，结果与 search_reference_legacy 一致。
+	# 跨行注释结束后的内容相当于行首，后面的 #include 也算
 	def search_reference(self, source, heads):
+		del heads[:]
+		try:
+			fp = open(source, "r")
+		except:
+			return ''
+		content = '\n'.join([ line.strip('\r\n') for line in fp ])
+		fp.close()
+		if (not '#' in content) or (not 'include' in content):
+			return content
+		if preprocessor._token is None:
+			import re
+			inline = r'/\*(?:[^*\n]|\*(?!/))*\*/[ \t]*'
+			include = r'[ \t]*(?:%s)*(#)[ \t]*(?:%s)*'%(inline, inline)
+			include += r'include[ \t]*(?:%s)*"((?:\\.|[^"\\\n])*)"'%inline
+			pattern = '^' + include
+			pattern += r'|/\*(?:[^*\n]|\*(?!/))*\n(?:[^*]|\*(?!/))*\*/'
+			pattern += include
+			pattern += r'|/\*.*?(?:\*/|\Z)|//[^\n]*'
+			pattern += r'|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+			preprocessor._token = re.compile(pattern, re.M | re.S)
+		number = 1
+		last = 0
+		for m in preprocessor._token.finditer(content):
+			index = 1
+			if m.group(2) is None:
+				if m.group(4) is None:
+					continue
+				index = 3
+			start = m.start(index)
+			number += content.count('\n', last, start)
+			last = start
+			heads.append([m.group(index + 1), start, m.end() - 1, number])
+		return content
+
+	# 正则表达式，第一次使用时编译
+	_token = None
+
+	# 查找单一文件的头文件引用情况：逐字符预处理的旧版本
+	def search_reference_legacy(self, source, heads):
 		content = ''
 		del heads[:]
 		try:
@@ -196,7 +237,7 @@ class preprocessor(object):
 		filename = os.path.abspath(filename)
 		import cStringIO
 		outtext = cStringIO.StringIO()
-		if not os.path.exists(filename):
+		if not STAT.exists(filename):
 			sys.stderr.write('can not open %s\n'%(filename))
 			return outtext.getvalue()
 		if filename in self._references:
@@ -204,19 +245,16 @@ class preprocessor(object):
 		else:
 			content = self.search_reference(filename, headers)
 			self._references[filename] = content, headers
-		save_cwd = os.getcwd()
 		file_cwd = os.path.dirname(filename)
-		if file_cwd == '':
-			file_cwd = '.'
-		os.chdir(file_cwd)
 		available = []
 		for head in headers:
-			if os.path.exists(head[0]):
+			if STAT.exists(os.path.join(file_cwd, head[0])):
 				available.append(head)
 		headers = available
 		offset = 0
 		for head in headers:
-			name = os.path.abspath(os.path.normcase(head[0]))
+			name = os.path.join(file_cwd, os.path.normcase(head[0]))
+			name = os.path.abspath(name)
 			if not (name in history_headers):
 				history_headers.append(name)
 				position = len(history_headers) - 1
@@ -232,7 +270,6 @@ class preprocessor(object):
 				outtext.write('/*:: skip including "%s" ::*/\n'%(head[0]))
 				offset = head[2] + 1
 		outtext.write(content[offset:])
-		os.chdir(save_cwd)
 		return outtext.getvalue()
 
 	# 过滤代码注释
@@ -267,8 +304,65 @@ class preprocessor(object):
 	# 复位依赖关系
 	def reset (self):
 		self._references = {}
+		self._direct = {}
+		self._closure = {}
 		return 0
 
+	# 文件直接引用的头文件（相对文件所在目录存在的），返回绝对路径列表
+	def includes (self, filename):
+		if filename in self._direct:
+			return self._direct[filename]
+		heads = []
+		self.search_reference(filename, heads)
+		home = os.path.dirname(filename)
+		names = []
+		for head in heads:
+			name = os.path.join(home, head[0])
+			if STAT.exists(name):
+				names.append(os.path.abspath(os.path.normcase(name)))
+		self._direct[filename] = names
+		return names
+
+	# 返回文件传递引用的所有头文件，结果按头文件缓存，在同一次构建的
+	# 所有源文件之间共享，不再生成合并后的文本
+	def closure (self, filename):
+		filename = os.path.abspath(filename)
+		if filename in self._closure:
+			return self._closure[filename]
+		output, pending = self._closure_visit(filename, {})
+		return output
+
+	# 深度优先遍历引用关系图，返回 (头文件列表, 环中尚未完成的节点)，
+	# 只有不依赖于未完成节点的结果才会被缓存
+	def _closure_visit (self, filename, visiting):
+		visiting[filename] = 1
+		pending = {}
+		output = []
+		seen = { filename: 1 }
+		for name in self.includes(filename):
+			if name in seen:
+				continue
+			seen[name] = 1
+			output.append(name)
+			if name in self._closure:
+				sub = self._closure[name]
+			elif name in visiting:
+				pending[name] = 1
+				continue
+			else:
+				sub, waiting = self._closure_visit(name, visiting)
+				pending.update(waiting)
+			for n in sub:
+				if not n in seen:
+					seen[n] = 1
+					output.append(n)
+		del visiting[filename]
+		if filename in pending:
+			del pending[filename]
+		if not pending:
+			self._closure[filename] = output
+		return output, pending
+
 	# 直接返回依赖
 	def dependence (self, filename, reset = False):
 		head = []
@@ -345,23 +439,26 @@ class preprocessor(object):
 #----------------------------------------------------------------------
 # execute and capture
 #----------------------------------------------------------------------
+def cmdsplit(cmd):
+	import shlex
+	if sys.platform[:3] == 'win':
+		ucs = False
+		if type(cmd) == type(u''):
+			cmd = cmd.encode('utf-8')
+			ucs = True
+		args = shlex.split(cmd.replace('\\', '\x00'))
+		args = [ n.replace('\x00', '\\') for n in args ]
+		if ucs:
+			args = [ n.decode('utf-8') for n in args ]
+	else:
+		args = shlex.split(cmd)
+	return args
+
 def execute(args, shell = False, capture = False):
 	import sys, os
 	parameters = []
 	if type(args) in (type(''), type(u'')):
-		import shlex
-		cmd = args
-		if sys.platform[:3] == 'win':
-			ucs = False
-			if type(cmd) == type(u''):
-				cmd = cmd.encode('utf-8')
-				ucs = True
-			args = shlex.split(cmd.replace('\\', '\x00'))
-			args = [ n.replace('\x00', '\\') for n in args ]
-			if ucs:
-				args = [ n.decode('utf-8') for n in args ]
-		else:
-			args = shlex.split(cmd)
+		args = cmdsplit(args)
 	for n in args:
 		if sys.platform[:3] != 'win':
 			replace = { ' ':'\\ ', '\\':'\\\\', '\"':'\\\"', '\t':'\\t', \
@@ -408,13 +505,709 @@ def execute(args, shell = False, capture = False):
 	return text
 
 
+#----------------------------------------------------------------------
+# scheduler: 进程池调度，非阻塞 Popen 并用 select 复用所有输出管道
+#----------------------------------------------------------------------
+class scheduler (object):
+
+	def __init__ (self, cpus = 1):
+		self.cpus = max(1, cpus)
+		self.reset()
+
+	def reset (self):
+		self.queue = []
+		self.running = {}
+		self.stop = False
+		self.slots = []
+		self.stream = None
+
+	# 是否可用：需要能 select 管道的平台
+	def available (self):
+		if sys.platform[:3] == 'win':
+			return False
+		import select
+		return ('poll' in select.__dict__) or ('select' in select.__dict__)
+
+	# 添加任务：name 为任务名，args 为命令行参数列表
+	def push (self, name, args, data = None):
+		job = {}
+		job['name'] = name
+		job['args'] = args
+		job['data'] = data
+		job['output'] = []
+		job['code'] = -1
+		job['time'] = 0.0
+		job['slot'] = -1
+		self.queue.append(job)
+		return job
+
+	# 启动任务
+	def _launch (self, job):
+		import subprocess
+		slot = self.slots.index(None)
+		devnull = open(os.devnull, 'r')
+		job['start'] = time.time()
+		try:
+			p = subprocess.Popen(job['args'], shell = False,
+					stdin = devnull, stdout = subprocess.PIPE,
+					stderr = subprocess.STDOUT)
+		except OSError, e:
+			devnull.close()
+			job['output'].append('error: %s: %s\n'%(job['args'][0], e))
+			job['code'] = -1
+			return None
+		devnull.close()
+		job['proc'] = p
+		job['slot'] = slot
+		self.slots[slot] = job
+		fd = p.stdout.fileno()
+		import fcntl
+		flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+		fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+		self.running[fd] = job
+		if self.stream:
+			self.stream(job, None)
+		return fd
+
+	# 读取管道输出，返回 False 表示管道已经关闭
+	def _read (self, fd):
+		job = self.running[fd]
+		try:
+			text = os.read(fd, 0x10000)
+		except OSError, e:
+			import errno
+			if e.errno in (errno.EAGAIN, errno.EINTR):
+				return True
+			text = ''
+		if text:
+			job['output'].append(text)
+			if self.stream:
+				self.stream(job, text)
+			return True
+		return False
+
+	# 任务结束
+	def _finish (self, fd):
+		job = self.running.pop(fd)
+		p = job['proc']
+		p.stdout.close()
+		job['code'] = p.wait()
+		job['time'] = time.time() - job['start']
+		job['proc'] = None
+		self.slots[job['slot']] = None
+		return job
+
+	# 等待管道事件，返回可读的 fd 列表，等待令牌时同时等待 jobserver
+	def _wait (self, timeout = None, token = False):
+		import select
+		fds = self.running.keys()
+		if token and JOBS.fileno() >= 0:
+			fds.append(JOBS.fileno())
+		if 'poll' in select.__dict__:
+			poller = select.poll()
+			for fd in fds:
+				poller.register(fd, select.POLLIN | select.POLLHUP | select.POLLERR)
+			ms = (timeout is not None) and int(timeout * 1000) or None
+			try: events = poller.poll(ms)
+			except select.error: return []
+			return [ fd for fd, ev in events ]
+		try: r, w, x = select.select(fds, [], [], timeout)
+		except select.error: return []
+		return r
+
+	# 运行所有任务，每个任务结束时调用 callback(job)，返回 False 停止调度；
+	# stream(job, text) 在任务启动（text 为 None）和读到输出时调用；
+	# 第一个任务使用进程本身的隐含令牌，其余的任务需要 jobserver 令牌
+	def run (self, callback = None, stream = None):
+		self.stream = stream
+		self.slots = [ None for i in xrange(self.cpus) ]
+		self.queue.reverse()
+		tokens = 0
+		try:
+			while self.queue or self.running:
+				waiting = False
+				while self.queue and (not self.stop):
+					if len(self.running) >= self.cpus:
+						break
+					if tokens < len(self.running):
+						if not JOBS.acquire(0):
+							waiting = True
+							break
+						tokens += 1
+					job = self.queue.pop()
+					if self._launch(job) is None:
+						if callback and callback(job) == False:
+							self.stop = True
+				if self.stop:
+					self.queue = []
+				while tokens > max(0, len(self.running) - 1):
+					JOBS.release()
+					tokens -= 1
+				if not self.running:
+					continue
+				for fd in self._wait(None, waiting):
+					if fd not in self.running:
+						continue
+					if self._read(fd):
+						continue
+					job = self._finish(fd)
+					if callback and callback(job) == False:
+						self.stop = True
+		finally:
+			for i in xrange(tokens):
+				JOBS.release()
+		return 0
+
+
+#----------------------------------------------------------------------
+# diagnostics: 编译输出流水线，增量切分各个编译进程的输出并标记来源，
+# 去掉公共头文件中重复的警告，由单独的线程写控制台
+#----------------------------------------------------------------------
+class diagnostics (object):
+
+	def __init__ (self, mode = 'text', stream = None):
+		import re, threading, Queue
+		self.mode = mode
+		self.dedupe = (mode != 'raw')
+		self.stream = stream or sys.stdout
+		self.lock = threading.Lock()
+		self.queue = Queue.Queue()
+		self.states = {}
+		self.seen = {}
+		self.last = None
+		self.duplicated = 0
+		self.rehead = re.compile(r'^(.+?):(\d+):(?:(\d+):)? ' \
+				r'(warning|error|fatal error|note): (.*)$')
+		self.reprefix = re.compile(r'^(In file included from |\s+from )|' \
+				r': (In|At) [^:]*:$|: In instantiation of ')
+		self.thread = threading.Thread(target = self._writer)
+		self.thread.daemon = True
+		self.thread.start()
+
+	# 控制台写线程：编译线程只负责入队，不会被缓慢的终端或管道阻塞
+	def _writer (self):
+		while True:
+			text = self.queue.get()
+			if text is None:
+				break
+			try:
+				self.stream.write(text)
+				self.stream.flush()
+			except IOError:
+				pass
+		return 0
+
+	def write (self, text):
+		if text:
+			self.queue.put(text)
+
+	def _state (self, source):
+		state = self.states.get(source, None)
+		if state is None:
+			state = { 'partial': '', 'prefix': [], 'record': None,
+				'hold': None, 'shown': False, 'name': '' }
+			self.states[source] = state
+		return state
+
+	# 开始一个任务：name 为输出诊断信息前显示的任务名，hold 为真时输出
+	# 先缓存到任务结束再决定是否显示，show 为真时立即显示任务名
+	def begin (self, source, name = '', hold = False, show = False):
+		self.lock.acquire()
+		state = self._state(source)
+		state['name'] = name
+		if hold:
+			state['hold'] = []
+		if show and name and self.mode != 'json':
+			self.write(name)
+			state['shown'] = True
+			self.last = source
+		self.lock.release()
+
+	# 输入编译进程的一段输出，可以是不完整的行
+	def feed (self, source, text):
+		if not text:
+			return 0
+		self.lock.acquire()
+		state = self._state(source)
+		if state['hold'] is not None:
+			state['hold'].append(text)
+		else:
+			self._feed(source, state, text)
+		self.lock.release()
+		return 0
+
+	def _feed (self, source, state, text):
+		lines = (state['partial'] + text).split('\n')
+		state['partial'] = lines.pop()
+		for line in lines:
+			self._line(source, state, line.rstrip('\r'))
+		return 0
+
+	# 诊断信息分组：包含路径等前缀行、诊断行以及其后的源码和 note
+	# 组成一条记录，整条记录一起输出或者去重
+	def _line (self, source, state, line):
+		m = self.rehead.match(line)
+		if m:
+			record = state['record']
+			if m.group(4) == 'note' and record is not None:
+				record['lines'].extend(state['prefix'])
+				record['lines'].append(line)
+				state['prefix'] = []
+				return 0
+			self._flush(source, state)
+			record = {}
+			record['lines'] = state['prefix'] + [line]
+			record['file'] = m.group(1)
+			record['line'] = int(m.group(2))
+			record['column'] = int(m.group(3) or 0)
+			record['kind'] = m.group(4)
+			record['message'] = m.group(5)
+			state['prefix'] = []
+			state['record'] = record
+		elif self.reprefix.search(line):
+			state['prefix'].append(line)
+		elif line[:1] in (' ', '\t') and state['record'] is not None:
+			state['record']['lines'].append(line)
+		else:
+			self._flush(source, state)
+			lines = state['prefix'] + [line]
+			state['prefix'] = []
+			self._emit(source, state, { 'lines': lines })
+		return 0
+
+	def _flush (self, source, state):
+		record = state['record']
+		state['record'] = None
+		if record is None:
+			return 0
+		if record['kind'] == 'warning' and self.dedupe:
+			filename = os.path.normcase(os.path.abspath(record['file']))
+			key = (filename, record['line'], record['column'],
+					record['message'])
+			if key in self.seen:
+				self.duplicated += 1
+				return 0
+			self.seen[key] = source
+		self._emit(source, state, record)
+		return 0
+
+	def _emit (self, source, state, record):
+		if self.mode == 'json':
+			import json
+			item = { 'source': source, 'text': '\n'.join(record['lines']) }
+			if 'kind' in record:
+				item['type'] = 'diagnostic'
+				for key in ('file', 'line', 'column', 'kind', 'message'):
+					item[key] = record[key]
+			else:
+				item['type'] = 'output'
+			self.write(json.dumps(item) + '\n')
+			return 0
+		text = '\n'.join(record['lines']) + '\n'
+		if self.last != source and state['name']:
+			text = state['name'] + text
+		self.last = source
+		state['shown'] = True
+		self.write(text)
+		return 0
+
+	# 结束一个任务：keep 为假时丢弃缓存的输出（合并编译单元失败），
+	# 任务名在之前没有显示过的情况下才显示
+	def end (self, source, name = '', timeslap = 0.0, failed = False, keep = True):
+		self.lock.acquire()
+		state = self._state(source)
+		hold = state['hold']
+		state['hold'] = None
+		if keep:
+			if name and (not state['shown']) and self.mode != 'json':
+				self.write(name)
+				state['shown'] = True
+				self.last = source
+			if hold:
+				self._feed(source, state, ''.join(hold))
+			if state['partial']:
+				self._line(source, state, state['partial'])
+			self._flush(source, state)
+			if state['prefix']:
+				self._emit(source, state, { 'lines': state['prefix'] })
+			if self.mode == 'json':
+				import json
+				item = { 'type': 'job', 'source': source,
+					'time': round(timeslap, 3), 'failed': failed }
+				self.write(json.dumps(item) + '\n')
+		del self.states[source]
+		self.lock.release()
+		return 0
+
+	# 运行编译进程并增量读取输出，返回进程退出码
+	def run (self, source, args):
+		import subprocess
+		devnull = open(os.devnull, 'r')
+		try:
+			p = subprocess.Popen(args, shell = False, stdin = devnull,
+					stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+		except OSError, e:
+			devnull.close()
+			self.feed(source, 'error: %s: %s\n'%(args[0], e))
+			return -1
+		devnull.close()
+		while True:
+			text = os.read(p.stdout.fileno(), 0x10000)
+			if not text:
+				break
+			self.feed(source, text)
+		p.stdout.close()
+		return p.wait()
+
+	# 等待写线程输出完所有内容
+	def close (self):
+		if self.thread is None:
+			return 0
+		if self.duplicated and self.mode != 'json':
+			text = '(%d duplicate warnings suppressed)\n'%self.duplicated
+			self.write(text)
+		self.queue.put(None)
+		self.thread.join()
+		self.thread = None
+		return 0
+
+
+# --diag=json 时控制台只能有 json 记录：去掉任务名、进度和耗时这些文本行
+def diag_printmode(printmode):
+	if CFG.get('diag', 'text') == 'json':
+		return printmode & ~11
+	return printmode
+
+
 #----------------------------------------------------------------------
 # Default CFG File
 #----------------------------------------------------------------------
 ININAME = ''
 INIPATH = ''
 
-CFG = {'abspath':False, 'verbose':False, 'silent':False}
+CFG = {'abspath':False, 'verbose':False, 'silent':False, 'engine':''}
+
+
+#----------------------------------------------------------------------
+# statcache: 整个构建共享的文件状态缓存，编译和链接后需显式失效
+#----------------------------------------------------------------------
+class statcache (object):
+
+	def __init__ (self):
+		self.scandir = None
+		try:
+			self.scandir = os.scandir
+		except AttributeError:
+			try:
+				import scandir
+				self.scandir = scandir.scandir
+			except ImportError:
+				pass
+		self.reset()
+
+	def reset (self):
+		self._stat = {}			# 路径 -> (mtime, size) 或 None
+		self._listing = {}		# 目录 -> 文件名字典，None 表示不是目录
+		self.counters = { 'stat': 0, 'listdir': 0, 'hit': 0, 'invalidate': 0 }
+
+	# 返回 (mtime, size)，文件不存在返回 None
+	def stat (self, path):
+		if path in self._stat:
+			self.counters['hit'] += 1
+			return self._stat[path]
+		name = os.path.abspath(path)
+		if name in self._stat:
+			self.counters['hit'] += 1
+			return self._stat[name]
+		st = None
+		if self._listed(name) != False:
+			self.counters['stat'] += 1
+			try:
+				info = os.stat(name)
+				st = (float('%.6f'%info.st_mtime), info.st_size)
+			except OSError:
+				pass
+		self._stat[name] = st
+		return st
+
+	# 从已经列出的目录判断文件是否存在：True, False 或者 None(未知)
+	def _listed (self, name):
+		home, fn = os.path.split(name)
+		listing = self._listing.get(home, None)
+		if listing is None:
+			return None
+		return (os.path.normcase(fn) in listing)
+
+	# 列出目录，缓存文件名用于批量判断存在性
+	def listdir (self, path):
+		path = os.path.abspath(path)
+		if path in self._listing:
+			self.counters['hit'] += 1
+			return self._listing[path]
+		self.counters['listdir'] += 1
+		listing = {}
+		try:
+			if self.scandir:
+				for entry in self.scandir(path):
+					listing[os.path.normcase(entry.name)] = 1
+			else:
+				for fn in os.listdir(path):
+					listing[os.path.normcase(fn)] = 1
+		except OSError:
+			listing = {}
+		self._listing[path] = listing
+		return listing
+
+	# 判断文件是否存在：先列出所在目录，同一目录下的查询不再调用 stat
+	def exists (self, path):
+		if path in self._stat:
+			self.counters['hit'] += 1
+			return self._stat[path] is not None
+		name = os.path.abspath(path)
+		home, fn = os.path.split(name)
+		if not home in self._listing:
+			self.listdir(home)
+		if not os.path.normcase(fn) in self._listing[home]:
+			self._stat[name] = None
+			return False
+		return self.stat(name) is not None
+
+	def mtime (self, path):
+		st = self.stat(path)
+		return st and st[0] or 0.0
+
+	def size (self, path):
+		st = self.stat(path)
+		return st and st[1] or ((st is None) and -1 or 0)
+
+	# 是否已经缓存
+	def cached (self, path):
+		return path in self._stat
+
+	# 使缓存失效：path 为空时全部失效
+	def invalidate (self, path = None):
+		self.counters['invalidate'] += 1
+		if path is None:
+			self._stat = {}
+			self._listing = {}
+			return 0
+		name = os.path.abspath(path)
+		if name in self._stat:
+			del self._stat[name]
+		home, fn = os.path.split(name)
+		if home in self._listing:
+			# 标记为可能存在，下次查询时重新 stat
+			self._listing[home][os.path.normcase(fn)] = 1
+		return 0
+
+
+STAT = statcache()
+
+
+#----------------------------------------------------------------------
+# tracer: 记录构建各阶段耗时，输出 Chrome trace-event 格式的 JSON
+#----------------------------------------------------------------------
+class tracer (object):
+
+	def __init__ (self):
+		self.enabled = False
+		self.reset()
+
+	def reset (self):
+		self.events = []
+		self.threads = {}
+		self.start = time.time()
+		self.pid = os.getpid()
+
+	# 当前线程的 tid
+	def tid (self):
+		import threading
+		return threading.current_thread().ident or 0
+
+	# 给 tid 命名，显示在 trace viewer 的线程列表中
+	def thread_name (self, tid, name):
+		if self.enabled:
+			self.threads[tid] = name
+		return 0
+
+	# 记录从 start 到 end(默认当前时间) 的一段耗时
+	def span (self, name, start, end = None, tid = None, args = None, cat = 'emake'):
+		if not self.enabled:
+			return 0
+		if end is None:
+			end = time.time()
+		if tid is None:
+			tid = self.tid()
+		event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': self.pid}
+		event['tid'] = tid
+		event['ts'] = int((start - self.start) * 1000000)
+		event['dur'] = int((end - start) * 1000000)
+		if args:
+			event['args'] = args
+		self.events.append(event)
+		return 0
+
+	def save (self, filename):
+		import json
+		events = []
+		for tid, name in self.threads.items():
+			event = {'name': 'thread_name', 'ph': 'M', 'pid': self.pid}
+			event['tid'] = tid
+			event['args'] = {'name': name}
+			events.append(event)
+		events.extend(self.events)
+		try:
+			fp = open(filename, 'w')
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+			fp.close()
+		except IOError:
+			sys.stderr.write('error: cannot write %s\n'%filename)
+			sys.stderr.flush()
+			return -1
+		return 0
+
+
+TRACE = tracer()
+
+
+#----------------------------------------------------------------------
+# jobserver: GNU make 的 jobserver 协议，每个令牌允许多运行一个任务，
+# 在 make -j 下作为客户端，否则创建管道作为子进程的服务端
+#----------------------------------------------------------------------
+class jobserver (object):
+
+	def __init__ (self):
+		self.active = False
+		self.owner = False
+		self.fd = -1			# 本进程读取令牌用的非阻塞 fd
+		self.wfd = -1
+		self.shared = False		# 无法重新打开时直接读取共享的阻塞 fd
+		self.tokens = []
+		import threading
+		self.lock = threading.Lock()
+
+	# 从 MAKEFLAGS 中解析 jobserver 参数：fifo:PATH 或者 R,W
+	def _parse (self, makeflags):
+		auth = None
+		for flag in makeflags.split():
+			for key in ('--jobserver-auth=', '--jobserver-fds='):
+				if flag.startswith(key):
+					auth = flag[len(key):]
+		if auth is None:
+			return None
+		if auth[:5] == 'fifo:':
+			return auth[5:]
+		try:
+			rfd, wfd = [ int(n) for n in auth.split(',') ]
+		except ValueError:
+			return None
+		return (rfd, wfd)
+
+	# 作为客户端连接到上层 make/emake 的 jobserver
+	def attach (self, makeflags = None):
+		if makeflags is None:
+			makeflags = os.environ.get('MAKEFLAGS', '')
+		auth = self._parse(makeflags)
+		if auth is None or sys.platform[:3] == 'win':
+			return False
+		try:
+			if isinstance(auth, tuple):
+				import fcntl
+				fcntl.fcntl(auth[0], fcntl.F_GETFD)
+				fcntl.fcntl(auth[1], fcntl.F_GETFD)
+				self.fd = self._reopen(auth[0])
+				self.wfd = auth[1]
+			else:
+				self.fd = os.open(auth, os.O_RDWR | os.O_NONBLOCK)
+				self.wfd = self.fd
+		except (IOError, OSError):
+			return False
+		self.active = True
+		return True
+
+	# 管道的读端和父进程共享文件状态，不能直接设置 O_NONBLOCK，
+	# Linux 下通过 /proc 重新打开得到独立的非阻塞 fd
+	def _reopen (self, fd):
+		try:
+			return os.open('/proc/self/fd/%d'%fd, os.O_RDONLY | os.O_NONBLOCK)
+		except OSError:
+			self.shared = True
+			return fd
+
+	# 作为服务端：创建放有 slots - 1 个令牌的管道，并导出 MAKEFLAGS
+	# 供编译事件等子进程使用
+	def create (self, slots):
+		if sys.platform[:3] == 'win':
+			return False
+		rfd, wfd = os.pipe()
+		if slots > 1:
+			os.write(wfd, '+' * (slots - 1))
+		self.fd = self._reopen(rfd)
+		self.wfd = wfd
+		self.active = True
+		self.owner = True
+		auth = '%d,%d'%(rfd, wfd)
+		flags = os.environ.get('MAKEFLAGS', '')
+		flags += ' -j%d --jobserver-auth=%s --jobserver-fds=%s'%(slots, auth, auth)
+		os.environ['MAKEFLAGS'] = flags.strip()
+		return True
+
+	def fileno (self):
+		return self.fd
+
+	def _select (self, timeout):
+		import select
+		try:
+			r, w, x = select.select([ self.fd ], [], [], timeout)
+		except select.error:
+			return False
+		return len(r) > 0
+
+	def _read (self):
+		import errno
+		try:
+			return os.read(self.fd, 1)
+		except OSError, e:
+			if not e.errno in (errno.EAGAIN, errno.EINTR):
+				raise
+		return None
+
+	# 取得一个令牌，没有启用 jobserver 时总是成功；timeout 为 0 时
+	# 不等待，为 None 时一直等待
+	def acquire (self, timeout = 0):
+		if not self.active:
+			return True
+		while True:
+			if self.shared and not self._select(timeout):
+				return False
+			try:
+				token = self._read()
+			except OSError:
+				return False
+			if token:
+				self.lock.acquire()
+				self.tokens.append(token)
+				self.lock.release()
+				return True
+			if self.shared:
+				if timeout is not None:
+					return False
+			elif not self._select(timeout):
+				return False
+
+	# 归还一个令牌
+	def release (self):
+		if not self.active:
+			return 0
+		self.lock.acquire()
+		token = self.tokens and self.tokens.pop() or None
+		self.lock.release()
+		if token is not None:
+			os.write(self.wfd, token)
+		return 0
+
+
+JOBS = jobserver()
 
 
 #----------------------------------------------------------------------
@@ -435,6 +1228,7 @@ class configure(object):
 		self.target = ''
 		self.config = {}
 		self.cp = ConfigParser.ConfigParser()
+		self.inifiles = []
 		self.unix = 1
 		self.xlink = 1
 		self.searchdirs = None
@@ -454,12 +1248,19 @@ class configure(object):
 		self.cpus = 0
 		self.inited = False
 		self.fpic = 0
+		self.fuseld = None
 		self.name = {}
 		ext = ('.c', '.cpp', '.c', '.cc', '.cxx', '.s', '.asm', '.m', '.mm')
 		self.extnames = ext
 		self.__jdk_home = None
+		self.probes = {}
+		self.probed = None
 		self.reset()
 	
+	# init 的结果中需要保存到探测缓存的字段
+	PROBED = ('config', 'inifiles', 'iniload', 'haveini', 'dirhome',
+		'exename', 'cpus', 'cygwin', 'name', 'target', 'fpic', 'replace')
+
 	# 配置信息复位
 	def reset (self):
 		self.inc = {}		# include路径
@@ -581,11 +1382,13 @@ class configure(object):
 	
 	# 读取ini文件
 	def _readini (self, inipath):
+		ts = time.time()
 		self.cp = ConfigParser.ConfigParser()
 		if self.unix and '~' in inipath:
 			inipath = os.path.expanduser(inipath)
 		if os.path.exists(inipath):
 			self.iniload = os.path.abspath(inipath)
+			self.inifiles.append(self.iniload)
 			config = {}
 			try: self.cp.read(inipath)
 			except: pass
@@ -629,6 +1432,7 @@ class configure(object):
 				else:
 					self.config['default']['java'] = os.path.abspath(java)
 			self.haveini = True
+			TRACE.span('configure._readini', ts, args = {'ini': inipath})
 		return 0
 
 	# 检查 dirhome
@@ -643,7 +1447,13 @@ class configure(object):
 	def init (self):
 		if self.inited:
 			return 0
+		ts = time.time()
+		if self._probe_load():
+			self.inited = True
+			TRACE.span('configure.init', ts, args = {'probe': 'hit'})
+			return 0
 		self.config = {}
+		self.inifiles = []
 		self.reset()
 		fn = INIPATH
 		self.iniload = os.path.abspath(self.inipath)
@@ -751,11 +1561,188 @@ class configure(object):
 		self.replace['inipath'] = self.inipath
 		self.replace['target'] = self.target
 		self.inited = True
+		self._probe_save()
+		TRACE.span('configure.init', ts)
 		return 0
 
 	# 读取配置
 	def _getitem (self, sect, key, default = ''):
 		return self.config.get(sect, {}).get(key, default)
+
+	# 缓存目录下的文件名：prefix-<text 的哈希>.bin
+	def cachefile (self, prefix, text):
+		import hashlib
+		root = os.environ.get('XDG_CACHE_HOME', '') or '~/.cache'
+		root = os.path.join(os.path.expanduser(root), 'emake')
+		name = hashlib.md5(text).hexdigest()[:16]
+		return os.path.join(root, '%s-%s.bin'%(prefix, name))
+
+	# 清理缓存目录：同一前缀的文件只保留最近使用的 keep 个
+	def cacheprune (self, prefix, keep):
+		root = os.path.dirname(self.cachefile(prefix, ''))
+		try:
+			names = os.listdir(root)
+		except OSError:
+			return 0
+		files = []
+		for name in names:
+			if name.startswith(prefix + '-') and name.endswith('.bin'):
+				name = os.path.join(root, name)
+				try:
+					files.append((os.stat(name).st_mtime, name))
+				except OSError:
+					pass
+		files.sort(reverse = True)
+		count = 0
+		for mtime, name in files[keep:]:
+			try:
+				os.remove(name)
+				count += 1
+			except OSError:
+				pass
+		return count
+
+	# 探测缓存文件：按 emake 及 ini 的位置区分
+	def _probe_file (self):
+		text = '%s\n%s\n%s'%(os.path.abspath(__file__), INIPATH, self.ininame)
+		return self.cachefile('probe', text)
+
+	# 探测缓存的键：所有候选 ini 文件、emake 本身的时间以及影响
+	# 搜索 gcc 的环境变量，任何一个变化都会重新探测
+	def _probe_key (self):
+		names = [ os.path.abspath(__file__) ]
+		if INIPATH:
+			names.append(os.path.abspath(INIPATH))
+		else:
+			if self.unix:
+				names.append('/etc/%s'%self.ininame)
+				names.append('/usr/local/etc/%s'%self.ininame)
+				names.append(os.path.expanduser('~/.config/%s'%self.ininame))
+			names.append(self.inipath)
+		key = []
+		for name in names:
+			try:
+				st = os.stat(name)
+				key.append((name, int(st.st_mtime * 1000), st.st_size))
+			except OSError:
+				key.append((name, -1, -1))
+		environ = ('PATH', 'JAVA_HOME', 'XDG_CACHE_HOME')
+		key.append(tuple([ os.environ.get(n, '') for n in environ ]))
+		key.append((sys.platform, sys.executable, sys.version))
+		return tuple(key)
+
+	# gcc 的标识：路径、时间、大小，升级或者替换编译器都会重新探测
+	def _probe_gcc (self):
+		gcc = self.exename.get('gcc', 'gcc')
+		for name in (gcc, gcc + '.exe'):
+			path = os.path.join(self.dirhome, name)
+			try:
+				st = os.stat(path)
+			except OSError:
+				continue
+			return (path, int(st.st_mtime * 1000), st.st_size, st.st_ino)
+		return ()
+
+	# 从探测缓存恢复 init 的结果，成功返回 True
+	def _probe_load (self):
+		self.probes = {}
+		self.probed = None
+		if not CFG.get('probe', True):
+			return False
+		import marshal
+		try:
+			fp = open(self._probe_file(), 'rb')
+			data = marshal.loads(fp.read())
+			fp.close()
+		except (IOError, OSError, EOFError, ValueError, TypeError):
+			return False
+		self.probed = self._probe_key()
+		if type(data) != type({}) or data.get('key') != self.probed:
+			return False
+		for name in self.PROBED:
+			if name not in data:
+				return False
+		saved = (self.dirhome, self.exename)
+		self.dirhome, self.exename = data['dirhome'], data['exename']
+		if data.get('gcc') != self._probe_gcc():
+			self.dirhome, self.exename = saved
+			return False
+		for name in self.PROBED:
+			setattr(self, name, data[name])
+		self.probes = data.get('probes', {})
+		self.searchdirs = self.probes.get('searchdirs', None)
+		return True
+
+	# 写入探测缓存，先写临时文件再改名，失败时忽略
+	def _probe_save (self):
+		if not CFG.get('probe', True):
+			return False
+		import marshal
+		if self.probed is None:
+			self.probed = self._probe_key()
+		data = {}
+		for name in self.PROBED:
+			data[name] = getattr(self, name)
+		# $(makefile) 和 $(workspace) 属于具体的工程，不能带到下一次
+		replace = {}
+		for k, v in self.replace.items():
+			if not k in ('makefile', 'workspace'):
+				replace[k] = v
+		data['replace'] = replace
+		data['key'] = self.probed
+		data['gcc'] = self._probe_gcc()
+		data['probes'] = self.probes
+		filename = self._probe_file()
+		temp = filename + '.%d.tmp'%os.getpid()
+		try:
+			if not os.path.exists(os.path.dirname(filename)):
+				os.makedirs(os.path.dirname(filename))
+			fp = open(temp, 'wb')
+			fp.write(marshal.dumps(data, 2))
+			fp.close()
+			if sys.platform[:3] == 'win' and os.path.exists(filename):
+				os.remove(filename)
+			os.rename(temp, filename)
+		except (IOError, OSError, ValueError):
+			try: os.remove(temp)
+			except OSError: pass
+			return False
+		return True
+
+	# 保存一次探测的结果（search-dirs、python/java 配置、链接器等）
+	def _probe_update (self, name, value):
+		if self.probes.get(name) != value:
+			self.probes[name] = value
+			if self.inited:
+				self._probe_save()
+		return value
+
+	# 恢复或者保存（store 为真）一个节展开后的参数。相对路径按当前目录
+	# 展开，$(makefile) 等变量按替换表展开，所以两者都作为键；恢复时
+	# 重新检查头文件和库目录是否还存在
+	def _probe_section (self, sect, store = False):
+		name = 'section:%s:%s'%(sect, self.replace.get('makefile', ''))
+		names = ('inc', 'lib', 'flag', 'pdef', 'link', 'flnk', 'wlnk', 'cond')
+		replace = self.replace.items()
+		replace.sort()
+		key = (os.getcwd(), tuple(replace))
+		if store:
+			data = [ key ] + [ getattr(self, n) for n in names ]
+			data.append((self.param_compile, self.param_build))
+			self._probe_update(name, tuple(data))
+			return True
+		data = self.probes.get(name, None)
+		if data is None or data[0] != key:
+			return False
+		for path in data[1].keys() + data[2].keys():
+			if path[:1] == '"' and path[-1:] == '"':
+				path = path[1:-1].replace('""', '"')
+			if not os.path.exists(path):
+				return False
+		for i in xrange(len(names)):
+			setattr(self, names[i], dict(data[i + 1]))
+		self.param_compile, self.param_build = data[-1]
+		return True
 	
 	# 取得替换了$(HOME)变量的路径
 	def path (self, path):
@@ -944,19 +1931,34 @@ class configure(object):
 		return path.strip(' \r\n\t')
 
 	# 刷新配置
+	# 完整读取一个节时先查探测缓存，存在无效路径（需要每次给出警告）
+	# 的节不缓存
 	def loadcfg (self, sect = 'default', reset = True):
 		self.init()
-		if reset: self.reset()
-		f1 = lambda n: (n[:1] != '\'' or n[-1:] != '\'') and n
+		if not reset:
+			self._loadcfg(sect)
+			return 0
+		self.reset()
+		if self._probe_section(sect):
+			return 0
+		if self._loadcfg(sect) == 0:
+			self._probe_section(sect, True)
+		return 0
+
+	# 读取一个节的配置，返回无效路径的数量
+	def _loadcfg (self, sect):
+		missing = 0
 		config = lambda n: self._getitem(sect, n, '')
 		for path in config('include').replace(';', ',').split(','):
 			path = self.pathconf(path)
 			if not path: continue
-			self.push_inc(path)
+			if self.push_inc(path) < 0:
+				missing += 1
 		for path in config('lib').replace(';', ',').split(','):
 			path = self.pathconf(path)
 			if not path: continue
-			self.push_lib(path)
+			if self.push_lib(path) < 0:
+				missing += 1
 		for link in config('link').replace(';', ',').split(','):
 			link = self.pathconf(link)
 			if not link: continue
@@ -983,7 +1985,7 @@ class configure(object):
 				if not flag: continue
 				self.push_cond(flag, name)
 		self.parameters()
-		return 0
+		return missing
 	
 	# 按字典值顺序取出配置
 	def sequence (self, data):
@@ -1072,7 +2074,7 @@ class configure(object):
 					dict[path] = 1
 				else:
 					dict[path] = 0
-		self.searchdirs = data
+		self.searchdirs = self._probe_update('searchdirs', data)
 		return data
 	
 	# 检测库是否存在
@@ -1097,15 +2099,19 @@ class configure(object):
 				if name: path = name
 		return path
 	
-	# 执行GNU工具集
-	def execute (self, binname, parameters, printcmd = False, capture = False):
+	# 取得GNU工具集的命令行
+	def cmdline (self, binname, parameters):
 		path = os.path.abspath(os.path.join(self.dirhome, binname))
 		if not self.unix:
 			name = self.pathshort(path)
 			if (not name) and os.path.exists(path + '.exe'):
 				name = self.pathshort(path + '.exe')
 			if name: path = name
-		cmd = '%s %s'%(self.pathtext(path), parameters)
+		return '%s %s'%(self.pathtext(path), parameters)
+
+	# 执行GNU工具集
+	def execute (self, binname, parameters, printcmd = False, capture = False):
+		cmd = self.cmdline(binname, parameters)
 		#printcmd = True
 		text = ''
 		if printcmd:
@@ -1127,11 +2133,29 @@ class configure(object):
 
 	# 编译
 	def compile (self, srcname, objname, cflags, printcmd = False, capture = False):
+		cmd = self._compile_param(srcname, objname, cflags)
+		return self.gcc(cmd, False, printcmd, capture)
+
+	# 取得编译命令行，用于直接启动编译进程
+	def compile_cmdline (self, srcname, objname, cflags):
+		cmd = self._compile_param(srcname, objname, cflags)
+		parameters = '%s %s'%(cmd, self.param_compile)
+		return self.cmdline(self.exename['gcc'], parameters)
+
+	# 编译参数
+	def _compile_param (self, srcname, objname, cflags):
 		if CFG['abspath']:
 			srcname = self.pathtext(os.path.abspath(srcname))
 		else:
 			srcname = self.pathrel(srcname)
 		cmd = '-c %s -o %s %s'%(srcname, self.pathrel(objname), cflags)
+		cond = self.compile_cond(srcname)
+		if cond:
+			cmd = cmd + ' ' + (' '.join(cond))
+		return cmd
+
+	# 按源文件类型返回条件编译参数：cflag, cxxflag, sflag 等
+	def compile_cond (self, srcname):
 		extname = os.path.splitext(srcname)[-1].lower()
 		cond = []
 		if extname in ('.c', '.h'):
@@ -1144,9 +2168,20 @@ class configure(object):
 			cond = self.condition({'mflag':1})
 		elif extname in ('.mm',):
 			cond = self.condition({'mmflag':1})
-		if cond:
-			cmd = cmd + ' ' + (' '.join(cond))
-		return self.gcc(cmd, False, printcmd, capture)
+		return cond
+	
+	# 预编译头文件的语言类型(gcc -x)，不支持预编译头的源文件返回 None
+	def pch_lang (self, srcname):
+		extname = os.path.splitext(srcname)[-1].lower()
+		if extname == '.c':
+			return 'c-header'
+		if extname in ('.cpp', '.cc', '.cxx'):
+			return 'c++-header'
+		if extname == '.m':
+			return 'objective-c-header'
+		if extname == '.mm':
+			return 'objective-c++-header'
+		return None
 	
 	# 使用 dllwrap
 	def dllwrap (self, parameters, printcmd = False, capture = False):
@@ -1161,18 +2196,89 @@ class configure(object):
 		dllwrap = self.exename.get('dllwrap', 'dllwrap')
 		return self.execute(dllwrap, parameters, printcmd, capture)
 	
-	# 生成lib库
+	# 生成lib库：只有文件名不重复的 .o 时直接用 ar 生成，否则需要
+	# composite 解开其中的 .a 并重命名同名文件
 	def makelib (self, output, objs = [], printcmd = False, capture = False):
-		if 0:
-			name = ' '.join([ self.pathrel(n) for n in objs ])
-			parameters = 'crv %s %s'%(self.pathrel(output), name)
-			return self.execute(self.exename['ar'], parameters, printcmd, capture)
 		objs = [ n for n in objs ]
 		for link in self.sequence(self.wlnk):
 			if link[-2:] in ('.a', '.o'):
 				if os.path.exists(link):
 					objs.append(link)
+		if self.archivable(objs):
+			try: os.remove(output)
+			except OSError: pass
+			return self.archive(output, objs, 'crv', printcmd, capture)
 		return self.composite(output, objs, printcmd, capture)
+
+	# 能否直接用 ar 维护：都是 .o 文件并且文件名不重复
+	def archivable (self, objs):
+		names = {}
+		for name in objs:
+			if os.path.splitext(name)[-1].lower() != '.o':
+				return False
+			key = os.path.normcase(os.path.basename(name))
+			if key in names:
+				return False
+			names[key] = 1
+		return True
+
+	# 执行 ar：modifier 为 crv 时新建，为 rv 时按文件名替换已有成员
+	def archive (self, output, objs, modifier = 'rv', printcmd = False, capture = False):
+		names = [ self.pathrel(n) for n in objs ]
+		name, rsp = self.response(output + '.rsp', names)
+		parameters = '%s %s %s'%(modifier, self.pathrel(output), name)
+		try:
+			return self.execute(self.exename['ar'], parameters, printcmd, capture)
+		finally:
+			if rsp: os.remove(rsp)
+
+	# 取得静态库的成员列表
+	def members (self, output):
+		text = self.execute(self.exename['ar'], 't ' + self.pathrel(output), False, True)
+		return [ n.strip('\r\n\t ') for n in text.split('\n') if n.strip('\r\n\t ') ]
+
+	# 参数过长时写入响应文件(@file)，返回 (参数, 响应文件名)
+	def response (self, filename, names):
+		text = ' '.join(names)
+		limit = self.unix and 100000 or 8000
+		if len(text) < limit:
+			return text, None
+		fp = open(filename, 'w')
+		for name in names:
+			fp.write(name.replace('\\', '\\\\') + '\n')
+		fp.close()
+		return '@' + self.pathrel(filename), filename
+
+	# 链接器选择：配置中的 linker 为 auto 时依次尝试 mold, lld, gold
+	def fuse_ld (self):
+		if self.fuseld is not None:
+			return self.fuseld
+		name = CFG.get('linker', None)
+		if name is None:
+			name = self._getitem('default', 'linker', '')
+		name = name.strip('\r\n\t ').lower()
+		self.fuseld = ''
+		if name in ('', 'default', 'no', 'off'):
+			return ''
+		if name != 'auto':
+			self.fuseld = '-fuse-ld=%s'%name
+			return self.fuseld
+		if 'fuseld' in self.probes:
+			self.fuseld = self.probes['fuseld']
+			return self.fuseld
+		import subprocess
+		for name in ('mold', 'lld', 'gold'):
+			cmd = self.cmdline(self.exename['gcc'], '-fuse-ld=%s -Wl,--version'%name)
+			try:
+				p = subprocess.Popen(cmdsplit(cmd), stdin = subprocess.PIPE,
+						stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+				p.communicate()
+			except OSError:
+				continue
+			if p.returncode == 0:
+				self.fuseld = '-fuse-ld=%s'%name
+				break
+		return self._probe_update('fuseld', self.fuseld)
 	
 	# 生成动态链接：dll 或者 so
 	def makedll (self, output, objs = [], param = '', printcmd = False, capture = False):
@@ -1192,11 +2298,17 @@ class configure(object):
 	
 	# 生成exe
 	def makeexe (self, output, objs = [], param = '', printcmd = False, capture = False):
-		name = ' '.join([ self.pathrel(n) for n in objs ])
+		names = [ self.pathrel(n) for n in objs ]
+		name, rsp = self.response(output + '.rsp', names)
 		if self.xlink:
 			name = '-Xlinker "-(" ' + name + ' -Xlinker "-)"'
+		if self.fuse_ld():
+			param = (self.fuse_ld() + ' ' + param).strip(' ')
 		parameters = '-o %s %s %s'%(self.pathrel(output), param, name)
-		return self.gcc(parameters, True, printcmd, capture)
+		try:
+			return self.gcc(parameters, True, printcmd, capture)
+		finally:
+			if rsp: os.remove(rsp)
 
 	# 合并.o .a文件为新的 .a文件 
 	def composite (self, output, objs = [], printcmd = False, capture = False):
@@ -1214,6 +2326,7 @@ class configure(object):
 		os.mkdir(srcpath)
 		os.chdir(srcpath)
 		names = {}
+		text = ''
 		for source in libname:
 			os.chdir(srcpath)
 			for fn in [ n for n in os.listdir('.') ]:
@@ -1224,7 +2337,7 @@ class configure(object):
 				files.append(source)
 			else:
 				args = '-x %s'%self.pathrel(source)
-				self.execute(self.exename['ar'], args, printcmd, capture)
+				text += self.execute(self.exename['ar'], args, printcmd, capture)
 				for fn in os.listdir('.'):
 					files.append(os.path.abspath(fn))
 			for fn in files:
@@ -1240,14 +2353,12 @@ class configure(object):
 					names[last] = 1
 					shutil.copyfile(fn, os.path.join(outpath, last))
 		os.chdir(outpath)
-		args = ['crv', self.pathrel(output)]
-		args = ' '.join(args + [self.pathrel(n) for n in names])
 		try: os.remove(output)
 		except: pass
-		self.execute(self.exename['ar'], args, printcmd, capture)
+		text += self.archive(output, names.keys(), 'crv', printcmd, capture)
 		os.chdir(cwd)
 		shutil.rmtree(temp)
-		return 0
+		return capture and text or 0
 
 	# 运行工具
 	def cmdtool (self, sectname, exename, parameters, printcmd = False):
@@ -1355,6 +2466,8 @@ class configure(object):
 		ldflags = self._getitem('default', 'python_ldflags', None)
 		if cflags or ldflags:
 			return (cflags.strip('\r\n\t '), ldflags.strip('\r\n\t '))
+		if 'python' in self.probes:
+			return tuple(self.probes['python'])
 		pythoninc, pythonlib = [], []
 		import distutils.sysconfig
 		sysconfig = distutils.sysconfig
@@ -1405,7 +2518,7 @@ class configure(object):
 		pythonlib.append('-lpython' + pyver)
 		cflags = ' '.join(pythoninc)
 		ldflags = ' '.join(pythonlib)
-		return cflags, ldflags
+		return self._probe_update('python', (cflags, ldflags))
 	
 	# 最终完成 java配置
 	def __java_final (self, home):
@@ -1427,6 +2540,11 @@ class configure(object):
 
 	# 取得 java配置
 	def java_home (self):
+		if 'javahome' not in self.probes:
+			self._probe_update('javahome', self.__java_home())
+		return self.probes['javahome']
+
+	def __java_home (self):
 		jdk = self._getitem('default', 'java', None)
 		if jdk:
 			jdk = os.path.abspath(jdk)
@@ -1535,6 +2653,13 @@ class coremake(object):
 		self._opt = []
 		self._export = {}	# DLL导出配置
 		self._environ = {}	# 环境变量
+		self._task_times = {}	# 每个源文件的编译耗时，只记录成功的
+		self._timing = {}		# 历史编译耗时，用于调度
+		self._unity = {}		# 合并编译单元 -> [(源文件, 目标文件, 参数)]
+		self._unity_failed = []
+		self._remote = None		# 分布式编译
+		self._diag = None		# 编译输出流水线
+		self._link_time = 0.0
 		self.inited = 0
 		
 	# 初始化：设置工程名字，类型，以及中间文件的目录
@@ -1639,6 +2764,7 @@ class coremake(object):
 	def remove (self, path):
 		try: os.remove(path)
 		except: pass
+		STAT.invalidate(path)
 		if os.path.exists(path):
 			sys.stderr.write('error: cannot remove \'%s\'\n'%path)
 			sys.stderr.flush()
@@ -1717,28 +2843,78 @@ class coremake(object):
 			options = self._opt[i]
 			if srcname == objname:
 				continue
-			if skipexist and os.path.exists(objname):
+			if skipexist and STAT.exists(objname):
 				continue
 			try: os.remove(os.path.abspath(objname))
 			except: pass
+			STAT.invalidate(objname)
+			name = ''
 			if printmode & 1:
-				name = self.config.pathrel(srcname)
-				if name[:1] == '"':
-					name = name[1:-1]
-				if CFG['abspath']:
-					name = os.path.abspath(srcname)
-				print name
-			self.config.compile(srcname, objname, options, printcmd)
-			if not os.path.exists(objname):
+				name = self._task_name(srcname, 0, printmode & 7)
+			unity = srcname in self._unity
+			self._diag.begin(srcname, name, unity, not unity)
+			timeslap = time.time()
+			self._task_compile(srcname, objname, options, printcmd)
+			timeslap = time.time() - timeslap
+			TRACE.span(os.path.basename(srcname), time.time() - timeslap,
+					cat = 'job', args = {'src': srcname})
+			STAT.invalidate(objname)
+			failed = not STAT.exists(objname)
+			if not failed:
+				self._task_times[srcname] = timeslap
+			if failed and not self._task_failed(srcname, objname):
+				self._diag.end(srcname, keep = False)
+				continue
+			self._diag.end(srcname, name, timeslap, failed)
+			if failed:
 				retval = -1
 				break
 		return retval
+
+	# 编译失败：合并编译单元失败时不中止，留待逐个文件重新编译
+	def _task_failed (self, srcname, objname):
+		if srcname in self._unity:
+			self._unity_failed.append((srcname, objname))
+			return False
+		return True
 	
+	# 估算编译耗时：优先使用历史耗时，没有记录的按文件大小及平均
+	# 每字节耗时估算，返回 {源文件: 耗时}
+	def _estimate (self, names):
+		sizes = {}
+		for srcname in names:
+			sizes[srcname] = max(0, STAT.size(srcname))
+		known = [ n for n in names if n in self._timing ]
+		total = sum([ sizes[n] for n in known ])
+		rate = 1.0
+		if known and total > 0:
+			rate = sum([ self._timing[n] for n in known ]) / total
+		costs = {}
+		for srcname in names:
+			weight = self._timing.get(srcname, None)
+			if weight is None:
+				weight = sizes[srcname] * rate
+			costs[srcname] = weight
+		return costs
+
+	# 返回按估算耗时升序排列的 (weight, src, obj, opt)
+	def _schedule (self):
+		names = [ n for n in self._src ]
+		for members in self._unity.values():
+			names.extend([ m[0] for m in members ])
+		costs = self._estimate(names)
+		for name, members in self._unity.items():
+			costs[name] = sum([ costs[m[0]] for m in members ])
+		ctasks = []
+		for s, o, t in zip(self._src, self._obj, self._opt):
+			ctasks.append((costs[s], s, o, t))
+		ctasks.sort()
+		return ctasks
+
 	# 多核编译：skipexist(是否需要跳过已有的obj文件)
 	def _compile_threading (self, skipexist, printmode, printcmd, cpus):
-		# 估算编译时间，文件越大假设时间越长，放在最前面
-		ctasks = [ (os.path.getsize(s), s, o, t) for s, o, t in zip(self._src, self._obj, self._opt) ]
-		ctasks.sort()
+		# 估算编译时间，耗时越长的放在最前面
+		ctasks = self._schedule()
 		import threading
 		self._task_lock = threading.Lock()
 		self._task_retval = 0
@@ -1752,19 +2928,35 @@ class coremake(object):
 			self._task_thread.append(th)
 		for th in self._task_thread:
 			th.start()
+			TRACE.thread_name(th.ident, th.name)
 		for th in self._task_thread:
 			th.join()
 		self._task_thread = None
 		self._task_lock = None
 		self._task_queue = None
 		for objname in self._obj:
-			if not os.path.exists(objname):
+			if not STAT.exists(objname):
 				self._task_retval = -1
 				break
 		return self._task_retval
 	
 	# 具体编译线程
+	# 编号为 0 的线程使用进程本身的隐含令牌，其余线程取得 jobserver
+	# 令牌后才能编译
 	def _compile_working_thread (self, skipexist, printmode, printcmd, id):
+		while id > 0:
+			if self._task_finish or (not self._task_queue):
+				return 0
+			if JOBS.acquire(0.2):
+				break
+		try:
+			self._compile_working_loop(skipexist, printmode, printcmd)
+		finally:
+			if id > 0:
+				JOBS.release()
+		return 0
+
+	def _compile_working_loop (self, skipexist, printmode, printcmd):
 		mutex = self._task_lock
 		while True:
 			weight, srcname, objname = 0, '', ''
@@ -1779,37 +2971,123 @@ class coremake(object):
 			mutex.release()
 			if srcname == objname:
 				continue
-			if skipexist and os.path.exists(objname):
+			if skipexist and STAT.exists(objname):
 				continue
 			try: os.remove(os.path.abspath(objname))
 			except: pass
+			STAT.invalidate(objname)
+			name = ''
+			if printmode & 1:
+				name = self._task_name(srcname, 0, printmode & 7)
+			self._diag.begin(srcname, name, srcname in self._unity)
 			timeslap = time.time()
-			output = self.config.compile(srcname, objname, options, printcmd, True)
+			self._task_compile(srcname, objname, options, printcmd)
+			TRACE.span(os.path.basename(srcname), timeslap, cat = 'job',
+					args = {'src': srcname})
 			timeslap = time.time() - timeslap
-			result = True
-			if not os.path.exists(objname):
+			STAT.invalidate(objname)
+			failed = not STAT.exists(objname)
+			if not failed:
+				self._task_times[srcname] = timeslap
+			if failed:
 				mutex.acquire()
+				if not self._task_failed(srcname, objname):
+					mutex.release()
+					self._diag.end(srcname, keep = False)
+					continue
 				self._task_retval = -1
 				self._task_finish = True
 				mutex.release()
-				result = False
-			mutex.acquire()
 			if printmode & 1:
-				name = self.config.pathrel(srcname)
-				if name[:1] == '"':
-					name = name[1:-1]
-				if CFG['abspath']:
-					name = os.path.abspath(srcname)
-				sys.stdout.write(name + '\n')
-			if sys.platform[:3] == 'win':
-				lines = [ x.rstrip('\r\n') for x in output.split('\n') ]
-				output = '\n'.join(lines)
-			sys.stdout.write(output)
-			sys.stdout.flush()
-			mutex.release()
-			time.sleep(0.01)
+				name = self._task_name(srcname, timeslap, printmode)
+			self._diag.end(srcname, name, timeslap, failed)
 		return 0
 
+	# 编译一个文件，输出增量送入诊断流水线，返回退出码；
+	# 配置了 worker 时分发到 worker 上编译
+	def _task_compile (self, srcname, objname, options, printcmd):
+		if self._remote is not None:
+			output = self._remote.compile(srcname, objname, options, printcmd)
+			self._diag.feed(srcname, output)
+			return 0
+		cmd = self.config.compile_cmdline(srcname, objname, options)
+		if printcmd:
+			self._diag.feed(srcname, cmd + '\n')
+		return self._diag.run(srcname, cmdsplit(cmd))
+
+	# 多进程编译：直接启动编译器进程，用 select 同时读取所有输出
+	def _compile_process (self, skipexist, printmode, printcmd, cpus):
+		ctasks = self._schedule()
+		ctasks.reverse()
+		sched = scheduler(cpus)
+		for weight, srcname, objname, options in ctasks:
+			if srcname == objname:
+				continue
+			if skipexist and STAT.exists(objname):
+				continue
+			try: os.remove(os.path.abspath(objname))
+			except: pass
+			STAT.invalidate(objname)
+			cmd = self.config.compile_cmdline(srcname, objname, options)
+			sched.push(srcname, cmdsplit(cmd), (objname, cmd))
+		self._task_retval = 0
+		diag = self._diag
+		def stream(job, text):
+			srcname = job['name']
+			if text is not None:
+				diag.feed(srcname, text)
+				return 0
+			name = ''
+			if printmode & 1:
+				name = self._task_name(srcname, 0, printmode & 7)
+			diag.begin(srcname, name, srcname in self._unity)
+			if printcmd:
+				diag.feed(srcname, job['data'][1] + '\n')
+			return 0
+		def finish(job):
+			objname, cmd = job['data']
+			srcname = job['name']
+			if job['slot'] >= 0:
+				tid = job['slot'] + 1
+				TRACE.thread_name(tid, 'worker %d'%tid)
+				TRACE.span(os.path.basename(srcname), job['start'], tid = tid,
+						cat = 'job', args = {'src': srcname, 'code': job['code']})
+			STAT.invalidate(objname)
+			failed = not STAT.exists(objname)
+			if not failed:
+				self._task_times[srcname] = job['time']
+			if failed and not self._task_failed(srcname, objname):
+				diag.end(srcname, keep = False)
+				return True
+			if job['slot'] < 0:
+				stream(job, None)
+				diag.feed(srcname, ''.join(job['output']))
+			name = ''
+			if printmode & 1:
+				name = self._task_name(srcname, job['time'], printmode)
+			diag.end(srcname, name, job['time'], failed)
+			if failed:
+				self._task_retval = -1
+				return False
+			return True
+		sched.run(finish, stream)
+		for objname in self._obj:
+			if not STAT.exists(objname):
+				self._task_retval = -1
+				break
+		return self._task_retval
+
+	# 编译时显示的文件名，printmode & 8 时附带耗时
+	def _task_name (self, srcname, timeslap, printmode):
+		name = self.config.pathrel(srcname)
+		if name[:1] == '"':
+			name = name[1:-1]
+		if CFG['abspath']:
+			name = os.path.abspath(srcname)
+		if printmode & 8:
+			name = '%s (%.2fs)'%(name, timeslap)
+		return name + '\n'
+
 	# 编译：skipexist(是否需要跳过已有的obj文件)
 	def compile (self, skipexist = False, printmode = 0, cpus = 0):
 		self.config.check()
@@ -1817,49 +3095,139 @@ class coremake(object):
 		printcmd = False
 		if printmode & 4:
 			printcmd = True
-		if printmode & 2:
-			print 'compiling ...'
 		t = time.time()
-		if cpus <= 1:
-			retval = self._compile_single(skipexist, printmode, printcmd)
-		else:
-			retval = self._compile_threading(skipexist, printmode, printcmd, cpus)
+		self._task_times = {}
+		self._unity_failed = []
+		engine = CFG['engine']
+		if not engine:
+			engine = scheduler().available() and 'process' or 'thread'
+		if self._remote is not None:
+			engine = 'remote'
+			cpus = max(cpus, len(self._remote.hosts))
+		self._diag = diagnostics(CFG.get('diag', 'text'))
+		if printmode & 2:
+			self._diag.write('compiling ...\n')
+		try:
+			retval = self._compile_tasks(engine, skipexist, printmode,
+					printcmd, cpus)
+			if self._unity_failed:
+				retval = self._compile_fallback(engine, printmode, printcmd, cpus)
+		finally:
+			self._diag.close()
+		TRACE.span('compile', t, args = {'engine': engine, 'cpus': cpus})
 		t = time.time() - t
 		#print 'time', t
 		return retval
+
+	# 使用指定的引擎编译所有任务
+	def _compile_tasks (self, engine, skipexist, printmode, printcmd, cpus):
+		if engine == 'remote':
+			return self._compile_threading(skipexist, printmode, printcmd, cpus)
+		if cpus <= 1:
+			return self._compile_single(skipexist, printmode, printcmd)
+		elif engine == 'process':
+			return self._compile_process(skipexist, printmode, printcmd, cpus)
+		return self._compile_threading(skipexist, printmode, printcmd, cpus)
+
+	# 合并编译失败时逐个编译其中的源文件，再用 ld -r 合并成原来的目标文件
+	def _compile_fallback (self, engine, printmode, printcmd, cpus):
+		failed = self._unity_failed
+		saved = (self._src, self._obj, self._opt, self._unity)
+		self._src, self._obj, self._opt, self._unity = [], [], [], {}
+		for srcname, objname in failed:
+			for member in saved[3][srcname]:
+				self.push(member[0], member[1], member[2])
+		retval = self._compile_tasks(engine, False, printmode, printcmd, cpus)
+		self._src, self._obj, self._opt, self._unity = saved
+		self._unity_failed = []
+		if retval != 0:
+			return -1
+		ld = self.config.exename['ld']
+		for srcname, objname in failed:
+			objs = [ self.config.pathrel(m[1]) for m in self._unity[srcname] ]
+			parameters = '-r -o %s %s'%(self.config.pathrel(objname), ' '.join(objs))
+			self._diag.write(self.config.execute(ld, parameters, printcmd, True))
+			STAT.invalidate(objname)
+		for objname in self._obj:
+			if not STAT.exists(objname):
+				return -1
+		return 0
 	
-	# 连接：(是否跳过已有的文件)
-	def link (self, skipexist = False, printmode = 0):
+	# 能否增量更新静态库：库已存在，成员和当前的目标文件一一对应
+	def archivable (self):
+		if self._mode != 'lib' or not STAT.exists(self._out):
+			return False
+		objs = [ n for n in self._obj ]
+		for link in self.config.sequence(self.config.wlnk):
+			if link[-2:] in ('.a', '.o') and os.path.exists(link):
+				return False
+		if not self.config.archivable(objs):
+			return False
+		names = [ os.path.normcase(os.path.basename(n)) for n in objs ]
+		members = [ os.path.normcase(n) for n in self.config.members(self._out) ]
+		names.sort()
+		members.sort()
+		return names == members
+
+	# 连接：(是否跳过已有的文件)，静态库给出 changed 时只替换变化的成员
+	def link (self, skipexist = False, printmode = 0, changed = None):
 		self.config.check()
-		retval = 0
 		printcmd = False
 		if printmode & 4:
 			printcmd = True
+		self._diag = diagnostics(CFG.get('diag', 'text'))
 		if printmode & 2:
-			print 'linking ...'
+			self._diag.write('linking ...\n')
+		try:
+			return self._link(skipexist, printmode, printcmd, changed)
+		finally:
+			self._diag.close()
+
+	def _link (self, skipexist, printmode, printcmd, changed):
 		output = self._out
-		if skipexist and os.path.exists(output):
+		ts = time.time()
+		if changed and self._mode == 'lib' and STAT.exists(output):
+			text = self.config.archive(output, changed, 'rv', printcmd, True)
+			self._link_done(output, ts, printmode, len(changed), text)
+			return output
+		if skipexist and STAT.exists(output):
 			return output
 		self.remove(output)
 		self.mkdir(os.path.split(output)[0])
+		text = ''
 		if self._mode == 'exe':
-			self.config.makeexe(output, self._obj, '', printcmd)
+			text = self.config.makeexe(output, self._obj, '', printcmd, True)
 		elif self._mode == 'win':
 			param = '-mwindows'
-			self.config.makeexe(output, self._obj, param, printcmd)
+			text = self.config.makeexe(output, self._obj, param, printcmd, True)
 		elif self._mode == 'dll':
 			param = self._dllparam()
-			self.config.makedll(output, self._obj, param, printcmd)
+			text = self.config.makedll(output, self._obj, param, printcmd, True)
 			if param and os.path.exists(output): 
 				self._dllpost()
 		elif self._mode == 'lib':
-			self.config.makelib(output, self._obj, printcmd)
-		if not os.path.exists(output):
+			text = self.config.makelib(output, self._obj, printcmd, True)
+		self._link_done(output, ts, printmode, len(self._obj), text)
+		if not STAT.exists(output):
 			return ''
 		return output
+
+	# 记录链接耗时，连接器的输出经过 diagnostics，printmode & 8 时显示耗时
+	def _link_done (self, output, ts, printmode, count, text):
+		STAT.invalidate(output)
+		TRACE.span('link', ts, args = {'mode': self._mode, 'objs': count})
+		self._link_time = time.time() - ts
+		name = ''
+		if printmode & 8:
+			name = self._task_name(output, self._link_time, printmode)
+		self._diag.begin(output, name)
+		self._diag.feed(output, text)
+		failed = not STAT.exists(output)
+		self._diag.end(output, name, self._link_time, failed)
+		return 0
 	
 	# 执行编译事件
-	def event (self, scripts):
+	def event (self, scripts, kind = 'event'):
 		if not scripts:
 			return False
 		# 保存环境
@@ -1896,8 +3264,11 @@ class coremake(object):
 		for script in scripts:
 			if savecwd != workdir: 
 				os.chdir(workdir)
+			ts = time.time()
 			os.system(script)
+			TRACE.span(kind, ts, args = {'script': script})
 		os.chdir(savecwd)
+		STAT.invalidate()
 		# 恢复环境
 		for k, v in envsave.items():
 			if os.environ.get(k) != v: 
@@ -1918,6 +3289,173 @@ class coremake(object):
 
 
 
+#----------------------------------------------------------------------
+# objcache: 目标文件缓存，按源文件及头文件内容和编译参数的哈希保存 .o
+#----------------------------------------------------------------------
+class objcache (object):
+
+	def __init__ (self, path, limit = 0):
+		if '~' in path:
+			path = os.path.expanduser(path)
+		self.path = os.path.abspath(path)
+		self.limit = limit
+		self.hits = 0
+		self.misses = 0
+		self.stored = 0
+		self._digest = {}
+
+	# 文件内容的哈希，同一次构建中共享的头文件只读一次
+	def digest (self, fname):
+		if fname in self._digest:
+			return self._digest[fname]
+		import hashlib
+		try:
+			fp = open(fname, 'rb')
+			text = fp.read()
+			fp.close()
+		except:
+			return None
+		value = hashlib.sha1(text).hexdigest()
+		self._digest[fname] = value
+		return value
+
+	# 计算缓存键：依赖文件列表(含源文件)加上完整的编译参数
+	def key (self, srcname, filelist, parameters):
+		import hashlib
+		sha = hashlib.sha1()
+		sha.update(srcname + '\n' + parameters + '\n')
+		names = [ n for n in filelist ]
+		names.sort()
+		for fname in names:
+			value = self.digest(fname)
+			if value is None:
+				return None
+			sha.update('%s:%s\n'%(fname, value))
+		return sha.hexdigest()
+
+	def _cachename (self, key):
+		return os.path.join(self.path, key[:2], key[2:] + '.o')
+
+	# 从缓存中恢复目标文件，命中后更新访问时间供 LRU 淘汰使用
+	def fetch (self, key, objname):
+		import shutil
+		cachename = self._cachename(key)
+		if not os.path.exists(cachename):
+			self.misses += 1
+			return False
+		try:
+			shutil.copyfile(cachename, objname)
+			os.utime(cachename, None)
+		except:
+			self.misses += 1
+			return False
+		self.hits += 1
+		return True
+
+	# 保存目标文件到缓存
+	def store (self, key, objname):
+		import shutil
+		cachename = self._cachename(key)
+		if not os.path.exists(objname):
+			return False
+		path = os.path.dirname(cachename)
+		try:
+			if not os.path.exists(path):
+				os.makedirs(path)
+			temp = cachename + '.%d'%os.getpid()
+			shutil.copyfile(objname, temp)
+			if os.path.exists(cachename):
+				os.remove(cachename)
+			os.rename(temp, cachename)
+		except:
+			return False
+		self.stored += 1
+		return True
+
+	# 列出缓存文件：(atime, size, name)
+	def _entries (self):
+		entries = []
+		if not os.path.exists(self.path):
+			return entries
+		for sub in os.listdir(self.path):
+			path = os.path.join(self.path, sub)
+			if len(sub) != 2 or (not os.path.isdir(path)):
+				continue
+			for fn in os.listdir(path):
+				if fn[-2:] != '.o':
+					continue
+				name = os.path.join(path, fn)
+				try: st = os.stat(name)
+				except: continue
+				entries.append((st.st_mtime, st.st_size, name))
+		return entries
+
+	# 超过大小限制时，按最近使用时间淘汰到限制的 90%
+	def evict (self):
+		if self.limit <= 0:
+			return 0
+		entries = self._entries()
+		total = sum([ n[1] for n in entries ])
+		if total <= self.limit:
+			return 0
+		entries.sort()
+		count = 0
+		for mtime, size, name in entries:
+			if total <= self.limit * 9 / 10:
+				break
+			try: os.remove(name)
+			except: continue
+			total -= size
+			count += 1
+		return count
+
+	# 读取统计信息：(hits, misses)
+	def _load_stats (self):
+		try:
+			fp = open(os.path.join(self.path, 'stats'), 'r')
+			part = fp.read().split()
+			fp.close()
+			return int(part[0]), int(part[1])
+		except:
+			pass
+		return 0, 0
+
+	# 累加本次的命中统计
+	def save (self):
+		if self.hits == 0 and self.misses == 0:
+			return 0
+		hits, misses = self._load_stats()
+		hits += self.hits
+		misses += self.misses
+		try:
+			if not os.path.exists(self.path):
+				os.makedirs(self.path)
+			fp = open(os.path.join(self.path, 'stats'), 'w')
+			fp.write('%d %d\n'%(hits, misses))
+			fp.close()
+		except:
+			return -1
+		self.hits = self.misses = 0
+		return 0
+
+	# 返回统计：hits, misses, files, size
+	def stats (self):
+		hits, misses = self._load_stats()
+		entries = self._entries()
+		size = sum([ n[1] for n in entries ])
+		return hits, misses, len(entries), size
+
+	# 清空缓存
+	def clear (self):
+		for mtime, size, name in self._entries():
+			try: os.remove(name)
+			except: pass
+		try: os.remove(os.path.join(self.path, 'stats'))
+		except: pass
+		return 0
+
+
+
 #----------------------------------------------------------------------
 # iparser: 工程分析器，分析各种配置信息
 #----------------------------------------------------------------------
@@ -1934,6 +3472,7 @@ class iparser (object):
 	# 配置复位
 	def reset (self):
 		self.src = []
+		self.globs = []
 		self.inc = []
 		self.lib = []
 		self.imp = []
@@ -1952,6 +3491,8 @@ class iparser (object):
 		self.info = 3
 		self.out = ''
 		self.int = ''
+		self.unity = 0
+		self.pch = ''
 		self.makefile = ''
 		self.incdict = {}
 		self.libdict = {}
@@ -2083,6 +3624,12 @@ class iparser (object):
 	
 	# 分析开始
 	def parse (self, makefile):
+		ts = time.time()
+		retval = self._parse(makefile)
+		TRACE.span('iparser.parse', ts, args = {'makefile': makefile})
+		return retval
+
+	def _parse (self, makefile):
 		self.reset()
 		self.config.init()
 		makefile = os.path.abspath(makefile)
@@ -2250,6 +3797,9 @@ class iparser (object):
 			else:
 				import glob
 				names = glob.glob(srcname)
+				found = [ os.path.abspath(n) for n in names ]
+				found.sort()
+				self.globs.append((os.path.abspath(srcname), found))
 			for srcname in names:
 				absname = os.path.abspath(srcname)
 				if not os.path.exists(absname):
@@ -2393,6 +3943,29 @@ class iparser (object):
 					continue
 				self.push_define(srcname)
 			return 0
+		if command == 'pch':
+			name = self.pathconf(body)
+			if not name:
+				self.pch = ''
+				return 0
+			absname = os.path.abspath(name)
+			if not os.path.exists(absname):
+				self.error('error: %s: No such file'%name, fname, lineno)
+				return -1
+			self.pch = absname
+			return 0
+		if command == 'unity':
+			body = body.strip(' \t\r\n').lower()
+			if body in ('', '0', 'false', 'off', 'no'):
+				self.unity = 0
+			elif body in ('1', 'true', 'on', 'yes'):
+				self.unity = 16
+			else:
+				try: self.unity = int(body)
+				except:
+					self.error('error: %s: bad unity size'%body, fname, lineno)
+					return -1
+			return 0
 		if command == 'info':
 			body = body.strip(' \t\r\n').lower()
 			if body in ('0', 'false', 'off'):
@@ -2535,6 +4108,514 @@ class iparser (object):
 		return 0
 
 
+#----------------------------------------------------------------------
+# depdb: 二进制依赖数据库，路径字符串表 + 每个源文件的依赖行
+# 文件格式：16字节头部 (magic, version, generation, 0)，之后是追加的记录
+#   'P' id len bytes                         路径字符串
+#   'R' srcid count ids[] mtimes[] sizes[]   源文件的依赖行
+# 只有发生变化的行被追加到文件末尾，加载时后面的行覆盖前面的行
+#----------------------------------------------------------------------
+class depdb (object):
+
+	MAGIC = 'EMDB'
+	VERSION = 1
+
+	def __init__ (self, filename):
+		self.name = filename
+		self.reset()
+
+	def reset (self):
+		self.paths = []			# id -> 路径
+		self.index = {}			# 路径 -> id
+		self.rows = {}			# 源文件 -> (names, mtimes, sizes)
+		self.users = None		# 反向索引：路径 -> {源文件: 1}，首次使用时建立
+		self.generation = 0		# 每次写入递增
+		self.records = 0		# 文件中行记录的个数
+		self.offset = 0			# 文件有效数据的结尾
+		self.written = 0		# 已经写入文件的路径个数
+
+	# 路径字符串驻留，返回路径 id
+	def intern (self, path):
+		pid = self.index.get(path, None)
+		if pid is None:
+			pid = len(self.paths)
+			self.paths.append(path)
+			self.index[path] = pid
+		return pid
+
+	# 加载数据库：返回 0 成功，-1 文件不存在，-2 格式错误
+	def load (self):
+		import struct, mmap
+		self.reset()
+		try:
+			fp = open(self.name, 'rb')
+		except IOError:
+			return -1
+		try:
+			size = os.fstat(fp.fileno()).st_size
+			if size < 16:
+				return -2
+			data = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+		finally:
+			fp.close()
+		try:
+			magic, version, generation, reserved = struct.unpack_from('<4sIII', data, 0)
+			if magic != self.MAGIC or version != self.VERSION:
+				return -2
+			self.generation = generation
+			self._parse(data, size)
+		finally:
+			data.close()
+		return 0
+
+	# 顺序解析记录，遇到不完整的记录则停止（上次写入被中断）
+	def _parse (self, data, size):
+		import struct
+		unpack = struct.unpack_from
+		paths, rows = self.paths, self.rows
+		pos = 16
+		while pos + 9 <= size:
+			kind, key, count = unpack('<cII', data, pos)
+			if kind == 'P':
+				if pos + 9 + count > size:
+					break
+				if key != len(paths):
+					break
+				path = data[pos + 9:pos + 9 + count]
+				paths.append(path)
+				self.index[path] = key
+				pos += 9 + count
+			elif kind == 'R':
+				need = 9 + count * 20
+				if pos + need > size:
+					break
+				if key >= len(paths):
+					break
+				p = pos + 9
+				ids = unpack('<%dI'%count, data, p)
+				mtimes = unpack('<%dd'%count, data, p + count * 4)
+				sizes = unpack('<%dq'%count, data, p + count * 12)
+				try:
+					names = [ paths[i] for i in ids ]
+				except IndexError:
+					break
+				rows[paths[key]] = (names, mtimes, sizes)
+				self.records += 1
+				pos += need
+			else:
+				break
+		self.offset = pos
+		self.written = len(paths)
+		return 0
+
+	def _encode_row (self, src, names, mtimes, sizes):
+		import struct
+		count = len(names)
+		ids = [ self.intern(n) for n in names ]
+		head = struct.pack('<cII', 'R', self.intern(src), count)
+		body = struct.pack('<%dI'%count, *ids)
+		body += struct.pack('<%dd'%count, *mtimes)
+		body += struct.pack('<%dq'%count, *sizes)
+		return head + body
+
+	def _encode_paths (self):
+		import struct
+		output = []
+		for pid in xrange(self.written, len(self.paths)):
+			path = self.paths[pid]
+			output.append(struct.pack('<cII', 'P', pid, len(path)) + path)
+		self.written = len(self.paths)
+		return ''.join(output)
+
+	# 更新一行，返回编码后的记录
+	def update (self, src, names, mtimes, sizes):
+		self._unlink(src)
+		self.rows[src] = (names, tuple(mtimes), tuple(sizes))
+		self._link(src)
+		return self._encode_row(src, names, mtimes, sizes)
+
+	# 删除一行
+	def remove (self, src):
+		self._unlink(src)
+		self.rows.pop(src, None)
+
+	def _link (self, src):
+		if self.users is not None and src in self.rows:
+			for name in self.rows[src][0]:
+				self.users.setdefault(name, {})[src] = 1
+
+	def _unlink (self, src):
+		if self.users is not None and src in self.rows:
+			for name in self.rows[src][0]:
+				users = self.users.get(name, None)
+				if users is not None:
+					users.pop(src, None)
+					if not users:
+						del self.users[name]
+
+	# 依赖某个文件（源文件或者头文件）的所有源文件
+	def dependents (self, path):
+		if self.users is None:
+			self.users = {}
+			for src in self.rows:
+				self._link(src)
+		return self.users.get(path, {}).keys()
+
+	# 保存：changed 为发生变化的源文件，只追加这些行；垃圾过多时整体重写
+	def save (self, changed):
+		import struct
+		if not changed and self.offset > 0:
+			return 0
+		live = len(self.rows)
+		if self.offset == 0 or self.records + len(changed) > live * 2 + 64:
+			return self.compact()
+		rows = []
+		for src in changed:
+			if src in self.rows:
+				names, mtimes, sizes = self.rows[src]
+				rows.append(self._encode_row(src, names, mtimes, sizes))
+		text = self._encode_paths() + ''.join(rows)
+		self.generation += 1
+		fp = open(self.name, 'r+b')
+		fp.seek(self.offset)
+		fp.write(text)
+		fp.truncate()
+		fp.seek(0)
+		fp.write(struct.pack('<4sIII', self.MAGIC, self.VERSION, self.generation, 0))
+		fp.close()
+		self.offset += len(text)
+		self.records += len(rows)
+		return 0
+
+	# 整体重写，只保留现存的行和用到的路径
+	def compact (self):
+		import struct
+		rows = self.rows
+		self.paths, self.index, self.written = [], {}, 0
+		names = rows.keys()
+		names.sort()
+		body = [ self._encode_row(src, rows[src][0], rows[src][1], rows[src][2]) for src in names ]
+		text = self._encode_paths() + ''.join(body)
+		self.generation += 1
+		head = struct.pack('<4sIII', self.MAGIC, self.VERSION, self.generation, 0)
+		temp = self.name + '.tmp'
+		fp = open(temp, 'wb')
+		fp.write(head + text)
+		fp.close()
+		if os.path.exists(self.name):
+			os.remove(self.name)
+		os.rename(temp, self.name)
+		self.offset = len(head) + len(text)
+		self.records = len(body)
+		return 0
+
+
+#----------------------------------------------------------------------
+# timedb: 每个源文件的历史编译耗时，格式为每行 "秒数 源文件"
+#----------------------------------------------------------------------
+class timedb (object):
+
+	def __init__ (self, filename):
+		self.name = filename
+		self.times = {}
+		self.dirty = False
+
+	def load (self):
+		self.times = {}
+		self.dirty = False
+		try:
+			fp = open(self.name, 'r')
+		except IOError:
+			return -1
+		for line in fp:
+			line = line.rstrip('\r\n')
+			pos = line.find(' ')
+			if pos < 0: continue
+			try: self.times[line[pos + 1:]] = float(line[:pos])
+			except ValueError: continue
+		fp.close()
+		return 0
+
+	# 合并新的耗时（只有编译成功的），用滑动平均平滑单次编译的波动
+	def update (self, times):
+		for name, value in times.items():
+			if name in self.times:
+				value = self.times[name] * 0.5 + value * 0.5
+			self.times[name] = value
+			self.dirty = True
+		return 0
+
+	# 去掉已经不在工程中的源文件
+	def prune (self, names):
+		for name in self.times.keys():
+			if not name in names:
+				del self.times[name]
+				self.dirty = True
+		return 0
+
+	def save (self):
+		if not self.dirty:
+			return 0
+		names = self.times.keys()
+		names.sort()
+		try:
+			fp = open(self.name + '.tmp', 'w')
+			for name in names:
+				fp.write('%.4f %s\n'%(self.times[name], name))
+			fp.close()
+			if os.path.exists(self.name):
+				os.remove(self.name)
+			os.rename(self.name + '.tmp', self.name)
+		except (IOError, OSError):
+			return -1
+		self.dirty = False
+		return 0
+
+
+#----------------------------------------------------------------------
+# unity: 合并编译，把多个源文件合并成一个编译单元以减少进程启动及
+# 头文件重复分析的开销，生成的文件为 <int>/<name>.unityN.c(pp)
+#----------------------------------------------------------------------
+class unity (object):
+
+	def __init__ (self, name, intermediate, limit = 16):
+		self.name = name
+		self.int = os.path.abspath(intermediate)
+		self.limit = max(2, limit)
+		self.batches = {}		# 合并文件 -> [源文件]
+
+	# 合并分组：语言和编译参数都相同的源文件才能合并
+	def group (self, srcname, options):
+		extname = os.path.splitext(srcname)[-1].lower()
+		if extname == '.c':
+			return ('.c', options)
+		if extname in ('.cpp', '.cc', '.cxx'):
+			return ('.cpp', options)
+		return None
+
+	# 读取已经生成的合并文件
+	def _load (self):
+		import glob
+		batches = {}
+		pattern = os.path.join(self.int, self.name + '.unity*')
+		for fn in glob.glob(pattern):
+			if not os.path.splitext(fn)[-1] in ('.c', '.cpp'):
+				continue
+			members = []
+			try:
+				for line in open(fn, 'r'):
+					if line[:10] == '#include "':
+						members.append(os.path.abspath(line[10:].rstrip('"\r\n')))
+			except IOError:
+				continue
+			batches[os.path.abspath(fn)] = members
+		return batches
+
+	def _newname (self, extname):
+		stems = {}
+		for name in self.batches:
+			stems[os.path.splitext(name)[0]] = 1
+		index = 1
+		while True:
+			stem = os.path.join(self.int, '%s.unity%d'%(self.name, index))
+			if not stem in stems:
+				return stem + extname
+			index += 1
+
+	def _push (self, extname, batch):
+		if len(batch) >= 2:
+			self.batches[self._newname(extname)] = batch
+		return 0
+
+	# 划分合并单元：仍然有效的旧单元保持不变，避免增量编译时重编，
+	# 剩余的源文件按顺序装箱，每个单元的估算耗时不超过总耗时 / cpus
+	def plan (self, sources, optdict, costs, cpus = 1):
+		groups = {}
+		order = []
+		candidate = {}
+		for srcname in sources:
+			key = self.group(srcname, optdict.get(srcname, ''))
+			if key is None:
+				continue
+			if not key in groups:
+				groups[key] = []
+				order.append(key)
+			groups[key].append(srcname)
+			candidate[srcname] = key
+		self.batches = {}
+		used = {}
+		for name, members in self._load().items():
+			keys = [ candidate.get(n, None) for n in members ]
+			valid = len(members) >= 2 and keys[0] is not None
+			valid = valid and keys.count(keys[0]) == len(keys)
+			valid = valid and keys[0][0] == os.path.splitext(name)[-1]
+			valid = valid and len(members) <= self.limit
+			for n in members:
+				if n in used:
+					valid = False
+			if valid:
+				self.batches[name] = members
+				for n in members:
+					used[n] = name
+		total = sum([ costs.get(n, 0) for n in candidate ])
+		budget = total / max(1, cpus)
+		for key in order:
+			batch, cost = [], 0
+			for srcname in groups[key]:
+				if srcname in used:
+					continue
+				weight = costs.get(srcname, 0)
+				if batch and (len(batch) >= self.limit or cost + weight > budget):
+					self._push(key[0], batch)
+					batch, cost = [], 0
+				batch.append(srcname)
+				cost += weight
+			self._push(key[0], batch)
+		return self.batches
+
+	# 写入合并文件，内容没有变化时不改写以保留时间戳，变化时删除
+	# 对应的目标文件，过期的合并文件及目标文件一并删除
+	def write (self):
+		for name, members in self._load().items():
+			if not name in self.batches:
+				for fn in (name, self.objname(name)):
+					try: os.remove(fn)
+					except OSError: pass
+					STAT.invalidate(fn)
+		if self.batches and not os.path.exists(self.int):
+			os.makedirs(self.int)
+		for name, members in self.batches.items():
+			lines = ['/* generated by emake (unity build), do not edit */\n']
+			for srcname in members:
+				lines.append('#include "%s"\n'%srcname.replace('\\', '/'))
+			text = ''.join(lines)
+			try:
+				fp = open(name, 'r')
+				data = fp.read()
+				fp.close()
+			except IOError:
+				data = None
+			if data == text:
+				continue
+			fp = open(name, 'w')
+			fp.write(text)
+			fp.close()
+			STAT.invalidate(name)
+			try: os.remove(self.objname(name))
+			except OSError: pass
+			STAT.invalidate(self.objname(name))
+		return 0
+
+	def objname (self, name):
+		return os.path.splitext(name)[0] + '.o'
+
+
+#----------------------------------------------------------------------
+# compdb: compile_commands.json，每行一个条目并按文件名排序，更新时
+# 和旧文件逐行归并，只替换本工程的条目，内容不变时不改写文件
+#----------------------------------------------------------------------
+class compdb (object):
+
+	def __init__ (self, filename):
+		self.name = os.path.abspath(filename)
+		self.count = 0
+
+	@staticmethod
+	def format (directory, filename, output, command):
+		import json
+		items = (('directory', directory), ('command', command), 
+				('file', filename), ('output', output))
+		text = ', '.join([ '"%s": %s'%(k, json.dumps(v)) for k, v in items ])
+		return '{' + text + '}'
+
+	# 读取旧文件，返回按文件名排序的 (file, line)，不是每行一个条目
+	# 的格式(比如 cmake 生成的)时整体读入后转换
+	def _load (self):
+		import json
+		try:
+			fp = open(self.name, 'r')
+		except IOError:
+			return
+		head = fp.readline()
+		line = fp.readline()
+		if head.strip() != '[' or line.strip()[-2:] not in ('},', '}'):
+			fp.seek(0)
+			try:
+				items = json.load(fp)
+			except ValueError:
+				items = []
+			fp.close()
+			entries = []
+			for item in items:
+				try:
+					home = item['directory']
+					name = os.path.abspath(os.path.join(home, item['file']))
+					command = item.get('command', None)
+					if command is None:
+						command = ' '.join(item['arguments'])
+					output = item.get('output', '')
+				except (KeyError, TypeError):
+					continue
+				entries.append((name, self.format(home, name, output, command)))
+			entries.sort()
+			for entry in entries:
+				yield entry
+			return
+		while line:
+			text = line.strip().rstrip(',')
+			line = fp.readline()
+			if text in ('', '[', ']'):
+				continue
+			try:
+				name = json.loads(text)['file']
+			except (ValueError, KeyError, TypeError):
+				continue
+			yield (name, text)
+		fp.close()
+
+	# 合并写入：entries 为按文件名排序的 (file, line)，替换同名条目，
+	# 删除已经不存在的文件，返回是否改写了文件
+	def update (self, entries):
+		tmpname = self.name + '.tmp'
+		fp = open(tmpname, 'w')
+		fp.write('[')
+		state = { 'count': 0, 'changed': not os.path.exists(self.name) }
+		def write(text):
+			fp.write((state['count'] > 0) and ',\n' or '\n')
+			fp.write(text)
+			state['count'] += 1
+		old = self._load()
+		new = iter(entries)
+		item_old = next(old, None)
+		item_new = next(new, None)
+		while item_old is not None or item_new is not None:
+			if item_old is None or (item_new is not None and item_new[0] <= item_old[0]):
+				if item_old is not None and item_old[0] == item_new[0]:
+					if item_old[1] != item_new[1]:
+						state['changed'] = True
+					item_old = next(old, None)
+				else:
+					state['changed'] = True
+				write(item_new[1])
+				item_new = next(new, None)
+			else:
+				if os.path.exists(item_old[0]):
+					write(item_old[1])
+				else:
+					state['changed'] = True
+				item_old = next(old, None)
+		fp.write('\n]\n')
+		fp.close()
+		self.count = state['count']
+		if not state['changed']:
+			os.remove(tmpname)
+			return False
+		if os.path.exists(self.name):
+			os.remove(self.name)
+		os.rename(tmpname, self.name)
+		return True
+
+
 #----------------------------------------------------------------------
 # dependence: 工程编译，Compile/Link/Build
 #----------------------------------------------------------------------
@@ -2546,37 +4627,80 @@ class dependence (object):
 		self.reset()
 	
 	def reset (self):
-		self._mtime = {}
+		self.preprocessor.reset()
 		self._dirty = {}
 		self._depinfo = {}
+		self._depsize = {}
+		self._changed = {}
+		self._scanned = {}
+		self._checked = {}
 		self._depname = ''
+		self._dbname = ''
+		self._db = None
 		self._outchg = False
 	
 	def mtime (self, fname):
-		fname = os.path.abspath(fname)
-		if fname in self._mtime:
-			return self._mtime[fname]
-		try: mtime = os.path.getmtime(fname)
-		except: mtime = 0.0
-		mtime = float('%.6f'%mtime)
-		self._mtime[fname] = mtime
-		return mtime
+		return STAT.mtime(fname)
+
+	def size (self, fname):
+		return STAT.size(fname)
 	
 	def _scan_src (self, srcname):
 		srcname = os.path.abspath(srcname)
 		if not srcname in self.parser:
 			return None
-		if not os.path.exists(srcname):
+		if not STAT.exists(srcname):
 			return None
 		objname = self.parser[srcname]
-		head, lost, src = self.preprocessor.dependence(srcname)
+		if srcname in self._scanned:
+			head = self._scanned.pop(srcname)
+		else:
+			head = self.preprocessor.closure(srcname)
 		filelist = [srcname] + head
+		for fn in self._extra(srcname):
+			filelist += [fn] + self.preprocessor.closure(fn)
 		dependence = []
 		for fn in filelist:
 			name = os.path.abspath(fn)
 			dependence.append((name, self.mtime(name)))
 		return dependence
 	
+	# 源文件之外隐含的依赖：预编译头文件
+	def _extra (self, srcname):
+		pch = self.parser.pch
+		if pch and self.parser.config.pch_lang(srcname):
+			return [ pch ]
+		return []
+
+	# 检查源文件记录的依赖是否需要重新扫描
+	def _outdated (self, srcname):
+		if srcname in self._checked:
+			return self._checked[srcname]
+		self._checked[srcname] = update = self._check_outdated(srcname)
+		return update
+
+	def _check_outdated (self, srcname):
+		info = self._depinfo.setdefault(srcname, {})
+		sizes = self._depsize.get(srcname, {})
+		if len(info) == 0: 
+			return True
+		for fn in self._extra(srcname):
+			if not fn in info:
+				return True
+		for fn in info:
+			oldtime = info[fn]
+			st = STAT.stat(fn)
+			if st is None:
+				return True
+			newtime = st[0]
+			if newtime > oldtime:
+				#print '%f %f %f'%(newtime, oldtime, newtime - oldtime)
+				return True
+			oldsize = sizes.get(fn, -1)
+			if oldsize >= 0 and oldsize != st[1]:
+				return True
+		return False
+
 	def _update_dep (self, srcname):
 		srcname = os.path.abspath(srcname)
 		if not srcname in self.parser:
@@ -2587,87 +4711,196 @@ class dependence (object):
 		objname = self.parser[srcname]
 		srctime = self.mtime(srcname)
 		objtime = self.mtime(objname)
-		update = False
-		info = self._depinfo.setdefault(srcname, {})
-		if len(info) == 0: 
-			update = True
-		if not update:
-			for fn in info:
-				if not os.path.exists(fn):
-					update = True
-					break
-				oldtime = info[fn]
-				newtime = self.mtime(fn)
-				if newtime > oldtime:
-					update = True
-					#print '%f %f %f'%(newtime, oldtime, newtime - oldtime)
-					break
+		update = self._outdated(srcname)
 		if update:
 			dependence = self._scan_src(srcname)
 			info = {}
+			sizes = {}
 			self._depinfo[srcname] = info
+			self._depsize[srcname] = sizes
+			self._changed[srcname] = 1
 			if not dependence:
 				return -2
 			for fname, mtime in dependence:
 				info[fname] = mtime
+				sizes[fname] = self.size(fname)
 		info = self._depinfo[srcname]
-		for fn in info:
-			oldtime = info[fn]
-			if oldtime > objtime:
-				self._dirty[srcname] = 1
-				retval = 1
-				break
+		if info and max(info.itervalues()) > objtime:
+			self._dirty[srcname] = 1
+			retval = 1
 		if debug: print '</dep:%s>\n'%srcname
 		return retval
+
+	# 读取旧版本的 .p 文本依赖文件，用于迁移到 .pdb
+	def _load_text (self):
+		if not os.path.exists(self._depname):
+			return -1
+		for line in open(self._depname, 'U'):
+			line = line.strip(' \t\r\n')
+			if not line: continue
+			pos = line.find('=')
+			if pos < 0: continue
+			src, body = line[:pos], line[pos + 1:]
+			src = os.path.abspath(self.parser.pathconf(src))
+			if not os.path.exists(src): continue
+			item = body.replace(';', ',').split(',')
+			count = len(item) / 2
+			info = {}
+			self._depinfo[src] = info
+			self._changed[src] = 1
+			for i in xrange(count):
+				fname = item[i * 2 + 0].strip(' \r\n\t')
+				mtime = item[i * 2 + 1].strip(' \r\n\t')
+				fname = self.parser.pathconf(fname)
+				info[fname] = float(mtime)
+		return 0
 	
-	def _load_dep (self):
-		lineno = -1
+	# 用线程池并行执行 func(item)，用于批量 stat
+	def _parallel (self, func, items, cpus):
+		import threading
+		items = [ n for n in items ]
+		lock = threading.Lock()
+		def working():
+			while True:
+				lock.acquire()
+				item = items and items.pop() or None
+				lock.release()
+				if item is None:
+					break
+				func(item)
+		threads = [ threading.Thread(target = working) for i in xrange(cpus) ]
+		for th in threads:
+			th.start()
+		for th in threads:
+			th.join()
+		return 0
+
+	# 并行 stat 所有源文件、目标文件和已记录的依赖文件
+	def _prefetch (self, cpus):
+		names = {}
+		for src in self.parser:
+			names[src] = 1
+			names[self.parser[src]] = 1
+			for fn in self._depinfo.get(src, {}):
+				names[fn] = 1
+		names = [ n for n in names if not STAT.cached(n) ]
+		if len(names) >= 64:
+			self._parallel(self.mtime, names, cpus)
+		return 0
+
+	# 并行扫描需要更新的源文件，每个进程处理一段连续的源文件，
+	# 进程内共享头文件的引用关系缓存
+	def _prescan (self, cpus):
+		todo = [ src for src in self.parser if self._outdated(src) ]
+		todo = [ src for src in todo if STAT.exists(src) ]
+		try:
+			import multiprocessing
+			cpus = min(cpus, multiprocessing.cpu_count())
+		except:
+			return -1
+		if len(todo) < 64 or cpus <= 1:
+			return 0
+		todo.sort()
+		size = (len(todo) + cpus - 1) / cpus
+		chunks = [ todo[i:i + size] for i in xrange(0, len(todo), size) ]
+		try:
+			pool = multiprocessing.Pool(len(chunks))
+			try:
+				results = pool.map(_dependence_scan, chunks)
+			finally:
+				pool.close()
+				pool.join()
+		except Exception:
+			return -1
+		names = {}
+		for result in results:
+			for src, head in result:
+				self._scanned[src] = head
+				for fn in head:
+					names[fn] = 1
+		names = [ n for n in names if not STAT.cached(n) ]
+		if len(names) >= 64:
+			self._parallel(self.mtime, names, cpus)
+		return 0
+
+	# 每个依赖文件只 stat 一次，和记录的状态比较得到变化的文件，再通过
+	# 反向索引找到受影响的源文件，其余源文件不再逐个检查依赖
+	def _precheck (self):
+		recorded = {}
+		for src in self._depinfo:
+			names, mtimes, sizes = self._db.rows[src]
+			recorded.update(zip(names, zip(mtimes, sizes)))
+		changed = []
+		for name, (mtime, size) in recorded.iteritems():
+			st = STAT.stat(name)
+			if st is None or st[0] > mtime:
+				changed.append(name)
+			elif size >= 0 and size != st[1]:
+				changed.append(name)
+		affected = {}
+		if changed:
+			for src in self.affected(changed):
+				affected[src] = 1
+		for src in self.parser:
+			info = self._depinfo.get(src, None)
+			if not info or src in affected:
+				continue
+			if not [ n for n in self._extra(src) if not n in info ]:
+				self._checked[src] = False
+		return len(changed)
+
+	def _load_dep (self, cpus = 0):
 		retval = 0
-		if os.path.exists(self._depname):
-			for line in open(self._depname, 'U'):
-				line = line.strip(' \t\r\n')
-				if not line: continue
-				pos = line.find('=')
-				if pos < 0: continue
-				src, body = line[:pos], line[pos + 1:]
-				src = os.path.abspath(src)
-				if not os.path.exists(src): continue
-				item = body.replace(';', ',').split(',')
-				count = len(item) / 2
-				info = {}
-				self._depinfo[src] = info
-				for i in xrange(count):
-					fname = item[i * 2 + 0].strip(' \r\n\t')
-					mtime = item[i * 2 + 1].strip(' \r\n\t')
-					fname = self.parser.pathconf(fname)
-					info[fname] = float(mtime)
-			retval = 0
+		self._db = depdb(self._dbname)
+		fast = False
+		if self._db.load() != 0:
+			self._load_text()		# 没有数据库或者从 .p 导入：逐个检查
+		else:
+			for src, row in self._db.rows.iteritems():
+				if not STAT.exists(src): continue
+				names, mtimes, sizes = row
+				self._depinfo[src] = dict(zip(names, mtimes))
+				self._depsize[src] = dict(zip(names, sizes))
+			fast = True
+		if cpus > 1:
+			self._prefetch(cpus)
+		if fast:
+			self._precheck()
+		if cpus > 1:
+			self._prescan(cpus)
 		for fn in self.parser:
 			self._update_dep(fn)
+		self._scanned = {}
+		self._checked = {}
 		return retval
 
 	def _save_dep (self):
-		path = os.path.split(self._depname)[0]
+		path = os.path.split(self._dbname)[0]
 		if not os.path.exists(path):
 			self.parser.coremake.mkdir(path)
-		fp = open(self._depname, 'w')
-		names = self._depinfo.keys()
-		names.sort()
-		for src in names:
-			info = self._depinfo[src]
-			fp.write('%s = '%(src))
-			part = []
-			keys = info.keys()
-			keys.sort()
-			for fname in keys:
-				mtime = info[fname]
-				if ' ' in fname: fname = '"%s"'%fname
-				part.append('%s, %.6f'%(fname, mtime))
-			fp.write(', '.join(part) + '\n')
-		fp.close()
+		db = self._db
+		for src in db.rows.keys():
+			if not src in self._depinfo:
+				db.remove(src)
+		changed = []
+		for src in self._changed:
+			info = self._depinfo.get(src, None)
+			if not info:
+				db.remove(src)
+				continue
+			sizes = self._depsize.get(src, {})
+			names = info.keys()
+			names.sort()
+			mtimes = [ info[n] for n in names ]
+			size = [ sizes.get(n, -1) for n in names ]
+			db.update(src, names, mtimes, size)
+			changed.append(src)
+		changed.sort()
+		db.save(changed)
+		self._changed = {}
 		return 0
 	
-	def process (self):
+	def process (self, cpus = 0):
 		self.reset()
 		parser = self.parser
 		depname = parser.name + '.p'
@@ -2675,13 +4908,92 @@ class dependence (object):
 		if parser.int:
 			self._depname = os.path.join(parser.int, depname)
 		self._depname = os.path.abspath(self._depname)
-		self._load_dep()
+		self._dbname = os.path.splitext(self._depname)[0] + '.pdb'
+		ts = time.time()
+		self._load_dep(cpus)
+		TRACE.span('dependence.scan', ts, args = {'sources': len(parser)})
+		ts = time.time()
 		self._save_dep()
+		TRACE.span('dependence.save', ts)
 		for info in self._depinfo:
 			dirty = (info in self._dirty) and 1 or 0
 			#print info, '=', dirty
 		return 0
 
+	# 增量更新：保留内存中的依赖信息，只重新检查状态已失效的文件，
+	# 用于常驻模式，调用前需要对变化的文件调用 STAT.invalidate；
+	# 给出 changed 时通过反向索引只检查受影响的源文件，其余源文件
+	# 保持原来的状态
+	def update (self, changed = None):
+		ts = time.time()
+		self.preprocessor.reset()
+		self._checked = {}
+		if changed is None:
+			self._dirty = {}
+			names = [ n for n in self.parser ]
+		else:
+			names = self.affected(changed)
+			for fn in names:
+				self._dirty.pop(fn, None)
+		for fn in names:
+			self._update_dep(fn)
+		self._checked = {}
+		self._save_dep()
+		TRACE.span('dependence.update', ts, args = {'sources': len(names)})
+		return 0
+
+	# 受一组变化的文件影响的源文件，用反向索引查找，
+	# 耗时只和受影响的源文件数量有关
+	def affected (self, changed):
+		names = {}
+		for fn in changed:
+			fn = os.path.abspath(fn)
+			if fn in self.parser:
+				names[fn] = 1
+			for src in self._db.dependents(fn):
+				if src in self.parser:
+					names[src] = 1
+		names = names.keys()
+		names.sort()
+		return names
+
+	# 解释源文件需要重新编译的原因，返回描述的列表
+	def _reason (self, srcname):
+		srcname = os.path.abspath(srcname)
+		if not srcname in self._dirty:
+			return []
+		objname = self.parser[srcname]
+		if not STAT.exists(objname):
+			return [ 'object %s does not exist'%objname ]
+		objtime = self.mtime(objname)
+		info = self._depinfo.get(srcname, {})
+		newer = [ (info[fn], fn) for fn in info if info[fn] > objtime ]
+		newer.sort()
+		newer.reverse()
+		reasons = []
+		for mtime, fn in newer:
+			kind = (fn == srcname) and 'source' or 'dependency'
+			reasons.append('%s %s is newer than %s (+%.3fs)'%(kind, fn, \
+				objname, mtime - objtime))
+		if not reasons:
+			reasons.append('dependencies of %s changed'%objname)
+		return reasons
+
+	# 返回所有依赖的文件
+	def files (self):
+		names = {}
+		for src in self.parser:
+			names[src] = 1
+			for fn in self._depinfo.get(src, {}):
+				names[fn] = 1
+		return names.keys()
+
+
+# 并行扫描的工作进程：返回 [(源文件, 头文件列表)]
+def _dependence_scan(names):
+	pst = preprocessor()
+	return [ (src, pst.closure(src)) for src in names ]
+
 
 #----------------------------------------------------------------------
 # emake: 工程编译，Compile/Link/Build
@@ -2697,15 +5009,24 @@ class emake (object):
 		self.unix = self.coremake.unix
 		self.cpus = -1
 		self.loaded = 0
+		self.makefile = ''
+		self.opened = 0
+		self._unity_objs = {}
+		self._pch_units = {}
 	
 	def reset (self):
 		self.parser.reset()
 		self.coremake.reset()
 		self.dependence.reset()
+		self._unity_objs = {}
+		self._pch_units = {}
 		self.loaded = 0
 	
 	def open (self, makefile):
 		self.reset()
+		STAT.invalidate()
+		self.makefile = os.path.abspath(makefile)
+		self.opened = time.time()
 		self.config.init()
 		environ = {}
 		cfg = self.config.config
@@ -2718,24 +5039,146 @@ class emake (object):
 		parser = self.parser
 		self.coremake.init(makefile, parser.out, parser.mode, parser.int)
 		#print 'open', parser.out, parser.mode, parser.int
+		cpus = self.config.cpus
+		if self.cpus >= 0:
+			cpus = self.cpus
+		units = self._unity(cpus)
 		for src in self.parser:
 			obj = self.parser[src]
 			opt = self.parser.optdict[src]
+			if obj in units:
+				if units[obj] in self.coremake._unity:
+					continue
+				src = units[obj]
+				self.coremake._unity[src] = []
 			self.coremake.push(src, obj, opt)
+		for src in self.parser:
+			obj = self.parser[src]
+			if obj in units:
+				member = (src, self._unity_objs[src], self.parser.optdict[src])
+				self.coremake._unity[units[obj]].append(member)
 		savedir = os.getcwd()
 		os.chdir(os.path.dirname(os.path.abspath(makefile)))
 		hr = self._config()
 		os.chdir(savedir)
 		if hr != 0:
 			return -2
+		self._pch()
 		self.coremake._environ = {}
 		for k, v in environ.items():
 			self.coremake._environ[k] = v
 		for k, v in self.parser.environ.items():
 			self.coremake._environ[k] = v
-		self.dependence.process()
+		cpus = self.config.cpus
+		if self.cpus >= 0:
+			cpus = self.cpus
+		self.dependence.process(cpus)
 		self.loaded = 1
 		return 0
+
+	# 合并编译：划分合并单元并把成员源文件的目标文件指向合并单元的
+	# 目标文件，返回 {合并单元目标文件: 合并单元源文件}
+	def _unity (self, cpus):
+		self._unity_objs = {}
+		limit = CFG.get('unity', None)
+		if limit is None:
+			limit = self.parser.unity
+		if limit <= 1:
+			return {}
+		parser = self.parser
+		self.coremake._timing = self._timedb().times
+		costs = self.coremake._estimate(parser.src)
+		build = unity(parser.name, parser.int or parser.home, limit)
+		batches = build.plan(parser.src, parser.optdict, costs, cpus)
+		build.write()
+		units = {}
+		for name, members in batches.items():
+			objname = build.objname(name)
+			units[objname] = name
+			for src in members:
+				self._unity_objs[src] = parser[src]
+				parser.srcdict[src] = objname
+		return units
+
+	# 预编译头：按语言及编译参数分组，每组对应 <int>/pch/<hash>/ 下的
+	# 一个桩头文件及其 .gch，编译时用 -include 自动引入
+	def _pch (self):
+		self._pch_units = {}
+		if not self.parser.pch:
+			return 0
+		core = self.coremake
+		for i in xrange(len(core._src)):
+			core._opt[i] = self._pch_option(core._src[i], core._opt[i])
+		for name, members in core._unity.items():
+			members = [ (m[0], m[1], self._pch_option(m[0], m[2])) for m in members ]
+			core._unity[name] = members
+		return 0
+
+	def _pch_option (self, srcname, options):
+		import hashlib
+		lang = self.config.pch_lang(srcname)
+		if lang is None:
+			return options
+		cond = ' '.join(self.config.compile_cond(srcname))
+		gcc = self.config.getname('gcc')
+		text = '\n'.join((self.parser.pch, lang, gcc, self.config.param_compile, cond, options))
+		key = hashlib.md5(text).hexdigest()[:16]
+		home = os.path.join(self.parser.int or self.parser.home, 'pch', key)
+		stub = os.path.abspath(os.path.join(home, os.path.basename(self.parser.pch)))
+		self._pch_units[stub] = (lang, cond, options)
+		stub = self.config.pathtext(stub)
+		return ('%s -include %s -Winvalid-pch'%(options, stub)).strip()
+
+	# 生成预编译头，头文件及其引用的文件或者编译器更新后重新生成
+	def _pch_build (self, printmode = 0):
+		if not self._pch_units:
+			return 0
+		header = self.parser.pch
+		names = [ header ] + self.dependence.preprocessor.closure(header)
+		names.append(self.config.getname('gcc'))
+		mtime = max([ STAT.mtime(n) for n in names ])
+		printcmd = (printmode & 4) and True or False
+		text = '#include "%s"\n'%header.replace('\\', '/')
+		diag = diagnostics(CFG.get('diag', 'text'))
+		try:
+			for stub, (lang, cond, options) in self._pch_units.items():
+				gch = stub + '.gch'
+				if not STAT.exists(stub):
+					self.coremake.mkdir(os.path.dirname(stub))
+					fp = open(stub, 'w')
+					fp.write(text)
+					fp.close()
+					STAT.invalidate(stub)
+				if STAT.exists(gch) and STAT.mtime(gch) >= mtime:
+					continue
+				self.coremake.remove(gch)
+				ts = time.time()
+				param = '-x %s %s -o %s %s %s'%(lang, self.config.pathrel(stub), \
+						self.config.pathrel(gch), options, cond)
+				output = self.config.gcc(param, False, printcmd, True)
+				TRACE.span('pch', ts, args = {'header': header, 'lang': lang})
+				ts = time.time() - ts
+				name = ''
+				if printmode & 1:
+					name = self.coremake._task_name(header, ts, printmode)
+				STAT.invalidate(gch)
+				failed = not STAT.exists(gch)
+				diag.begin(gch, name, True)
+				diag.feed(gch, output)
+				diag.end(gch, name, ts, failed)
+				if failed:
+					return -1
+		finally:
+			diag.close()
+		return 0
+
+	# 历史编译耗时，和依赖文件保存在同一目录
+	def _timedb (self):
+		parser = self.parser
+		name = os.path.join(parser.int or parser.home, parser.name + '.time')
+		timing = timedb(os.path.abspath(name))
+		timing.load()
+		return timing
 	
 	def _config (self):
 		self.config.replace['makefile'] = self.coremake._main
@@ -2780,42 +5223,202 @@ class emake (object):
 	def compile (self, printmode = 0):
 		if not self.loaded:
 			return 1
+		self._jobserver()
+		if self._compdb_name():
+			self.compdb()
 		dirty = 0
-		for src in self.parser:
-			if src in self.dependence._dirty:
-				obj = self.parser[src]
-				if obj != src:
-					self.coremake.remove(obj)
-					dirty += 1
+		for src in self.dependence._dirty:
+			obj = self.parser[src]
+			if obj != src:
+				self.coremake.remove(obj)
+				dirty += 1
 		if dirty:
-			self.coremake.remove(self.parser.out)
-			self.coremake.event(self.parser.events.get('prebuild', []))
+			if self.parser.mode != 'lib':	# 静态库留给链接时增量更新
+				self.coremake.remove(self.parser.out)
+			self.coremake.event(self.parser.events.get('prebuild', []), 'prebuild')
+		if self._pch_build(printmode) != 0:
+			return 2
 		cpus = self.config.cpus
 		if self.cpus >= 0:
 			cpus = self.cpus
+		cache = self._cache()
+		keys = {}
+		if cache:
+			keys = self._cache_fetch(cache)
+		timing = self._timedb()
+		self.coremake._timing = timing.times
+		self.coremake._remote = self._remote()
 		retval = self.coremake.compile(True, printmode, cpus)
+		if self.coremake._remote:
+			self.coremake._remote.close()
+			self.coremake._remote = None
+		timing.update(self._unity_times(self.coremake._task_times))
+		timing.prune(self.parser)
+		timing.save()
+		if cache:
+			for src in keys:
+				if src in self.coremake._task_times:
+					cache.store(keys[src][0], keys[src][1])
+			if cache.stored:
+				cache.evict()
+			cache.save()
 		if retval != 0:
 			return 2
 		return 0
+
+	# jobserver：在 make -j 下使用上层的令牌，否则创建 jobserver 使编译
+	# 事件中嵌套的 make/emake 和本进程共享 cpus 个并发任务
+	def _jobserver (self):
+		if JOBS.active or (not CFG.get('jobserver', True)):
+			return 0
+		if not JOBS.attach():
+			cpus = self.config.cpus
+			if self.cpus >= 0:
+				cpus = self.cpus
+			JOBS.create(max(1, cpus))
+		return 0
+
+	# 分布式编译：--workers 参数或者配置中的 workers，逗号分隔的地址，
+	# loopback 为本进程内的 worker
+	def _remote (self):
+		text = CFG.get('workers', None)
+		if text is None:
+			text = self.config._getitem('default', 'workers', '')
+		hosts = [ n.strip() for n in text.replace(';', ',').split(',') ]
+		hosts = [ n for n in hosts if n ]
+		if not hosts:
+			return None
+		return remote(self.config, hosts)
+
+	# 导出 compile_commands.json，合并编译单元展开为各个成员源文件
+	def compdb (self, filename = ''):
+		if not self.loaded:
+			return 1
+		if not filename:
+			filename = self._compdb_name()
+		if not filename:
+			filename = os.path.join(self.parser.home, 'compile_commands.json')
+		core = self.coremake
+		tasks = []
+		for src, obj, opt in zip(core._src, core._obj, core._opt):
+			if src in core._unity:
+				tasks.extend(core._unity[src])
+			elif src != obj:
+				tasks.append((src, obj, opt))
+		tasks.sort()
+		directory = os.getcwd()
+		def entries():
+			for src, obj, opt in tasks:
+				cmd = self.config.compile_cmdline(src, obj, opt).strip()
+				yield (src, compdb.format(directory, src, obj, cmd))
+		ts = time.time()
+		db = compdb(filename)
+		try:
+			db.update(entries())
+		except (IOError, OSError), e:
+			sys.stderr.write('error: %s: %s\n'%(filename, e))
+			sys.stderr.flush()
+			return 4
+		TRACE.span('compdb', ts, args = {'entries': db.count})
+		return 0
+
+	# --compdb 参数或者配置中的 compdb，相对路径以工程文件所在目录为准
+	def _compdb_name (self):
+		name = CFG.get('compdb', None)
+		if name is None:
+			name = self.config._getitem('default', 'compdb', '')
+			name = name.strip('\r\n\t ')
+			if name and not os.path.isabs(name):
+				name = os.path.join(self.parser.home, name)
+		if name.lower() in ('0', 'off', 'no', 'false'):
+			return ''
+		return name and os.path.abspath(name) or ''
+
+	# 合并单元的耗时按文件大小分摊到各个成员源文件上
+	def _unity_times (self, times):
+		result = {}
+		for name, members in self.coremake._unity.items():
+			if not name in times:
+				continue
+			sizes = [ max(1, STAT.size(m[0])) for m in members ]
+			total = float(sum(sizes))
+			for member, size in zip(members, sizes):
+				result[member[0]] = times[name] * size / total
+		for name, value in times.items():
+			if not name in self.coremake._unity:
+				result[name] = value
+		return result
+
+	# 取得目标文件缓存：--cache 参数或者配置中的 cache 目录
+	def _cache (self):
+		path = CFG.get('cache', None)
+		if path is None:
+			path = self.config._getitem('default', 'cache', '')
+		path = path.strip('\r\n\t ')
+		if (not path) or path.lower() in ('0', 'off', 'no', 'false'):
+			return None
+		limit = self.config._getitem('default', 'cache_size', '1024')
+		try: limit = int(limit) * 1024 * 1024
+		except: limit = 0
+		return objcache(path, limit)
+
+	# 为缺少目标文件的源文件查询缓存，返回未命中的 {源文件: (缓存键, 目标文件)}
+	def _cache_fetch (self, cache):
+		keys = {}
+		gcc = self.config.getname('gcc')
+		try:
+			st = os.stat(gcc)
+			gcc = '%s:%d:%d'%(gcc, st.st_size, st.st_mtime)
+		except:
+			pass
+		tasks = zip(self.coremake._src, self.coremake._obj, self.coremake._opt)
+		for src, obj, opt in tasks:
+			if obj == src or STAT.exists(obj):
+				continue
+			if src in self.coremake._unity:
+				names = [ src ]
+				for member in self.coremake._unity[src]:
+					info = self.dependence._depinfo.get(member[0], None)
+					if not info:
+						names = None
+						break
+					names.extend(info.keys())
+			else:
+				info = self.dependence._depinfo.get(src, None)
+				names = info and info.keys() or None
+			if not names:
+				continue
+			cond = ' '.join(self.config.compile_cond(src))
+			param = '%s\n%s\n%s\n%s'%(gcc, self.config.param_compile, cond, opt)
+			key = cache.key(src, names, param)
+			if key is None:
+				continue
+			if not cache.fetch(key, obj):
+				keys[src] = (key, obj)
+			STAT.invalidate(obj)
+		return keys
 	
 	def link (self, printmode = 0):
 		if not self.loaded:
 			return 1
-		update = False
+		self._jobserver()
 		outname = self.parser.out
 		outtime = self.dependence.mtime(outname)
-		for src in self.parser:
-			obj = self.parser[src]
+		changed = []
+		for obj in self.coremake._obj:
 			mtime = self.dependence.mtime(obj)
 			if mtime == 0 or mtime > outtime:
-				update = True
-				break
-		if update:
-			self.coremake.remove(self.parser.out)
-			self.coremake.event(self.parser.events.get('prelink', []))
-		retval = self.coremake.link(True, printmode)
+				changed.append(obj)
+		incremental = False
+		if changed:
+			incremental = self.coremake.archivable()
+			if not incremental:
+				self.coremake.remove(self.parser.out)
+			self.coremake.event(self.parser.events.get('prelink', []), 'prelink')
+		changed = incremental and changed or None
+		retval = self.coremake.link(True, printmode, changed)
 		if retval:
-			self.coremake.event(self.parser.events.get('postbuild', []))
+			self.coremake.event(self.parser.events.get('postbuild', []), 'postbuild')
 			return 0
 		return 3
 	
@@ -2828,6 +5431,138 @@ class emake (object):
 		retval = self.link(printmode)
 		if retval != 0:
 			return 3
+		self._stamp_save()
+		return 0
+
+	# 无修改构建的快速路径：成功构建后记录配置的指纹、所有输入和输出
+	# 文件的时间及大小、依赖数据库的版本，下次构建前全部相同的话
+	# 不需要解析工程和扫描依赖
+	def _stamp_file (self, makefile):
+		text = '%s\n%s'%(os.path.abspath(makefile), INIPATH)
+		return self.config.cachefile('stamp', text)
+
+	# 构建会读取的环境变量：emake 自己用到的以及 gcc/ld 的搜索路径等，
+	# 整个环境都会传给编译器，GCC_ 和 LD_ 开头的也都算上
+	ENVIRON = ('PATH', 'JAVA_HOME', 'XDG_CACHE_HOME', 'EMAKECYGWIN',
+		'CPATH', 'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH', 'OBJC_INCLUDE_PATH',
+		'LIBRARY_PATH', 'COMPILER_PATH', 'DEPENDENCIES_OUTPUT',
+		'SUNPRO_DEPENDENCIES', 'SOURCE_DATE_EPOCH', 'MACOSX_DEPLOYMENT_TARGET',
+		'SDKROOT', 'PKG_CONFIG_PATH', 'PYTHONHOME', 'CYGWIN')
+
+	def _stamp_key (self, makefile):
+		ignore = ('stamp', 'probe', 'diag', 'jobserver')
+		cfg = [ (k, v) for k, v in CFG.items() if k not in ignore ]
+		cfg.sort()
+		environ = []
+		for k, v in os.environ.items():
+			if k in self.ENVIRON or k[:4] == 'GCC_' or k[:3] == 'LD_':
+				environ.append((k, v))
+		environ.sort()
+		key = (os.path.abspath(makefile), os.getcwd(), repr(cfg))
+		key += (repr(environ), )
+		return key + self.config._probe_key()
+
+	# 返回文件的 (mtime, size)，不存在时返回 None
+	def _stamp_stat (self, name):
+		try:
+			st = os.stat(name)
+		except OSError:
+			return None
+		return (st.st_mtime, st.st_size)
+
+	# 依赖数据库的版本号，只读取文件头
+	def _stamp_generation (self, dbname):
+		import struct
+		try:
+			fp = open(dbname, 'rb')
+			head = fp.read(16)
+			fp.close()
+			return struct.unpack('<4sIII', head)[2]
+		except (IOError, struct.error):
+			return -1
+
+	# 上次成功构建之后没有任何变化时返回 True
+	def uptodate (self, makefile):
+		if not CFG.get('stamp', True):
+			return False
+		import marshal
+		ts = time.time()
+		try:
+			fp = open(self._stamp_file(makefile), 'rb')
+			data = marshal.loads(fp.read())
+			fp.close()
+		except (IOError, OSError, EOFError, ValueError, TypeError):
+			return False
+		if type(data) != type({}) or data.get('key') != self._stamp_key(makefile):
+			return False
+		for name, stamp in data['files']:
+			if self._stamp_stat(name) != stamp:
+				return False
+		dbname, generation = data['db']
+		if self._stamp_generation(dbname) != generation:
+			return False
+		if data.get('globs'):
+			import glob
+			for pattern, names in data['globs']:
+				found = [ os.path.abspath(n) for n in glob.glob(pattern) ]
+				found.sort()
+				if found != names:
+					return False
+		TRACE.span('emake.uptodate', ts, args = {'files': len(data['files'])})
+		return True
+
+	# 记录成功构建后的状态，有 postbuild 事件的工程每次都要执行事件，
+	# 不使用快速路径；构建过程中被修改过的输入不能记录
+	def _stamp_save (self):
+		if not CFG.get('stamp', True) or not self.makefile:
+			return -1
+		import marshal
+		filename = self._stamp_file(self.makefile)
+		events = self.parser.events.get('postbuild', [])
+		if [ n for n in events if n.strip('\r\n\t ') ]:
+			try: os.remove(filename)
+			except OSError: pass
+			return -1
+		names = [ self.makefile ] + self.config.inifiles
+		names.extend(self.dependence.files())
+		for name in names:
+			stamp = self._stamp_stat(name)
+			if stamp is not None and stamp[0] >= self.opened:
+				try: os.remove(filename)
+				except OSError: pass
+				return -1
+		names.extend(self.coremake._obj)
+		names.append(self.parser.out)
+		if self._compdb_name():
+			names.append(self._compdb_name())
+		for stub in self._pch_units:
+			names.append(stub + '.gch')
+		files = {}
+		for name in names:
+			files[os.path.abspath(name)] = 1
+		files = [ (n, self._stamp_stat(n)) for n in files ]
+		files.sort()
+		dbname = self.dependence._dbname
+		data = {}
+		data['key'] = self._stamp_key(self.makefile)
+		data['files'] = files
+		data['db'] = (dbname, self._stamp_generation(dbname))
+		data['globs'] = self.parser.globs
+		temp = filename + '.%d.tmp'%os.getpid()
+		try:
+			if not os.path.exists(os.path.dirname(filename)):
+				os.makedirs(os.path.dirname(filename))
+			fp = open(temp, 'wb')
+			fp.write(marshal.dumps(data, 2))
+			fp.close()
+			if sys.platform[:3] == 'win' and os.path.exists(filename):
+				os.remove(filename)
+			os.rename(temp, filename)
+		except (IOError, OSError, ValueError):
+			try: os.remove(temp)
+			except OSError: pass
+			return -2
+		self.config.cacheprune('stamp', 32)
 		return 0
 	
 	def clean (self):
@@ -2837,6 +5572,10 @@ class emake (object):
 			obj = self.parser[src]
 			if obj != src:
 				self.coremake.remove(obj)
+		for src, obj in self._unity_objs.items():
+			self.coremake.remove(obj)
+		for stub in self._pch_units:
+			self.coremake.remove(stub + '.gch')
 		if self.loaded:
 			self.coremake.remove(self.parser.out)
 		return 0
@@ -2882,10 +5621,786 @@ class emake (object):
 			for src in self.parser:
 				if src in self.dependence._dirty:
 					print src
+		elif name in ('why', 'explain'):
+			for src in self.parser:
+				if src in self.dependence._dirty:
+					print src
+					for reason in self.dependence._reason(src):
+						print '    ' + reason
 		return 0
 	
 
-		
+
+#----------------------------------------------------------------------
+# watcher: 文件变化监控，Linux 下使用 inotify，其他平台轮询 stat
+#----------------------------------------------------------------------
+class watcher (object):
+
+	IN_MODIFY = 0x2
+	IN_ATTRIB = 0x4
+	IN_CLOSE_WRITE = 0x8
+	IN_MOVED_FROM = 0x40
+	IN_MOVED_TO = 0x80
+	IN_CREATE = 0x100
+	IN_DELETE = 0x200
+	IN_Q_OVERFLOW = 0x4000
+
+	def __init__ (self, interval = 0.5):
+		self.interval = interval
+		self.files = {}			# 文件 -> (mtime, size)，轮询时使用
+		self.dirs = {}			# 目录 -> inotify wd
+		self.wds = {}			# inotify wd -> 目录
+		self.fd = -1
+		self.libc = None
+		if sys.platform[:5] == 'linux':
+			self._inotify_init()
+
+	def _inotify_init (self):
+		try:
+			import ctypes, ctypes.util
+			name = ctypes.util.find_library('c') or 'libc.so.6'
+			libc = ctypes.CDLL(name, use_errno = True)
+			fd = libc.inotify_init1(os.O_NONBLOCK)
+		except (OSError, AttributeError):
+			return -1
+		if fd < 0:
+			return -2
+		self.libc = libc
+		self.fd = fd
+		return 0
+
+	def _snapshot (self, name):
+		try:
+			st = os.stat(name)
+			return (st.st_mtime, st.st_size)
+		except OSError:
+			return None
+
+	# 设置需要监控的文件，inotify 监控它们所在的目录
+	def watch (self, names):
+		self.files = {}
+		for name in names:
+			name = os.path.abspath(name)
+			self.files[name] = self._snapshot(name)
+			home = os.path.dirname(name)
+			if home in self.dirs:
+				continue
+			self.dirs[home] = -1
+			if self.fd >= 0:
+				mask = self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE
+				mask |= self.IN_MOVED_FROM | self.IN_MOVED_TO
+				mask |= self.IN_CREATE | self.IN_DELETE
+				wd = self.libc.inotify_add_watch(self.fd, home, mask)
+				if wd >= 0:
+					self.dirs[home] = wd
+					self.wds[wd] = home
+		return 0
+
+	def fileno (self):
+		return self.fd
+
+	# 读取 inotify 事件，返回发生变化的文件
+	def _inotify_read (self):
+		import struct
+		changed = {}
+		while True:
+			try:
+				data = os.read(self.fd, 0x10000)
+			except OSError:
+				break
+			if not data:
+				break
+			pos = 0
+			while pos + 16 <= len(data):
+				wd, mask, cookie, size = struct.unpack_from('iIII', data, pos)
+				name = data[pos + 16:pos + 16 + size].rstrip('\0')
+				pos += 16 + size
+				if mask & self.IN_Q_OVERFLOW:
+					for fn in self.files:
+						changed[fn] = 1
+					continue
+				if wd in self.wds and name:
+					fn = os.path.join(self.wds[wd], name)
+					if fn in self.files:
+						changed[fn] = 1
+					elif mask & (self.IN_CREATE | self.IN_DELETE | self.IN_MOVED_TO):
+						changed[fn] = 1
+		return changed.keys()
+
+	# 轮询所有文件的 (mtime, size)
+	def _poll (self):
+		changed = []
+		for name in self.files:
+			snapshot = self._snapshot(name)
+			if snapshot != self.files[name]:
+				self.files[name] = snapshot
+				changed.append(name)
+		return changed
+
+	# 等待文件变化，返回变化的文件列表，超时返回空列表
+	def wait (self, timeout = None):
+		import select
+		limit = (timeout is not None) and (time.time() + timeout) or None
+		while True:
+			wait = self.interval
+			if limit is not None:
+				wait = min(wait, max(0, limit - time.time()))
+			if self.fd >= 0:
+				try: select.select([self.fd], [], [], wait)
+				except select.error: pass
+				changed = self._inotify_read()
+			else:
+				time.sleep(wait)
+				changed = self._poll()
+			if changed:
+				return self._filter(changed)
+			if limit is not None and time.time() >= limit:
+				return []
+
+	# 过滤掉构建过程自己产生的文件：只保留监控的文件和新建的源文件
+	def _filter (self, changed):
+		exts = ('.c', '.cpp', '.cc', '.cxx', '.s', '.asm', '.m', '.mm')
+		exts += ('.h', '.hpp', '.hh', '.hxx', '.inc', '.mak', '.em', '.emk')
+		output = []
+		for name in changed:
+			if name in self.files:
+				output.append(name)
+			elif os.path.splitext(name)[-1].lower() in exts:
+				output.append(name)
+		return output
+
+	def close (self):
+		if self.fd >= 0:
+			os.close(self.fd)
+			self.fd = -1
+		self.dirs = {}
+		self.wds = {}
+		return 0
+
+
+#----------------------------------------------------------------------
+# daemon: 常驻内存的构建服务，保留解析结果、依赖关系和文件状态缓存，
+# 根据文件变化增量更新，并通过本地 socket 接受客户端的构建请求
+#----------------------------------------------------------------------
+class daemon (object):
+
+	def __init__ (self, makefile, printmode = 3):
+		self.makefile = os.path.abspath(makefile)
+		self.printmode = printmode
+		self.make = None
+		self.watcher = watcher()
+		self.pending = []
+		self.reopen = True
+
+	# 由工程文件名得到本地 socket 地址，客户端无需解析工程
+	def address (self):
+		import hashlib, tempfile
+		uid = ('getuid' in os.__dict__) and os.getuid() or 0
+		key = hashlib.md5(self.makefile).hexdigest()[:16]
+		name = 'emake-%d-%s.sock'%(uid, key)
+		return os.path.join(tempfile.gettempdir(), name)
+
+	# 需要监控的文件：工程文件、配置文件和所有依赖文件
+	def _files (self):
+		names = [ self.makefile ] + self.make.config.inifiles
+		names += self.make.dependence.files()
+		return names
+
+	# 加载工程，或者根据变化的文件增量更新
+	def refresh (self):
+		changed = self.pending
+		self.pending = []
+		if not self.reopen and self.make:
+			known = {}
+			for name in self._files():
+				known[name] = 1
+			for name in changed:
+				if not name in known or name == self.makefile:
+					self.reopen = True
+				elif name in self.make.config.inifiles:
+					self.reopen = True
+		if self.reopen or (not self.make):
+			self.make = emake()
+			if self.make.open(self.makefile) != 0:
+				return -1
+			self.reopen = False
+		elif changed:
+			for name in changed:
+				STAT.invalidate(name)
+			self.make.dependence.update(changed)
+		self.watcher.watch(self._files())
+		return 0
+
+	# 执行构建命令
+	def execute (self, command):
+		if self.refresh() != 0:
+			return -1
+		make = self.make
+		if command in ('build', 'b'):
+			retval = make.build(self.printmode)
+		elif command in ('compile', 'c'):
+			retval = make.compile(self.printmode)
+		elif command in ('link', 'l'):
+			retval = make.link(self.printmode)
+		elif command in ('dirty', 'why'):
+			retval = make.info(command)
+		else:
+			sys.stderr.write('unknow command: %s\n'%command)
+			sys.stderr.flush()
+			return 127
+		make.dependence.update(make.dependence._dirty.keys())
+		return retval
+
+	# 收集变化的文件
+	def _collect (self, timeout):
+		changed = self.watcher.wait(timeout)
+		for name in changed:
+			if not name in self.pending:
+				self.pending.append(name)
+		return len(changed)
+
+	# 监控模式：文件变化后自动重新构建
+	def watch (self, command = 'build'):
+		self.execute(command)
+		print 'watching for changes ...'
+		sys.stdout.flush()
+		while True:
+			try:
+				if not self._collect(None):
+					continue
+				time.sleep(0.1)
+				self._collect(0)
+				self.execute(command)
+				print 'watching for changes ...'
+				sys.stdout.flush()
+			except KeyboardInterrupt:
+				break
+		self.watcher.close()
+		return 0
+
+	# 服务模式：在本地 socket 上接受 "命令 printmode" 请求
+	def serve (self):
+		import socket, select
+		if not 'AF_UNIX' in socket.__dict__:
+			sys.stderr.write('error: daemon requires unix domain sockets\n')
+			sys.stderr.flush()
+			return -1
+		address = self.address()
+		if os.path.exists(address):
+			# 能连上说明已经有 daemon 在服务，否则是残留的 socket 文件
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				sock.connect(address)
+			except socket.error:
+				os.remove(address)
+			else:
+				sock.close()
+				sys.stderr.write('error: daemon already running on %s\n'%address)
+				sys.stderr.flush()
+				return -1
+		server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		umask = os.umask(0077)
+		try:
+			server.bind(address)
+		finally:
+			os.umask(umask)
+		server.listen(5)
+		self.refresh()
+		print 'emake daemon listening on %s'%address
+		sys.stdout.flush()
+		running = True
+		while running:
+			fds = [ server ]
+			if self.watcher.fileno() >= 0:
+				fds.append(self.watcher.fileno())
+			try:
+				readable = select.select(fds, [], [], self.watcher.interval)[0]
+			except KeyboardInterrupt:
+				break
+			except select.error:
+				continue
+			if self.watcher.fileno() < 0 or self.watcher.fileno() in readable:
+				self._collect(0)
+			if server in readable:
+				conn, addr = server.accept()
+				running = self._request(conn)
+		server.close()
+		self.watcher.close()
+		os.remove(address)
+		return 0
+
+	# 处理一个客户端请求，构建输出重定向到连接上
+	def _request (self, conn):
+		fp = conn.makefile('rb')
+		line = fp.readline().strip('\r\n\t ')
+		fp.close()
+		part = line.split()
+		command = part and part[0] or 'build'
+		if command == 'stop':
+			conn.sendall('\0exit:0\n')
+			conn.close()
+			return False
+		if len(part) > 1:
+			try: self.printmode = diag_printmode(int(part[1]))
+			except ValueError: pass
+		sys.stdout.flush()
+		sys.stderr.flush()
+		save = (os.dup(1), os.dup(2))
+		os.dup2(conn.fileno(), 1)
+		os.dup2(conn.fileno(), 2)
+		try:
+			try:
+				retval = self.execute(command)
+			except IOError:
+				retval = -1
+			try:
+				sys.stdout.flush()
+				sys.stderr.flush()
+			except IOError:
+				pass
+		finally:
+			os.dup2(save[0], 1)
+			os.dup2(save[1], 2)
+			os.close(save[0])
+			os.close(save[1])
+		try:
+			conn.sendall('\0exit:%d\n'%retval)
+		except Exception:
+			pass
+		conn.close()
+		return True
+
+
+# 客户端：把命令发给常驻的 daemon，daemon 不存在时返回 None
+def client(makefile, command, printmode = 3):
+	import socket
+	if not 'AF_UNIX' in socket.__dict__:
+		return None
+	address = daemon(makefile).address()
+	if not os.path.exists(address):
+		return None
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(address)
+	except socket.error:
+		return None
+	sock.sendall('%s %d\n'%(command, printmode))
+	retval = -1
+	trailer = None
+	while True:
+		data = sock.recv(0x10000)
+		if not data:
+			break
+		if trailer is not None:
+			trailer += data
+			continue
+		pos = data.find('\0')
+		if pos >= 0:
+			trailer = data[pos:]
+			data = data[:pos]
+		sys.stdout.write(data)
+		sys.stdout.flush()
+	if trailer and trailer[:6] == '\0exit:':
+		try: retval = int(trailer[6:].strip())
+		except ValueError: pass
+	sock.close()
+	return retval
+
+
+#----------------------------------------------------------------------
+# worker/remote: 分布式编译，客户端在本地预处理后把源代码和编译参数
+# 发给 worker，worker 编译后返回目标文件和编译输出
+#----------------------------------------------------------------------
+
+# 解析 worker 地址："host:port" 为 TCP，"unix:path" 或者路径为 unix socket
+def sockaddr(text):
+	import socket
+	text = text.strip()
+	if text[:5] == 'unix:':
+		return (socket.AF_UNIX, text[5:])
+	if '/' in text or '\\' in text:
+		return (socket.AF_UNIX, text)
+	host, port = text, 7771
+	if ':' in text:
+		host, port = text.rsplit(':', 1)
+		port = int(port)
+	return (socket.AF_INET, (host or '127.0.0.1', port))
+
+# 发送消息：头部(json)和数据都带长度前缀
+def _message_send(sock, header, payload = ''):
+	import json, struct
+	text = json.dumps(header)
+	head = struct.pack('<4sII', 'EMWK', len(text), len(payload))
+	sock.sendall(head + text)
+	if payload:
+		sock.sendall(payload)
+	return 0
+
+def _message_read(sock, size):
+	data = []
+	while size > 0:
+		text = sock.recv(min(size, 0x100000))
+		if not text:
+			raise IOError('connection closed')
+		data.append(text)
+		size -= len(text)
+	return ''.join(data)
+
+# 接收消息，连接在消息开始前关闭时返回 None，limit 限制消息大小
+def _message_recv(sock, limit = None):
+	import json, struct
+	head = sock.recv(12)
+	if not head:
+		return None
+	if len(head) < 12:
+		head += _message_read(sock, 12 - len(head))
+	magic, hsize, psize = struct.unpack('<4sII', head)
+	if magic != 'EMWK':
+		raise IOError('bad message')
+	if limit is not None and hsize + psize > limit:
+		raise IOError('message too large')
+	header = json.loads(_message_read(sock, hsize))
+	payload = _message_read(sock, psize)
+	return header, payload
+
+
+# worker 的共享口令：--token 参数或者配置中的 token
+def _worker_token(config):
+	token = CFG.get('token', None)
+	if token is None:
+		token = config._getitem('default', 'token', '')
+	return token.strip('\r\n\t ')
+
+# 握手时用口令对随机数做的签名
+def _worker_sign(token, nonce):
+	import hmac, hashlib
+	return hmac.new(token, nonce, hashlib.sha256).hexdigest()
+
+# worker 只接受影响代码生成和警告的参数，带路径的，或者会写文件、
+# 运行其它程序的参数（-o、-B、-specs=、-wrapper、-fplugin=、-Wa, 等）
+# 一律拒绝，客户端遇到这样的参数就在本地编译
+def _worker_flag(flag):
+	if not isinstance(flag, basestring) or flag[:1] != '-':
+		return False
+	if flag[:2] in ('-D', '-U'):
+		return True
+	if '/' in flag or '\\' in flag:
+		return False
+	for prefix in ('-fplugin', '-fprofile', '-fauto-profile', '-fdump',
+			'-fcallgraph-info', '-fsave-optimization-record', '-fopt-info',
+			'-fstack-usage', '-ftest-coverage', '-fcoverage', '-fdiagnostics',
+			'-fcompare-debug', '-fada-spec', '-Wa,', '-Wl,', '-Wp,'):
+		if flag.startswith(prefix):
+			return False
+	if flag[:2] in ('-f', '-m', '-O', '-W', '-g'):
+		return True
+	if flag.startswith('-std='):
+		return True
+	return flag in ('-w', '-ansi', '-pedantic', '-pedantic-errors', '-pthread')
+
+
+class worker (object):
+
+	langs = ('cpp-output', 'c++-cpp-output', 'objective-c-cpp-output',
+			'objective-c++-cpp-output')
+
+	def __init__ (self, config = None):
+		import threading
+		self.config = config or configure()
+		self.config.init()
+		self.config.loadcfg()
+		self.slots = threading.Semaphore(max(1, self.config.cpus))
+		self.token = _worker_token(self.config)
+
+	# 编译一个预处理过的源文件，返回 (头部, 目标文件内容)
+	def handle (self, header, payload):
+		import tempfile, shutil, subprocess
+		lang = header.get('lang', '')
+		flags = header.get('flags', [])
+		if not lang in self.langs:
+			return ({'code': -1, 'output': 'bad language: %s\n'%lang}, '')
+		for flag in flags:
+			if not _worker_flag(flag):
+				return ({'code': -1, 'output': 'bad flag: %r\n'%flag}, '')
+		temp = tempfile.mkdtemp('.job', 'emake')
+		try:
+			srcname = os.path.join(temp, 'source.i')
+			objname = os.path.join(temp, 'source.o')
+			fp = open(srcname, 'wb')
+			fp.write(payload)
+			fp.close()
+			gcc = self.config.getname('gcc')
+			args = [ gcc, '-x', lang ] + [ n.encode('utf-8') for n in flags ]
+			args += [ '-c', srcname, '-o', objname ]
+			self.slots.acquire()
+			try:
+				p = subprocess.Popen(args, stdin = subprocess.PIPE,
+						stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+						cwd = temp)
+				p.stdin.close()
+				output = p.stdout.read()
+				p.stdout.close()
+				code = p.wait()
+			finally:
+				self.slots.release()
+			data = ''
+			if code == 0 and os.path.exists(objname):
+				fp = open(objname, 'rb')
+				data = fp.read()
+				fp.close()
+		finally:
+			shutil.rmtree(temp, True)
+		return ({'code': code, 'output': output}, data)
+
+	# 握手：发送随机数，客户端用口令签名后返回，不对的话断开连接
+	def auth (self, sock):
+		import hmac
+		nonce = os.urandom(16).encode('hex')
+		_message_send(sock, {'nonce': nonce})
+		message = _message_recv(sock, 4096)
+		if message is None:
+			return False
+		answer = message[0].get('auth', '')
+		if not isinstance(answer, basestring):
+			return False
+		expect = _worker_sign(self.token, nonce)
+		if not hmac.compare_digest(expect, answer.encode('utf-8')):
+			_message_send(sock, {'code': -1, 'output': 'bad token\n'})
+			return False
+		_message_send(sock, {'code': 0})
+		return True
+
+	# 处理一个连接上的所有请求
+	def session (self, sock):
+		try:
+			if not self.auth(sock):
+				sock.close()
+				return -1
+			while True:
+				message = _message_recv(sock)
+				if message is None:
+					break
+				header, payload = self.handle(message[0], message[1])
+				_message_send(sock, header, payload)
+		except Exception:
+			pass
+		sock.close()
+		return 0
+
+	# 监听地址，每个连接一个线程，同时编译的任务数不超过 cpus
+	def serve (self, address = ''):
+		import socket, threading
+		family, addr = sockaddr(address or '127.0.0.1:7771')
+		if family != socket.AF_UNIX and not self.token:
+			sys.stderr.write('error: tcp worker requires a token, set "token" ' \
+					'in %s or use --token\n'%self.config.ininame)
+			sys.stderr.flush()
+			return -1
+		if family == socket.AF_UNIX and os.path.exists(addr):
+			os.remove(addr)
+		server = socket.socket(family, socket.SOCK_STREAM)
+		if family != socket.AF_UNIX:
+			server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		server.bind(addr)
+		server.listen(64)
+		print 'emake worker: listening on %s (%d slots)'%(address or \
+				'127.0.0.1:7771', max(1, self.config.cpus))
+		sys.stdout.flush()
+		try:
+			while True:
+				sock, peer = server.accept()
+				th = threading.Thread(target = self.session, args = (sock,))
+				th.setDaemon(True)
+				th.start()
+		except KeyboardInterrupt:
+			pass
+		server.close()
+		if family == socket.AF_UNIX:
+			os.remove(addr)
+		return 0
+
+
+class remote (object):
+
+	langs = { '.c': 'cpp-output', '.cpp': 'c++-cpp-output', 
+		'.cc': 'c++-cpp-output', '.cxx': 'c++-cpp-output',
+		'.m': 'objective-c-cpp-output', '.mm': 'objective-c++-cpp-output' }
+
+	# 只在预处理时需要的参数，其中 cpparg 带一个参数
+	cpparg = ('-I', '-D', '-U', '-include', '-imacros', '-isystem', '-iquote',
+			'-idirafter', '-MF', '-MT', '-MQ')
+	cppflag = ('-MD', '-MMD', '-MP', '-M', '-MM', '-Winvalid-pch', 
+			'-nostdinc', '-nostdinc++')
+
+	def __init__ (self, config, hosts):
+		import threading
+		self.config = config
+		self.hosts = hosts
+		self.lock = threading.Lock()
+		self.idle = {}			# 空闲的连接
+		self.dead = {}			# 失败的 worker -> 恢复时间
+		self.index = 0
+		self.counters = { 'remote': 0, 'local': 0, 'retry': 0 }
+		self.worker = None
+		self.token = _worker_token(config)
+		if 'loopback' in hosts:
+			self.worker = worker()
+
+	# 拆分命令行：得到预处理命令行和编译参数
+	def _split (self, args):
+		srcname, cpp, flags = None, [ args[0] ], []
+		i = 1
+		while i < len(args):
+			arg = args[i]
+			if arg in ('-c', '-o'):
+				if arg == '-c' and i + 1 < len(args):
+					srcname = args[i + 1]
+				i += 2
+				continue
+			cpp.append(arg)
+			keep = not arg in self.cppflag
+			for prefix in self.cpparg:
+				if arg == prefix:
+					if i + 1 < len(args):
+						cpp.append(args[i + 1])
+					i += 1
+					keep = False
+					break
+				if arg.startswith(prefix):
+					keep = False
+					break
+			if keep:
+				flags.append(arg)
+			i += 1
+		return srcname, cpp + [ '-E', srcname ], flags
+
+	# 选择下一个可用的 worker，失败过的 worker 十秒后再重试
+	def _pick (self):
+		self.lock.acquire()
+		try:
+			now = time.time()
+			for i in xrange(len(self.hosts)):
+				host = self.hosts[(self.index + i) % len(self.hosts)]
+				if self.dead.get(host, 0) <= now:
+					self.index = (self.index + i + 1) % len(self.hosts)
+					return host
+		finally:
+			self.lock.release()
+		return None
+
+	def _connect (self, host):
+		import socket
+		self.lock.acquire()
+		try:
+			idle = self.idle.get(host, [])
+			if idle:
+				return idle.pop(), True
+		finally:
+			self.lock.release()
+		if host == 'loopback':	# 本进程内的 worker，走完整的协议，用于测试
+			import threading
+			sock, peer = socket.socketpair()
+			th = threading.Thread(target = self.worker.session, args = (peer,))
+			th.setDaemon(True)
+			th.start()
+		else:
+			family, addr = sockaddr(host)
+			sock = socket.socket(family, socket.SOCK_STREAM)
+			sock.settimeout(600)
+		try:
+			if host != 'loopback':
+				sock.connect(addr)
+			self._handshake(sock)
+		except (socket.error, IOError, ValueError):
+			sock.close()
+			raise
+		return sock, False
+
+	# 回应 worker 的握手
+	def _handshake (self, sock):
+		message = _message_recv(sock, 4096)
+		if message is None or not message[0].get('nonce'):
+			raise IOError('bad handshake')
+		nonce = message[0]['nonce'].encode('utf-8')
+		_message_send(sock, {'auth': _worker_sign(self.token, nonce)})
+		message = _message_recv(sock, 4096)
+		if message is None or message[0].get('code', -1) != 0:
+			raise IOError('worker rejected the token')
+		return 0
+
+	def _release (self, host, sock):
+		self.lock.acquire()
+		self.idle.setdefault(host, []).append(sock)
+		self.lock.release()
+
+	def _fail (self, host):
+		self.lock.acquire()
+		self.dead[host] = time.time() + 10
+		self.counters['retry'] += 1
+		self.lock.release()
+
+	# 编译一个源文件，返回编译输出；worker 失败时换一个重试，
+	# 全部失败或者不支持的文件类型在本地编译
+	def compile (self, srcname, objname, options, printcmd = False):
+		import subprocess, socket, struct
+		cmd = self.config.compile_cmdline(srcname, objname, options)
+		lang = self.langs.get(os.path.splitext(srcname)[-1].lower(), None)
+		if lang is None:
+			return self._local(srcname, objname, options, printcmd)
+		source, cpp, flags = self._split(cmdsplit(cmd))
+		p = subprocess.Popen(cpp, stdin = subprocess.PIPE,
+				stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+		data, output = p.communicate()
+		text = printcmd and (cmd + '\n') or ''
+		if p.returncode != 0:
+			return text + output
+		if [ n for n in flags if not _worker_flag(n) ]:
+			return self._local(srcname, objname, options, printcmd)
+		header = { 'lang': lang, 'flags': flags, 'name': srcname }
+		for i in xrange(len(self.hosts) + 1):
+			host = self._pick()
+			if host is None:
+				break
+			sock, reused = None, False
+			try:
+				sock, reused = self._connect(host)
+				_message_send(sock, header, data)
+				message = _message_recv(sock)
+				if message is None:
+					raise IOError('connection closed')
+			except (socket.error, IOError, ValueError, struct.error):
+				if sock is not None:
+					try: sock.close()
+					except socket.error: pass
+				if not reused:
+					self._fail(host)
+				continue
+			self._release(host, sock)
+			result, obj = message
+			if result.get('code', -1) == 0 and obj:
+				fp = open(objname, 'wb')
+				fp.write(obj)
+				fp.close()
+			self.lock.acquire()
+			self.counters['remote'] += 1
+			self.lock.release()
+			return text + output + result.get('output', '')
+		return self._local(srcname, objname, options, printcmd)
+
+	def _local (self, srcname, objname, options, printcmd):
+		self.lock.acquire()
+		self.counters['local'] += 1
+		self.lock.release()
+		return self.config.compile(srcname, objname, options, printcmd, True)
+
+	def close (self):
+		for host, idle in self.idle.items():
+			for sock in idle:
+				sock.close()
+		self.idle = {}
+		return 0
+
+
 #----------------------------------------------------------------------
 # speed up
 #----------------------------------------------------------------------
@@ -2902,6 +6417,212 @@ def _psyco_speedup():
 	return True
 
 
+#----------------------------------------------------------------------
+# benchmark: 生成模拟的 C/C++ 工程并测试各个环节的耗时
+#----------------------------------------------------------------------
+def _bench_generate(root, sources, headers, fanout = 8, depth = 3, seed = 0):
+	import random
+	rand = random.Random(seed)
+	depth = max(1, depth)
+	headers = max(depth, headers)
+	levels = [ [] for i in xrange(depth) ]
+	for i in xrange(headers):
+		levels[i * depth / headers].append('h%05d.h'%i)
+	for level in xrange(depth):
+		for name in levels[level]:
+			lines = [ '#ifndef _%s_'%name.replace('.', '_').upper() ]
+			lines.append('#define _%s_'%name.replace('.', '_').upper())
+			if level + 1 < depth:
+				for inc in rand.sample(levels[level + 1], min(max(1, fanout / 2), len(levels[level + 1]))):
+					lines.append('#include "%s"'%inc)
+			lines.append('/* #include "missing_%s" */'%name)
+			lines.append('static const char *%s_s = "#include \\"x.h\\"";'%name[:-2])
+			lines.append('#endif')
+			fp = open(os.path.join(root, name), 'w')
+			fp.write('\n'.join(lines) + '\n')
+			fp.close()
+	names = []
+	for i in xrange(sources):
+		name = 's%05d.%s'%(i, (i % 2) and 'cpp' or 'c')
+		lines = [ '// source file %d'%i ]
+		for inc in rand.sample(levels[0], min(fanout, len(levels[0]))):
+			lines.append('#include "%s"'%inc)
+		lines.append('#include <stdio.h>')
+		lines.append('/* multi-line comment')
+		lines.append('#include "commented.h" */')
+		lines.append('int func_%d(void) { return %d; }'%(i, i))
+		fp = open(os.path.join(root, name), 'w')
+		fp.write('\n'.join(lines) + '\n')
+		fp.close()
+		names.append(name)
+	return names
+
+# 比较逐字符预处理和正则扫描的头文件分析速度
+def benchmark_scan(count = 10000):
+	import tempfile, shutil
+	root = tempfile.mkdtemp('.bench', 'emake')
+	try:
+		print 'generating %d files in %s ...'%(count, root)
+		_bench_generate(root, count - count / 10, count / 10)
+		names = [ os.path.join(root, n) for n in os.listdir(root) ]
+		names.sort()
+		pst = preprocessor()
+		result = []
+		for method in (pst.search_reference_legacy, pst.search_reference):
+			heads = []
+			output = []
+			t = time.time()
+			for name in names:
+				method(name, heads)
+				output.append([ n for n in heads ])
+			t = time.time() - t
+			result.append((t, output))
+			print '%s: %.3fs'%(method.__name__, t)
+		if result[0][1] != result[1][1]:
+			print 'error: results differ'
+			return -1
+		print 'results match, speed up: %.1fx'%(result[0][0] / max(0.000001, result[1][0]))
+	finally:
+		shutil.rmtree(root)
+	return 0
+
+
+# 编译器桩：只创建 -o 指定的文件，测试构建时不需要真正的工具链
+_BENCH_STUB = '''#! /bin/sh
+while [ $# -gt 0 ]; do
+	if [ "$1" = "-o" ]; then shift; : > "$1"; fi
+	shift
+done
+'''
+
+# 在子进程中运行一次 emake，返回墙钟时间、各个 trace 区段的耗时以及
+# 编译的文件数
+def _bench_run(root, command, options = None):
+	import subprocess, json
+	tracefile = os.path.join(root, 'trace.json')
+	args = [ sys.executable, os.path.abspath(__file__) ]
+	args.append('--ini=' + os.path.join(root, 'bench.ini'))
+	args.append('--trace=' + tracefile)
+	args.extend(options or [])
+	args.extend([ command, os.path.join(root, 'bench.mak') ])
+	environ = dict(os.environ)
+	environ['XDG_CACHE_HOME'] = os.path.join(root, 'cache')
+	devnull = open(os.devnull, 'w')
+	t = time.time()
+	code = subprocess.call(args, stdout = devnull, stderr = devnull,
+			env = environ, cwd = root)
+	t = time.time() - t
+	devnull.close()
+	if code != 0:
+		raise RuntimeError('emake %s failed with %d'%(command, code))
+	fp = open(tracefile)
+	events = json.load(fp)['traceEvents']
+	fp.close()
+	spans = {}
+	compiled = 0
+	for event in events:
+		if event.get('ph') != 'X':
+			continue
+		if event.get('cat') == 'job':
+			compiled += 1
+			continue
+		name = event['name']
+		spans[name] = spans.get(name, 0) + event['dur'] * 0.000001
+	for name in spans:
+		spans[name] = round(spans[name], 6)
+	return { 'wall': round(t, 6), 'spans': spans, 'compiled': compiled }
+
+# 测试构建各个环节的耗时：首次完整构建（包括解析工程和冷启动的依赖
+# 扫描）、无修改构建、修改一个源文件或者头文件后的构建以及完全重新
+# 构建，结果以 JSON 输出，多次运行的环节取墙钟时间最短的一次
+def benchmark_build(sources = 2000, headers = 0, fanout = 8, depth = 3,
+		repeat = 3, options = None):
+	import tempfile, shutil
+	if sys.platform[:3] == 'win':
+		sys.stderr.write('error: build benchmark requires a posix shell\n')
+		return None
+	headers = headers or max(depth, sources / 10)
+	root = tempfile.mkdtemp('.bench', 'emake')
+	try:
+		sys.stderr.write('generating %d sources, %d headers in %s ...\n'%( \
+			sources, headers, root))
+		_bench_generate(root, sources, headers, fanout, depth)
+		os.mkdir(os.path.join(root, 'bin'))
+		stub = os.path.join(root, 'bin', 'gcc')
+		fp = open(stub, 'w')
+		fp.write(_BENCH_STUB)
+		fp.close()
+		os.chmod(stub, 0755)
+		fp = open(os.path.join(root, 'bench.ini'), 'w')
+		fp.write('[default]\nhome=bin\ngcc=gcc\n')
+		fp.close()
+		fp = open(os.path.join(root, 'bench.mak'), 'w')
+		fp.write('mode: exe\nout: bench\nint: objs\nsrc: *.c\nsrc: *.cpp\n')
+		fp.close()
+		leaf = [ n for n in os.listdir(root) if n[-2:] == '.h' ]
+		leaf.sort()
+		touches = {}
+		touches['touch'] = os.path.join(root, 's00000.c')
+		touches['header'] = os.path.join(root, leaf[-1])
+		phases = {}
+		sys.stderr.write('full build ...\n')
+		phases['full'] = _bench_run(root, '-b', options)
+		for name in ('noop', 'touch', 'header', 'rebuild'):
+			sys.stderr.write('%s ...\n'%name)
+			best = None
+			for i in xrange(max(1, repeat)):
+				if name in touches:
+					os.utime(touches[name], None)
+				command = (name == 'rebuild') and '-r' or '-b'
+				result = _bench_run(root, command, options)
+				if best is None or result['wall'] < best['wall']:
+					best = result
+			phases[name] = best
+	finally:
+		shutil.rmtree(root)
+	report = {}
+	report['python'] = sys.version.split()[0]
+	report['platform'] = sys.platform
+	report['project'] = { 'sources': sources, 'headers': headers,
+		'fanout': fanout, 'depth': depth, 'repeat': repeat }
+	report['phases'] = phases
+	return report
+
+# 参与比较的指标：各阶段的墙钟时间，以及完整构建中解析工程和扫描依赖的耗时
+def _bench_metrics(report):
+	phases = report.get('phases', {})
+	metrics = {}
+	for name in phases:
+		metrics[name] = phases[name]['wall']
+	spans = phases.get('full', {}).get('spans', {})
+	for name, span in (('parse', 'iparser.parse'), ('scan', 'dependence.scan')):
+		if span in spans:
+			metrics[name] = spans[span]
+	return metrics
+
+# 和基准报告比较，某项指标超过基准的 (1 + threshold) 倍并且多出 10ms
+# 以上时视为退化（太短的耗时只有噪声），返回退化的指标列表
+def benchmark_compare(report, baseline, threshold = 0.2):
+	if report.get('project') != baseline.get('project'):
+		sys.stderr.write('error: baseline was measured on a different project\n')
+		return None
+	metrics = _bench_metrics(report)
+	base = _bench_metrics(baseline)
+	regressions = []
+	for name in sorted(metrics):
+		if not name in base:
+			continue
+		old, new = base[name], metrics[name]
+		status = 'ok'
+		if new > old * (1.0 + threshold) and new - old > 0.01:
+			status = 'REGRESSION'
+			regressions.append(name)
+		ratio = new / max(0.000001, old)
+		sys.stderr.write('%-8s %9.3fs %9.3fs %6.2fx  %s\n'%(name, old, \
+				new, ratio, status))
+	return regressions
+
+
 
 #----------------------------------------------------------------------
 # distribution
@@ -3120,6 +6841,8 @@ def main(argv = None):
 			print '            -s | -cshell     cygwin shell'
 		print '            -i | -install    install emake on unix'
 		print '            -u | -update     update itself from github'
+		print '            -benchmark scan [count]     compare header scanners'
+		print '            -benchmark build [sources]  time builds of a synthetic project'
 		print '            -h | -help       show help page'
 		return 0
 	
@@ -3154,6 +6877,8 @@ def main(argv = None):
 		if name in ('-h', '-help', '-help'):
 			help()
 			return 0
+		if name in ('-worker',):
+			return worker().serve('')
 
 	if len(argv) <= 3:
 		if name in ('-d', '-cmdline'):
@@ -3197,6 +6922,50 @@ def main(argv = None):
 	if 'abs' in options:
 		CFG['abspath'] = bool_safe(options['abs'], True)
 
+	if 'engine' in options:
+		CFG['engine'] = (options['engine'] or '').strip().lower()
+
+	if 'cache' in options:
+		CFG['cache'] = options['cache'] or ''
+
+	if 'linker' in options:
+		CFG['linker'] = options['linker'] or 'auto'
+
+	if 'jobserver' in options:
+		CFG['jobserver'] = bool_safe(options['jobserver'], True)
+
+	if 'workers' in options:
+		CFG['workers'] = options['workers'] or ''
+
+	if 'token' in options:
+		CFG['token'] = options['token'] or ''
+
+	if 'probe' in options:
+		CFG['probe'] = bool_safe(options['probe'], True)
+
+	if 'stamp' in options:
+		CFG['stamp'] = bool_safe(options['stamp'], True)
+
+	if 'diag' in options:
+		CFG['diag'] = (options['diag'] or 'text').strip().lower()
+
+	if 'compdb' in options:
+		CFG['compdb'] = options['compdb'] or 'compile_commands.json'
+
+	if 'unity' in options:
+		text = (options['unity'] or 'on').strip().lower()
+		if text in ('1', 'true', 'on', 'yes'):
+			text = '16'
+		CFG['unity'] = int_safe(text, 0)
+
+	if options.get('trace', None):
+		TRACE.enabled = True
+		TRACE.reset()
+		TRACE.thread_name(TRACE.tid(), 'emake')
+
+	# 所有选项解析完以后再应用，不受选项顺序影响
+	printmode = diag_printmode(printmode)
+
 	ext = os.path.splitext(name)[-1].lower() 
 	ft1 = ('.c', '.cpp', '.cxx', '.cc', '.m', '.mm')
 	ft2 = ('.h', '.hpp', '.hxx', '.hh', '.inc')
@@ -3280,6 +7049,73 @@ def main(argv = None):
 				dirs.remove('.git')
 		return 0
 
+	if cmd in ('-benchmark',):
+		if name == 'scan':
+			count = (len(argv) >= 4) and int_safe(argv[3], 10000) or 10000
+			return benchmark_scan(count)
+		if name == 'build':
+			import json
+			count = (len(argv) >= 4) and int_safe(argv[3], 2000) or 2000
+			extra = []
+			if options.get('cpu', None):
+				extra.append('--cpu=' + options['cpu'])
+			report = benchmark_build(count,
+				int_safe(options.get('headers', '0'), 0),
+				int_safe(options.get('fanout', '8'), 8),
+				int_safe(options.get('depth', '3'), 3),
+				int_safe(options.get('repeat', '3'), 3), extra)
+			if report is None:
+				return -1
+			text = json.dumps(report, indent = 2, sort_keys = True)
+			if options.get('json', None):
+				fp = open(options['json'], 'w')
+				fp.write(text + '\n')
+				fp.close()
+			else:
+				print text
+			if options.get('baseline', None):
+				fp = open(options['baseline'])
+				baseline = json.load(fp)
+				fp.close()
+				threshold = 0.2
+				try: threshold = float(options.get('threshold', '0.2'))
+				except ValueError: pass
+				regressions = benchmark_compare(report, baseline, threshold)
+				if regressions is None:
+					return -1
+				if regressions:
+					sys.stderr.write('error: slower than baseline: %s\n'% \
+							', '.join(regressions))
+					return 1
+			return 0
+		sys.stderr.write('usage: emake.py -benchmark scan [count]\n')
+		sys.stderr.write('       emake.py -benchmark build [sources] ' \
+				'[--headers=N] [--fanout=N] [--depth=N] [--repeat=N] ' \
+				'[--cpu=N] [--json=FILE] [--baseline=FILE [--threshold=0.2]]\n')
+		return -1
+
+	if cmd in ('-worker',):
+		return worker().serve(name)
+
+	if cmd in ('-cache',):
+		make.config.init()
+		cache = make._cache()
+		if not cache:
+			print 'object cache is not enabled, set "cache" in %s'%make.config.ininame
+			return -1
+		if name == 'clear':
+			cache.clear()
+			print 'cache cleared: %s'%cache.path
+			return 0
+		hits, misses, count, size = cache.stats()
+		total = max(1, hits + misses)
+		print 'cache dir: %s'%cache.path
+		print 'hits: %d (%.1f%%)'%(hits, hits * 100.0 / total)
+		print 'misses: %d'%misses
+		print 'files: %d'%count
+		print 'size: %.2f MB / %.2f MB'%(size / 1048576.0, cache.limit / 1048576.0)
+		return 0
+
 	if not ((ext in ft1) or (ext in ft3)):
 		sys.stderr.write('error: %s: unsupported file type\n'%(name))
 		sys.stderr.flush()
@@ -3287,9 +7123,41 @@ def main(argv = None):
 
 	retval = 0
 
+	if cmd in ('-daemon',):
+		return daemon(name, printmode).serve()
+
+	if cmd in ('-client',):
+		command = (len(argv) >= 4) and argv[3] or 'build'
+		retval = client(name, command, printmode)
+		if retval is not None:
+			return retval
+		# 没有 daemon 时在本地执行，命令对应到 daemon.execute 的含义
+		if command == 'stop':
+			sys.stderr.write('daemon is not running\n')
+			sys.stderr.flush()
+			return 0
+		if command == 'why':
+			options['explain'] = 1
+		local = { 'b': '-b', 'build': '-b', 'c': '-c', 'compile': '-c',
+				'l': '-l', 'link': '-l', 'dirty': '-dirty', 'why': '-dirty' }
+		if not command in local:
+			sys.stderr.write('unknow command: %s\n'%command)
+			sys.stderr.flush()
+			return 127
+		cmd = local[command]
+
+	if 'watch' in options:
+		if cmd in ('b', '-b', 'build', '-build'):
+			return daemon(name, printmode).watch('build')
+		if cmd in ('c', '-c', 'compile', '-compile'):
+			return daemon(name, printmode).watch('compile')
+
 	if cmd in ('b', '-b', 'build', '-build'):
-		make.open(name)
-		retval = make.build(printmode)
+		if make.uptodate(name):
+			retval = 0
+		else:
+			make.open(name)
+			retval = make.build(printmode)
 	elif cmd in ('c', '-c', 'compile', '-compile'):
 		make.open(name)
 		retval = make.compile(printmode)
@@ -3313,7 +7181,10 @@ def main(argv = None):
 		make.info('outname');
 	elif cmd in ('dirty', '-dirty'):
 		make.open(name)
-		make.info('dirty')
+		make.info(('explain' in options) and 'why' or 'dirty')
+	elif cmd in ('compdb', '-compdb'):
+		make.open(name)
+		retval = make.compdb((len(argv) >= 4) and argv[3] or '')
 	elif cmd in ('list', '-list'):
 		make.open(name)
 		make.info('list')
@@ -3324,6 +7195,16 @@ def main(argv = None):
 		sys.stderr.write('unknow command: %s\n'%cmd)
 		sys.stderr.flush()
 		retval = 127
+
+	if TRACE.enabled:
+		TRACE.save(options['trace'])
+
+	if 'stats' in options:
+		counters = STAT.counters
+		names = ('stat', 'listdir', 'hit', 'invalidate')
+		text = ', '.join([ '%s: %d'%(n, counters[n]) for n in names ])
+		sys.stderr.write('statcache: %s\n'%text)
+		sys.stderr.flush()
 	return retval
 
 
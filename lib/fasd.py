@@ -14,10 +14,205 @@ import time
 import os
 import shutil
 import codecs
+import errno
+import stat
 import random
 import re
 
 
+#----------------------------------------------------------------------
+# binary index: memory-mapped data file with interned path strings,
+# fixed-width rank/atime arrays and entries sorted by key.
+#
+#   header   magic, version, flags, count, pool size, reserved, total
+#   offsets  (count + 1) x uint32, start of each path in the pool
+#   ranks    count x int32
+#   atimes   count x double
+#   pool     utf-8 paths, each one followed by '\n'
+#----------------------------------------------------------------------
+class FasdIndex (object):
+
+	MAGIC = b'FSDB'
+	VERSION = 1
+	HEADER = '<4sIIIIId'
+
+	def __init__ (self, filename):
+		import mmap, struct
+		self.name = filename
+		self.mm = None
+		with open(filename, 'rb') as fp:
+			st = os.fstat(fp.fileno())
+			self.stamp = (st.st_mtime, st.st_size, st.st_ino)
+			if st.st_size < struct.calcsize(self.HEADER):
+				raise ValueError('bad index file')
+			self.mm = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+		head = struct.unpack_from(self.HEADER, self.mm, 0)
+		magic, version, flags, count, size, _, total = head
+		if magic != self.MAGIC or version != self.VERSION:
+			self.close()
+			raise ValueError('bad index file')
+		self.nocase = (flags & 1) and True or False
+		self.count = count
+		self.total = int(total)
+		self.p_offset = struct.calcsize(self.HEADER)
+		self.p_rank = self.p_offset + (count + 1) * 4
+		self.p_atime = self.p_rank + count * 4
+		self.p_pool = self.p_atime + count * 8
+		if self.p_pool + size > len(self.mm):
+			self.close()
+			raise ValueError('truncated index file')
+		self.offsets = _FasdArray(self.mm, self.p_offset, '<I', count + 1)
+
+	def close (self):
+		if self.mm is not None:
+			self.mm.close()
+			self.mm = None
+
+	def __len__ (self):
+		return self.count
+
+	@staticmethod
+	def detect (filename):
+		try:
+			with open(filename, 'rb') as fp:
+				return fp.read(4) == FasdIndex.MAGIC
+		except IOError:
+			return False
+
+	def _key (self, i):
+		start = self.p_pool + self.offsets[i]
+		return self.mm[start:self.p_pool + self.offsets[i + 1] - 1]
+
+	def path (self, i):
+		return self._key(i).decode('utf-8', 'ignore')
+
+	def item (self, i):
+		import struct
+		rank = struct.unpack_from('<i', self.mm, self.p_rank + i * 4)[0]
+		atime = struct.unpack_from('<d', self.mm, self.p_atime + i * 8)[0]
+		return [self.path(i), rank, int(atime), 0]
+
+	def items (self):
+		return [ self.item(i) for i in range(self.count) ]
+
+	# binary search the sorted keys, return the entry or None
+	def find (self, path):
+		key = _fasd_utf8(self.nocase and path.lower() or path)
+		low, high = 0, self.count
+		while low < high:
+			mid = (low + high) // 2
+			name = self._key(mid)
+			if self.nocase:
+				name = name.decode('utf-8', 'ignore').lower().encode('utf-8')
+			if name < key:
+				low = mid + 1
+			else:
+				high = mid
+		if low < self.count:
+			item = self.item(low)
+			name = self.nocase and item[0].lower() or item[0]
+			if name == (self.nocase and path.lower() or path):
+				return item
+		return None
+
+	# entries which may match the query: every argument has to occur in
+	# a matching path, so scan the string pool for the longest one with
+	# a case insensitive search, and only return the entries it hits
+	def candidates (self, args, mode):
+		literal = _fasd_literal(args, mode).encode('ascii')
+		if not literal:
+			return self.items()
+		import bisect
+		pattern = re.compile(re.escape(literal), re.I)
+		end = self.p_pool + self.offsets[self.count]
+		pos = self.p_pool
+		data = []
+		while True:
+			m = pattern.search(self.mm, pos, end)
+			if not m:
+				break
+			i = bisect.bisect_right(self.offsets, m.start() - self.p_pool) - 1
+			data.append(self.item(i))
+			pos = self.p_pool + self.offsets[i + 1]
+		return data
+
+	# encode [path, rank, atime, _] items into the binary format
+	@staticmethod
+	def encode (data, nocase):
+		import struct
+		keys = []
+		for item in data:
+			key = nocase and item[0].lower() or item[0]
+			keys.append((_fasd_utf8(key), item))
+		keys.sort(key = lambda n: n[0])
+		pool = []
+		offsets = []
+		size = 0
+		for key, item in keys:
+			name = _fasd_utf8(item[0]) + b'\n'
+			offsets.append(size)
+			pool.append(name)
+			size += len(name)
+		offsets.append(size)
+		count = len(keys)
+		total = sum([ n[1][1] for n in keys ])
+		flags = nocase and 1 or 0
+		head = struct.pack(FasdIndex.HEADER, FasdIndex.MAGIC,
+				FasdIndex.VERSION, flags, count, size, 0, total)
+		body = [ head, struct.pack('<%dI'%(count + 1), *offsets) ]
+		body.append(struct.pack('<%di'%count, *[ n[1][1] for n in keys ]))
+		body.append(struct.pack('<%dd'%count, *[ n[1][2] for n in keys ]))
+		return b''.join(body + pool)
+
+
+# the longest ascii argument which has to occur literally in a matching
+# path, regex arguments of the z matcher don't count
+def _fasd_literal(args, mode):
+	literal = ''
+	for arg in args:
+		if mode in (0, 'f', 'fasd'):
+			arg = arg.endswith('$') and arg[:-1] or arg
+		elif re.escape(arg) != arg:
+			continue
+		if len(arg) > len(literal):
+			literal = arg
+	try:
+		literal.encode('ascii')
+	except (UnicodeError, UnicodeDecodeError):
+		return ''
+	if '\n' in literal:
+		return ''
+	return literal
+
+
+# utf-8 bytes of a path, paths from argv are already bytes on python 2
+def _fasd_utf8(text):
+	if isinstance(text, bytes):
+		return text
+	return text.encode('utf-8')
+
+
+# read-only sequence over fixed-width values in a buffer, for bisect
+class _FasdArray (object):
+
+	def __init__ (self, buf, offset, fmt, count):
+		import struct
+		self.buf = buf
+		self.offset = offset
+		self.fmt = fmt
+		self.width = struct.calcsize(fmt)
+		self.count = count
+		self.unpack = struct.unpack_from
+
+	def __len__ (self):
+		return self.count
+
+	def __getitem__ (self, i):
+		if i < 0 or i >= self.count:
+			raise IndexError(i)
+		return self.unpack(self.fmt, self.buf, self.offset + i * self.width)[0]
+
+
 #----------------------------------------------------------------------
 # data file
 #----------------------------------------------------------------------
@@ -34,9 +229,30 @@ class FasdData (object):
 		self.nocase = False
 		self.maxage = 2000
 		self.exclude = []
+		self.journal = None
+		self.journal_limit = 65536
+		self.binary = None
+		self._index = None
+		self.missing = None
+		self.missing_name = filename + '.missing'
+		self.missing_ttl = 60
+		self._missing_dirty = False
 
 	# load z/fasd compatible file to a list of [path, rank, atime, 0]
+	# and replay the journal on it
 	def load (self):
+		data = self.load_base()
+		if self.journal:
+			records = self.journal_read(self.journal)
+			if records:
+				data = self.replay(data, records)
+		return data
+
+	# load the data file only
+	def load_base (self):
+		index = self.index()
+		if index is not None:
+			return index.items()
 		data = []
 		keys = {}
 		try:
@@ -59,23 +275,90 @@ class FasdData (object):
 			data.append(keys[key])
 		return data
 
-	# save data into text file in the line format of "path|rank|atime" 
+	# open the data file as a binary index, None for the text format
+	def index (self):
+		index = self._index
+		if index is not None:
+			try:
+				st = os.stat(self.name)
+				if (st.st_mtime, st.st_size, st.st_ino) == index.stamp:
+					return index
+			except OSError:
+				pass
+			index.close()
+			self._index = None
+		if not FasdIndex.detect(self.name):
+			return None
+		try:
+			self._index = FasdIndex(self.name)
+		except (IOError, OSError, ValueError):
+			return None
+		if self.binary is None:
+			self.binary = True
+		return self._index
+
+	# entries which may match the query, None for the text format
+	def candidates (self, args, mode):
+		index = self.index()
+		if index is None or index.nocase != self.nocase:
+			return None
+		data = index.candidates(args, mode)
+		records = self.journal and self.journal_read(self.journal) or []
+		if records:
+			keys = {}
+			for item in data:
+				keys[self.nocase and item[0].lower() or item[0]] = 1
+			for op, atime, path in records:
+				key = self.nocase and path.lower() or path
+				if key not in keys:
+					keys[key] = 1
+					item = index.find(path)
+					if item is not None:
+						data.append(item)
+			data = self.replay(data, records, index.total)
+		return data
+
+	# rewrite the data file in binary (True) or text (False) format
+	def convert (self, binary):
+		data = self.load_base()
+		self.binary = binary
+		return self.save(data)
+
+	def _tempname (self, filename):
+		if sys.platform[:3] == 'win':
+			ts = int(time.time() * 1000)
+			ts = hex(ts)[2:]
+		else:
+			ts = int(time.time() * 1000000)
+			ts = hex(ts)[2:]
+		ts += hex(random.randrange(65536))[2:]
+		return filename + '.' + ts.lower()
+
+	# save data into text file in the line format of "path|rank|atime",
+	# or into a binary index if the data file is binary. entries known
+	# to be gone are dropped unless they have been added again since
 	def save (self, data):
-		def make_tempname(filename):
-			if sys.platform[:3] == 'win':
-				ts = int(time.time() * 1000)
-				ts = hex(ts)[2:]
-			else:
-				ts = int(time.time() * 1000000)
-				ts = hex(ts)[2:]
-			ts += hex(random.randrange(65536))[2:]
-			return filename + '.' + ts.lower()
-		tmpname = make_tempname(self.name)
+		missing = self.missing_load()
+		if missing:
+			expire = int(time.time()) - self.missing_ttl
+			for path in [ n for n in missing if missing[n] <= expire ]:
+				del missing[path]
+			data = [ n for n in data if n[2] >= missing.get(n[0], n[2]) ]
+		tmpname = self._tempname(self.name)
 		retval = 0
+		if self.binary is None:
+			self.binary = FasdIndex.detect(self.name)
+		if self._index is not None:
+			self._index.close()
+			self._index = None
 		try:
-			with codecs.open(tmpname, 'w', encoding = 'utf-8') as fp:
-				for path, rank, atime, _ in data:
-					fp.write('%s|%d|%d\n'%(path, rank, atime))
+			if self.binary:
+				with open(tmpname, 'wb') as fp:
+					fp.write(FasdIndex.encode(data, self.nocase))
+			else:
+				with codecs.open(tmpname, 'w', encoding = 'utf-8') as fp:
+					for path, rank, atime, _ in data:
+						fp.write('%s|%d|%d\n'%(path, rank, atime))
 			if self.unix:
 				if self.user:
 					import pwd
@@ -95,20 +378,252 @@ class FasdData (object):
 				pass
 		return retval
 
+	# read journal records: a list of (op, atime, path), op is '+' for
+	# add and '-' for delete, a torn last line is ignored
+	def journal_read (self, filename):
+		records = []
+		try:
+			with codecs.open(filename, 'r', encoding = 'utf-8') as fp:
+				for line in fp:
+					if not line.endswith('\n'):
+						break
+					part = line.rstrip('\n').split('|', 2)
+					if len(part) != 3 or part[0] not in ('+', '-'):
+						continue
+					if not part[1].isdigit() or not part[2]:
+						continue
+					records.append((part[0], int(part[1]), part[2]))
+		except IOError:
+			return []
+		return records
+
+	# apply journal records in order, same rules as insert/remove,
+	# count is the total rank when data is only a part of the database
+	def replay (self, data, records, count = None):
+		keys = {}
+		for item in data:
+			key = self.nocase and item[0].lower() or item[0]
+			keys[key] = item
+		if count is None:
+			count = sum([ n[1] for n in data ])
+		for op, atime, path in records:
+			key = self.nocase and path.lower() or path
+			if op == '-':
+				item = keys.pop(key, None)
+				if item is not None:
+					count -= item[1]
+				continue
+			if count >= self.maxage:
+				for k in list(keys.keys()):
+					if int(keys[k][1] * 0.9) <= 0:
+						count -= keys[k][1]
+						del keys[k]
+			if key in keys:
+				item = keys[key]
+				item[1] += 1
+				item[2] = max(item[2], atime)
+			else:
+				keys[key] = [path, 1, atime, 0]
+			count += 1
+		return [ keys[n] for n in keys ]
+
+	# lock a file descriptor, return False if it can't be locked now
+	def _flock (self, fd, exclusive, wait = True):
+		try:
+			import fcntl
+		except ImportError:
+			return True
+		flag = exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH
+		if not wait:
+			flag |= fcntl.LOCK_NB
+		try:
+			fcntl.flock(fd, flag)
+		except (IOError, OSError):
+			return False
+		return True
+
+	# append records to the journal with a single write, returns the
+	# journal size after appending. writers hold a shared lock so
+	# compact() can wait for them, and retry if the file they opened
+	# has just been folded and unlinked by compact()
+	def journal_append (self, op, paths, atime = None):
+		if atime is None:
+			atime = int(time.time())
+		lines = [ '%s|%d|%s\n'%(op, atime, n) for n in paths if n ]
+		if not lines:
+			return 0
+		text = ''.join(lines).encode('utf-8')
+		flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+		for retry in range(4):
+			fd = os.open(self.journal, flags, 0o644)
+			try:
+				self._flock(fd, False)
+				if os.fstat(fd).st_nlink == 0:
+					continue
+				os.write(fd, text)
+				size = os.fstat(fd).st_size
+			finally:
+				os.close(fd)
+			if size == len(text) and self.unix:
+				self._permission(self.journal)
+			return size
+		return -1
+
+	# apply owner and mode to a newly created file
+	def _permission (self, filename):
+		try:
+			if self.user:
+				import pwd
+				user = pwd.getpwnam(self.user)
+				os.chown(filename, user.pw_uid, user.pw_gid)
+			if self.mode > 0:
+				os.chmod(filename, self.mode)
+		except (KeyError, OSError):
+			return -1
+		return 0
+
+	# fold the journal into the data file under a lock and drop the gone
+	# paths, do nothing if another process is already compacting
+	def compact (self):
+		if not self.journal:
+			return 0
+		lockname = self.name + '.lock'
+		try:
+			lock = os.open(lockname, os.O_RDWR | os.O_CREAT, 0o644)
+		except OSError:
+			return -1
+		try:
+			if not self._flock(lock, True, False):
+				return 1
+			folding = self.journal + '.compact'
+			if not os.path.exists(folding):
+				if not os.path.exists(self.journal):
+					return 0
+				try:
+					os.rename(self.journal, folding)
+				except OSError:
+					return -1
+			fd = os.open(folding, os.O_RDONLY)
+			try:
+				self._flock(fd, True)
+				records = self.journal_read(folding)
+				data = self.replay(self.prune(self.load_base()), records)
+				if self.save(data) != 0:
+					return -1
+				os.remove(folding)
+			finally:
+				os.close(fd)
+		finally:
+			os.close(lock)
+		return 0
+
 	# check existence and filter
 	def filter (self, data, what = 'a'):
 		new_data = []
 		for item in data:
-			if what == 'a':
-				if os.path.exists(item[0]):
-					new_data.append(item)
-			elif what == 'f':
-				if os.path.isfile(item[0]):
-					new_data.append(item)
-			else:
-				if os.path.isdir(item[0]):
-					new_data.append(item)
+			if self.exists(item[0], what):
+				new_data.append(item)
 		return new_data
+
+	# drop the entries whose path is gone, whether or not they are in
+	# the negative cache. every entry is stat'ed, so it only runs in the
+	# aging pass and in compact()
+	def prune (self, data):
+		new_data = []
+		for item in data:
+			try:
+				os.stat(item[0])
+			except OSError as e:
+				if e.errno in (errno.ENOENT, errno.ENOTDIR):
+					continue
+			except (TypeError, ValueError):
+				pass
+			new_data.append(item)
+		return new_data
+
+	# keep the items which exist, stat them in the order of score and
+	# stop after limit hits. paths in the negative cache are skipped
+	# unless they have been added again since they were found gone
+	def available (self, data, what = 'a', limit = None):
+		missing = self.missing_load()
+		expire = int(time.time()) - self.missing_ttl
+		data = sorted(data, key = lambda n: (n[3], n[0]), reverse = True)
+		new_data = []
+		for item in data:
+			if limit is not None and len(new_data) >= limit:
+				break
+			gone = missing.get(item[0])
+			if gone is not None and item[2] < gone and gone > expire:
+				continue
+			if self.exists(item[0], what):
+				new_data.append(item)
+		return new_data
+
+	# stat a path once, what is 'f' for files, 'd' for directories or
+	# 'a' for both, remember it in the negative cache if it is gone
+	def exists (self, path, what = 'a'):
+		try:
+			st = os.stat(path)
+		except OSError as e:
+			if e.errno in (errno.ENOENT, errno.ENOTDIR):
+				if self.missing_ttl > 0:
+					self.missing_load()[path] = int(time.time())
+					self._missing_dirty = True
+			return False
+		except (TypeError, ValueError):
+			return False
+		if what == 'f':
+			return stat.S_ISREG(st.st_mode)
+		elif what == 'd':
+			return stat.S_ISDIR(st.st_mode)
+		return True
+
+	# negative cache of paths known to be gone: {path: time found}
+	def missing_load (self):
+		if self.missing is not None:
+			return self.missing
+		self.missing = {}
+		if self.missing_ttl <= 0:
+			return self.missing
+		limit = int(time.time()) - self.missing_ttl
+		try:
+			with codecs.open(self.missing_name, 'r', encoding = 'utf-8') as fp:
+				for line in fp:
+					part = line.rstrip('\n').split('|', 1)
+					if len(part) != 2 or not part[0].isdigit():
+						continue
+					if int(part[0]) > limit and part[1]:
+						self.missing[part[1]] = int(part[0])
+		except IOError:
+			pass
+		return self.missing
+
+	# write the negative cache back if new gone paths were found
+	def missing_save (self):
+		if not self._missing_dirty:
+			return 0
+		self._missing_dirty = False
+		limit = int(time.time()) - self.missing_ttl
+		lines = []
+		for path, ts in self.missing.items():
+			if ts > limit:
+				lines.append('%d|%s\n'%(ts, path))
+		tmpname = self._tempname(self.missing_name)
+		try:
+			if not lines:
+				if os.path.exists(self.missing_name):
+					os.remove(self.missing_name)
+				return 0
+			with codecs.open(tmpname, 'w', encoding = 'utf-8') as fp:
+				fp.write(''.join(lines))
+			shutil.move(tmpname, self.missing_name)
+			if self.unix:
+				self._permission(self.missing_name)
+		except (IOError, OSError):
+			if os.path.exists(tmpname):
+				os.remove(tmpname)
+			return -1
+		return 0
 			
 	def print (self, data):
 		for path, rank, atime, score in data:
@@ -167,13 +682,11 @@ class FasdData (object):
 		if mode in (0, 'f', 'fasd'):
 			if nocase:
 				args = [ n.lower() for n in args ]
-			f = lambda n: self.string_match_fasd(n[0], args, nocase)
-			m = filter(f, data)
+			m = [ n for n in data if self.string_match_fasd(n[0], args, nocase) ]
 		elif mode in (1, 'z', 2, 'zc'):
 			flags = nocase and re.I or 0
 			patterns = [ re.compile(n, flags) for n in args ]
-			f = lambda n: self.string_match_z(n[0], patterns)
-			m = filter(f, data)
+			m = [ n for n in data if self.string_match_z(n[0], patterns) ]
 		else:
 			return []
 		return m
@@ -240,6 +753,10 @@ class FasdData (object):
 			paths = [paths]
 		current = int(time.time())
 		count = sum([ n[1] for n in data ])
+		if count >= self.maxage:
+			# dead entries must not age the live ones out
+			data = self.prune(data)
+			count = sum([ n[1] for n in data ])
 		if count >= self.maxage:
 			newdata = []
 			for item in data:
@@ -332,10 +849,9 @@ class FasdData (object):
 					path_dict[key] = item
 				else:
 					oi = path_dict[key]
-					rank = oi[1]
-					atime = oi[2]
-					oi[1] = rank + item[1]
-					oi[2] = max(atime, item[2])
+					rank = oi[1] + item[1]
+					atime = max(oi[2], item[2])
+					path_dict[key] = [oi[0], rank, atime, oi[3]]
 		data = []
 		for key in path_dict:
 			data.append(path_dict[key])
@@ -356,7 +872,9 @@ class FasdNg (object):
 		self.common = None
 		self.data = None
 		self.backend_map = {}
+		self.backend_deps = {}
 		self.method = 'frecent'
+		self.register('viminfo', backend_viminfo, [viminfo_name()])
 
 	def _init_environ (self):
 		exclude = os.environ.get('_F_BLACKLIST', '')
@@ -388,12 +906,84 @@ class FasdNg (object):
 		t = os.environ.get('_F_MAX_SCORE', '')
 		if t.isdigit():
 			self.fd.maxage = int(t)
+		t = os.environ.get('_F_FORMAT', '')
+		if t in ('binary', 'text'):
+			self.fd.binary = (t == 'binary')
+		if os.environ.get('_F_JOURNAL', '') in ('1', 'yes', 'true'):
+			self.fd.journal = self.fd.name + '.journal'
+		t = os.environ.get('_F_JOURNAL_SIZE', '')
+		if t.isdigit():
+			self.fd.journal_limit = int(t)
+		t = os.environ.get('_F_MISSING_TTL', '')
+		if t.isdigit():
+			self.fd.missing_ttl = int(t)
+		t = os.environ.get('_F_SERVER', '')
+		if t in ('0', 'no', 'false'):
+			self.server = None
+		elif t:
+			self.server = os.path.expanduser(t)
+		else:
+			self.server = self.address()
 		return 0
 
+	# unix socket of the query server, one per data file in a private
+	# directory: $XDG_RUNTIME_DIR/fasd or ~/.cache/fasd
+	def address (self):
+		import hashlib
+		root = os.environ.get('XDG_RUNTIME_DIR', '')
+		if not root:
+			root = os.environ.get('XDG_CACHE_HOME', '') or '~/.cache'
+		root = os.path.join(os.path.expanduser(root), 'fasd')
+		key = hashlib.md5(_fasd_utf8(self.fd.name)).hexdigest()[:16]
+		return os.path.join(root, 'fasd-%s.sock'%key)
+
+	# only talk to a socket (and its directory) owned by the current
+	# user and not writable by others, so nobody else can pose as the
+	# server. returns 1 for a good socket, 0 if it is missing, -1 else
+	def trusted (self, address):
+		uid = ('getuid' in os.__dict__) and os.getuid() or 0
+		try:
+			st = os.lstat(os.path.dirname(address))
+			if st.st_uid != uid or (st.st_mode & 0o022):
+				return -1
+			st = os.lstat(address)
+		except OSError:
+			return 0
+		if not stat.S_ISSOCK(st.st_mode) or st.st_uid != uid:
+			return -1
+		return 1
+
+	# send one request to the query server, None if it isn't running
+	def remote (self, op, **kwargs):
+		if not self.server or self.trusted(self.server) <= 0:
+			return None
+		import socket, json
+		if not 'AF_UNIX' in socket.__dict__:
+			return None
+		kwargs['op'] = op
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.settimeout(2.0)
+		try:
+			sock.connect(self.server)
+			sock.sendall(json.dumps(kwargs).encode('utf-8') + b'\n')
+			chunks = []
+			while True:
+				data = sock.recv(0x10000)
+				if not data:
+					break
+				chunks.append(data)
+			reply = json.loads(b''.join(chunks).decode('utf-8'))
+		except Exception:
+			return None
+		finally:
+			sock.close()
+		if not isinstance(reply, dict) or reply.get('code') != 0:
+			return None
+		return reply
+
 	def load (self):
 		if self.data is None:
-			data = self.fd.load()
-			self.data = self.fd.filter(data)
+			self.data = self.fd.load()
 		return self.data
 
 	def save (self):
@@ -418,46 +1008,88 @@ class FasdNg (object):
 					continue
 			if path:
 				available.append(path)
+		if not self.readonly and self.remote('add', paths = available):
+			return True
+		if self.fd.journal:
+			paths = [ self.fd.normalize(n) for n in available ]
+			return self._journal('+', [ n for n in paths if n ])
 		self.load()
 		self.data = self.fd.add(self.data, available)
 		self.save()
 		return True
 
 	def delete (self, paths):
+		if not self.readonly and self.remote('delete', paths = paths):
+			return True
+		if self.fd.journal:
+			paths = [ os.path.normpath(n) for n in paths ]
+			return self._journal('-', [ n for n in paths if n ])
 		self.load()
 		self.data = self.fd.delete(self.data, paths)
 		self.save()
 		return True
 
-	# st: f, d, a
-	def search (self, args, st):
-		data = self.load()
+	# journal mode: append one record per path instead of rewriting
+	# the data file, and compact once the journal grows too large
+	def _journal (self, op, paths):
+		if self.data is not None:
+			records = [ (op, int(time.time()), n) for n in paths ]
+			self.data = self.fd.replay(self.data, records)
+		if self.readonly or not paths:
+			return False
+		size = self.fd.journal_append(op, paths)
+		if size > self.fd.journal_limit:
+			self.fd.compact()
+		return True
+
+	# st: f, d, a. entries are matched and scored in memory first,
+	# then only the best ones are stat'ed until limit of them exist
+	def search (self, args, st, limit = None):
+		reply = self.remote('query', args = args, st = st, limit = limit,
+				matcher = self.matcher, method = self.method,
+				backends = list(self.backends.keys()))
+		if reply is not None:
+			self.common = reply.get('common')
+			return reply.get('data', [])
+		data = self.candidates(args)
 		for backend in self.backends:
-			source = []
 			try:
-				if backend.startswith('+'):
-					source = self.backend_command(backend[1:])
-				elif backend in self.backend_map:
-					b = self.backend_map[backend]
-					source = b()
+				source = self.backend(backend)
 			except:
 				continue
-			source = self.fd.filter(source)
 			data = self.fd.converge([data, source])
 		self.common = None
-		m = self.fd.search(data, args, self.matcher)
-		if st == 'f':
-			m = filter(lambda n: os.path.isfile(n[0]), m)
-		elif st == 'd':
-			m = filter(lambda n: os.path.isdir(n[0]), m)
+		if st == 'd' and self.matcher != 0:
+			limit = None
+		m = self.fd.match(data, args, self.fd.nocase, self.matcher)
+		m = self._available(m, st, limit)
+		if not m and not self.fd.nocase:
+			# every case sensitive match may be gone, ignore case then
+			m = self.fd.match(data, args, True, self.matcher)
+			m = self._available(m, st, limit)
+		if st == 'd':
 			self.common = self.fd.common(m, args)
+		if not self.readonly:
+			self.fd.missing_save()
+		return m
+
+	# score the matched entries and keep the best ones which exist
+	def _available (self, m, st, limit):
 		if self.method in (0, '0', 'f', 'frecent'):
 			self.fd.score(m, 'f')
 		elif self.method in (1, '1', 'r', 'rank', 'ranked'):
 			self.fd.score(m, 'r')
 		else:
 			self.fd.score(m, 't')
-		return m
+		return self.fd.available(m, st, limit)
+
+	# entries which may match the query
+	def candidates (self, args):
+		if self.data is None:
+			data = self.fd.candidates(args, self.matcher)
+			if data is not None:
+				return data
+		return self.load()
 
 	# query one result
 	def query (self, args, mode):
@@ -465,7 +1097,7 @@ class FasdNg (object):
 			lastarg = args[-1]
 			if os.path.isabs(lastarg) and os.path.exists(lastarg):
 				return lastarg
-		m = self.search(args, mode)
+		m = self.search(args, mode, 1)
 		if not m:
 			return None
 		if self.matcher != 0:
@@ -505,22 +1137,36 @@ class FasdNg (object):
 			data.append([path, rank, atime, score])
 		return data
 		
-	def register (self, name, backend_function):
+	# run a backend: "+command" or a registered name
+	def backend (self, name):
+		if name.startswith('+'):
+			return self.backend_command(name[1:])
+		elif name in self.backend_map:
+			return self.backend_map[name]()
+		return []
+
+	# depends: files whose change invalidates the cached backend result
+	def register (self, name, backend_function, depends = None):
 		self.backend_map[name] = backend_function
+		self.backend_deps[name] = depends
 		return True
 
 
 #----------------------------------------------------------------------
 # backend_viminfo 
 #----------------------------------------------------------------------
-def backend_viminfo():
-	data = []
+def viminfo_name():
 	viminfo = os.environ.get('_F_VIMINFO', '')
 	if not viminfo:
 		if sys.platform[:3] != 'win':
 			viminfo = os.path.expanduser('~/.viminfo')
 		else:
 			viminfo = os.path.expanduser('~/_viminfo')
+	return viminfo
+
+def backend_viminfo():
+	data = []
+	viminfo = viminfo_name()
 	if not os.path.exists(viminfo):
 		return data
 	current = int(time.time())
@@ -574,9 +1220,200 @@ def backend_viminfo():
 			if '~' in name:
 				item[0] = os.path.expanduser(name)
 			new_data.append(item)
-	# return data
-	data = filter(lambda n: os.path.exists(n[0]), new_data)
-	return data
+	return new_data
+
+
+#----------------------------------------------------------------------
+# FasdServer: long-lived query server on a unix socket, keeps the data,
+# backend results and a match index in memory. a request is one json
+# line with "op" (query/add/delete/stop) and its arguments, the reply
+# is one json line with "code" and, for queries, "data" and "common".
+#----------------------------------------------------------------------
+class FasdServer (FasdNg):
+
+	def __init__ (self):
+		super(FasdServer, self).__init__()
+		self.listen = self.server
+		self.server = None
+		self.stamp = None
+		self.cache = {}
+		self.items = None
+		self.ids = None
+		self.text = None
+		self.offsets = None
+
+	# stat of the data file and journal, to notice other writers
+	def _stamp (self):
+		stamp = []
+		for name in (self.fd.name, self.fd.journal):
+			try:
+				st = os.stat(name)
+				stamp.append((st.st_mtime, st.st_size, st.st_ino))
+			except (OSError, TypeError):
+				stamp.append(None)
+		return stamp
+
+	# reload the data if somebody else has changed the files
+	def refresh (self):
+		stamp = self._stamp()
+		if stamp != self.stamp or self.data is None:
+			self.data = None
+			self.load()
+			self.stamp = stamp
+		return self.data
+
+	# match index: lower-cased paths joined by '\n' and their offsets,
+	# rebuilt when the entries themselves (not their ranks) change
+	def reindex (self):
+		data = self.load()
+		if self.items is data:
+			return 0
+		if self.ids is not None and len(self.ids) == len(data):
+			ids = self.ids
+			if not [ n for n in data if id(n) not in ids ]:
+				self.items = data
+				return 0
+		names = [ n[0].lower() for n in data ]
+		offsets = [0]
+		for name in names:
+			offsets.append(offsets[-1] + len(name) + 1)
+		self.items = data
+		self.ids = set([ id(n) for n in data ])
+		self.text = '\n'.join(names)
+		self.offsets = offsets
+		return 1
+
+	# scan the match index for the longest literal argument
+	def candidates (self, args):
+		import bisect
+		literal = _fasd_literal(args, self.matcher).lower()
+		self.reindex()
+		if not literal:
+			return self.items
+		data = []
+		pos = 0
+		while True:
+			pos = self.text.find(literal, pos)
+			if pos < 0:
+				break
+			i = bisect.bisect_right(self.offsets, pos) - 1
+			data.append(self.items[i])
+			pos = self.offsets[i + 1]
+		return data
+
+	# cache registered backends until one of their files changes
+	def backend (self, name):
+		depends = self.backend_deps.get(name)
+		if name.startswith('+') or not depends:
+			return FasdNg.backend(self, name)
+		stamp = []
+		for fn in depends:
+			try:
+				st = os.stat(fn)
+				stamp.append((st.st_mtime, st.st_size, st.st_ino))
+			except OSError:
+				stamp.append(None)
+		hit = self.cache.get(name)
+		if hit is not None and hit[0] == stamp:
+			return hit[1]
+		data = FasdNg.backend(self, name)
+		self.cache[name] = (stamp, data)
+		return data
+
+	# handle one decoded request, returns the reply
+	def execute (self, request):
+		op = request.get('op')
+		self.refresh()
+		if op == 'query':
+			self.matcher = request.get('matcher', 0)
+			self.method = request.get('method', 'frecent')
+			self.backends = {}
+			for name in request.get('backends', []):
+				self.backends[name] = 1
+			args = request.get('args', [])
+			st = request.get('st', 'a')
+			m = self.search(args, st, request.get('limit'))
+			data = [ [n[0], n[1], n[2], n[3]] for n in m ]
+			return {'code': 0, 'data': data, 'common': self.common}
+		elif op in ('add', 'delete'):
+			paths = request.get('paths', [])
+			if op == 'add':
+				self.add(paths)
+			else:
+				self.delete(paths)
+			self.stamp = self._stamp()
+			return {'code': 0}
+		elif op == 'stop':
+			return {'code': 0}
+		return {'code': 1, 'error': 'unknown op: %s'%op}
+
+	# serve requests on the unix socket until a "stop" request
+	def serve (self):
+		import socket, json
+		if not 'AF_UNIX' in socket.__dict__:
+			sys.stderr.write('error: server requires unix domain sockets\n')
+			return -1
+		address = self.listen
+		if not address:
+			sys.stderr.write('error: server disabled by _F_SERVER\n')
+			return -1
+		root = os.path.dirname(address)
+		if not os.path.isdir(root):
+			os.makedirs(root, 0o700)
+		trusted = self.trusted(address)
+		if trusted < 0:
+			sys.stderr.write('error: %s is not a socket owned by you ' \
+					'in a private directory\n'%address)
+			return -1
+		elif trusted > 0:
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				sock.connect(address)
+				sock.close()
+				sys.stderr.write('error: server running on %s\n'%address)
+				return -1
+			except socket.error:
+				sock.close()
+			os.remove(address)
+		server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		umask = os.umask(0o077)
+		try:
+			server.bind(address)
+		finally:
+			os.umask(umask)
+		server.listen(16)
+		self.refresh()
+		running = True
+		while running:
+			try:
+				conn, addr = server.accept()
+			except KeyboardInterrupt:
+				break
+			except socket.error:
+				continue
+			try:
+				conn.settimeout(2.0)
+				fp = conn.makefile('rb')
+				line = fp.readline()
+				fp.close()
+				request = json.loads(line.decode('utf-8'))
+				if not isinstance(request, dict):
+					raise ValueError('bad request')
+				reply = self.execute(request)
+				running = (request.get('op') != 'stop')
+			except KeyboardInterrupt:
+				break
+			except Exception as e:
+				reply = {'code': -1, 'error': str(e)}
+			try:
+				conn.sendall(json.dumps(reply).encode('utf-8') + b'\n')
+			except Exception:
+				pass
+			conn.close()
+		server.close()
+		if os.path.exists(address):
+			os.remove(address)
+		return 0
 
 
 #----------------------------------------------------------------------
@@ -740,6 +1577,16 @@ doc_help = '''fasd [options] [query ...]
 fasd [-A|-D] [paths ...]
     -A    add paths
     -D    delete paths
+
+fasd --compact
+    fold the journal (enabled by _F_JOURNAL=1) into the data file
+
+fasd --convert=<binary|text>
+    rewrite the data file in the binary index or z/fasd text format
+
+fasd --server[=stop]
+    run (or stop) the query server which keeps the data in memory,
+    clients use it when it is running unless _F_SERVER=0
 '''
 
 #----------------------------------------------------------------------
@@ -764,6 +1611,25 @@ def main(args = None):
 		if paths:
 			fn.delete(paths)
 		return 0
+	# fold the journal into the data file
+	elif first == '--compact':
+		fn.fd.compact()
+		return 0
+	# run the query server, or stop it
+	elif first in ('--server', '--server=stop'):
+		if first == '--server':
+			return FasdServer().serve()
+		if fn.remote('stop') is None:
+			return 1
+		return 0
+	# convert the data file between binary and text format
+	elif first.startswith('--convert='):
+		fmt = first[len('--convert='):].strip('\r\n\t ')
+		if fmt not in ('binary', 'text'):
+			print(doc_help)
+			return 1
+		fn.fd.convert(fmt == 'binary')
+		return 0
 	# process paths
 	elif first.startswith('--proc'):
 		head = '--proc='
@@ -800,11 +1666,11 @@ def main(args = None):
 			break
 		if arg == '-b':
 			if pos + 1 < len(args):
-				fn.backends = [arg[pos + 1]]
+				fn.backends = { args[pos + 1]: 1 }
 			pos += 2
 		elif arg == '-B':
 			if pos + 1 < len(args):
-				fn.backends.append(args[pos + 1])
+				fn.backends[args[pos + 1]] = 1
 			pos += 2
 		elif arg == '-e':
 			if pos + 1 < len(args):
@@ -0,0 +1,649 @@
+#! /usr/bin/env python2
+# -*- coding: utf-8 -*-
+#======================================================================
+#
+# test_emake.py - regression tests for lib/emake.py (python 2)
+#
+#   python2 tools/test/test_emake.py
+#
+#======================================================================
+import sys
+import os
+import time
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import unittest
+
+LIBDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../lib')
+EMAKE = os.path.abspath(os.path.join(LIBDIR, 'emake.py'))
+
+sys.path.insert(0, os.path.abspath(LIBDIR))
+import emake
+
+
+#----------------------------------------------------------------------
+# projects are built with tool stubs: gcc and ld only log the command
+# line to <tool>.log and create the file after -o, STUB_FAIL makes
+# every command line containing it fail; ar keeps the member names
+# in the archive, one per line
+#----------------------------------------------------------------------
+STUB = '''#! /bin/sh
+echo "$*" >> "$0.log"
+if [ -n "$STUB_FAIL" ]; then
+	case "$*" in *"$STUB_FAIL"*) exit 1 ;; esac
+fi
+while [ $# -gt 0 ]; do
+	if [ "$1" = "-o" ]; then shift; echo obj > "$1"; fi
+	shift
+done
+'''
+
+AR = '''#! /bin/sh
+echo "$*" >> "$0.log"
+mode=$1; lib=$2; shift 2
+case "$mode" in
+	t) cat "$lib" ;;
+	crv) : > "$lib" ;;
+esac
+for name in "$@"; do
+	name=`basename "$name"`
+	grep -qx "$name" "$lib" || echo "$name" >> "$lib"
+done
+'''
+
+class BuildCase (unittest.TestCase):
+
+	def setUp (self):
+		self.root = tempfile.mkdtemp(prefix = 'emake-test-')
+		self.environ = {}
+		bindir = os.path.join(self.root, 'bin')
+		os.mkdir(bindir)
+		for name, text in (('gcc', STUB), ('ld', STUB), ('ar', AR)):
+			self.write(os.path.join(bindir, name), text)
+			os.chmod(os.path.join(bindir, name), 0755)
+		self.ini = os.path.join(self.root, 'stub.ini')
+		self.write(self.ini, '[default]\nhome=%s\ngcc=gcc\n'%bindir)
+
+	def tearDown (self):
+		shutil.rmtree(self.root, True)
+
+	def path (self, name):
+		return os.path.join(self.root, name)
+
+	def write (self, name, text):
+		fp = open(self.path(name), 'w')
+		fp.write(text)
+		fp.close()
+
+	def run_emake (self, *options):
+		args = [ sys.executable, EMAKE, '--ini=' + self.ini ]
+		args.extend(options)
+		args.extend([ '-b', self.path('p.mak') ])
+		environ = dict(os.environ)
+		environ['XDG_CACHE_HOME'] = self.path('cache')
+		environ.update(self.environ)
+		p = subprocess.Popen(args, stdout = subprocess.PIPE,
+				stderr = subprocess.STDOUT, env = environ, cwd = self.root)
+		output = p.communicate()[0]
+		return p.returncode, output
+
+	def build (self, *options):
+		code, output = self.run_emake(*options)
+		self.assertEqual(code, 0, output)
+		return output
+
+	def objects (self):
+		names = os.listdir(self.path('objs'))
+		return sorted([ n for n in names if n[-2:] == '.o' ])
+
+	# command lines the tool ran since the last call
+	def calls (self, tool = 'gcc'):
+		name = self.path('bin/%s.log'%tool)
+		if not os.path.exists(name):
+			return []
+		lines = open(name).read().splitlines()
+		os.remove(name)
+		return lines
+
+	# sources compiled since the last call
+	def compiled (self):
+		names = []
+		for line in self.calls('gcc'):
+			args = line.split()
+			if '-c' in args:
+				names.append(os.path.basename(args[args.index('-c') + 1]))
+		return sorted(names)
+
+
+#----------------------------------------------------------------------
+# object cache
+#----------------------------------------------------------------------
+class CacheTest (BuildCase):
+
+	def setUp (self):
+		BuildCase.setUp(self)
+		self.write('a.h', '#define A 1\n')
+		self.write('a.c', '#include "a.h"\nint a(void) { return A; }\n')
+		self.write('main.c', 'int main(void) { return 0; }\n')
+		self.write('p.mak', 'mode: exe\nout: prog\nint: objs\nsrc: a.c\nsrc: main.c\n')
+		self.cache = '--cache=' + self.path('objcache')
+
+	def test_hit (self):
+		self.build(self.cache)
+		self.assertEqual(self.compiled(), ['a.c', 'main.c'])
+		shutil.rmtree(self.path('objs'))
+		self.build(self.cache)
+		self.assertEqual(self.compiled(), [])
+		self.assertEqual(self.objects(), ['a.o', 'main.o'])
+		hits, misses, files, size = emake.objcache(self.path('objcache')).stats()
+		self.assertEqual((hits, misses, files), (2, 2, 2))
+
+	def test_header (self):
+		self.build(self.cache)
+		self.calls()
+		time.sleep(0.05)
+		self.write('a.h', '#define A 2\n')
+		self.build(self.cache)
+		self.assertEqual(self.compiled(), ['a.c'])
+		time.sleep(0.05)
+		self.write('a.h', '#define A 1\n')
+		self.build(self.cache)
+		self.assertEqual(self.compiled(), [])
+
+	def test_evict (self):
+		cache = emake.objcache(self.path('objcache'), 250)
+		obj = self.path('x.o')
+		self.write(obj, 'x' * 100)
+		keys = [ '%040x'%i for i in xrange(4) ]
+		for i, key in enumerate(keys):
+			cache.store(key, obj)
+			os.utime(cache._cachename(key), (1000 + i, 1000 + i))
+		self.assertEqual(cache.evict(), 2)
+		self.assertFalse(cache.fetch(keys[0], obj))
+		self.assertFalse(cache.fetch(keys[1], obj))
+		self.assertTrue(cache.fetch(keys[3], obj))
+		self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+
+#----------------------------------------------------------------------
+# dependency database
+#----------------------------------------------------------------------
+class DepdbTest (BuildCase):
+
+	def test_append (self):
+		name = self.path('p.pdb')
+		db = emake.depdb(name)
+		self.assertEqual(db.load(), -1)
+		db.update('/a.c', ['/a.c', '/a.h'], [1.0, 2.0], [10, 20])
+		db.save(['/a.c'])
+		size = os.path.getsize(name)
+		db.update('/b.c', ['/b.c', '/a.h'], [3.0, 2.0], [30, 20])
+		db.save(['/b.c'])
+		self.assertTrue(os.path.getsize(name) > size)
+		db = emake.depdb(name)
+		self.assertEqual(db.load(), 0)
+		self.assertEqual(db.rows['/a.c'], (['/a.c', '/a.h'], (1.0, 2.0), (10, 20)))
+		self.assertEqual(db.rows['/b.c'], (['/b.c', '/a.h'], (3.0, 2.0), (30, 20)))
+		self.assertEqual(db.records, 2)
+
+	def test_truncated (self):
+		name = self.path('p.pdb')
+		db = emake.depdb(name)
+		db.update('/a.c', ['/a.c'], [1.0], [10])
+		db.save(['/a.c'])
+		db.update('/b.c', ['/b.c'], [2.0], [20])
+		db.save(['/b.c'])
+		fp = open(name, 'r+b')
+		fp.truncate(os.path.getsize(name) - 4)
+		fp.close()
+		db = emake.depdb(name)
+		self.assertEqual(db.load(), 0)
+		self.assertEqual(db.rows.keys(), ['/a.c'])
+
+	def test_compact (self):
+		name = self.path('p.pdb')
+		db = emake.depdb(name)
+		for i in xrange(200):
+			db.update('/a.c', ['/a.c'], [float(i)], [i])
+			db.save(['/a.c'])
+		self.assertTrue(db.records <= 66)
+		db = emake.depdb(name)
+		self.assertEqual(db.load(), 0)
+		self.assertEqual(db.rows['/a.c'], (['/a.c'], (199.0,), (199,)))
+
+	# a .p file written by the old version is imported and trusted, the
+	# sources are not scanned again
+	def test_legacy (self):
+		self.write('a.c', 'int a(void) { return 0; }\n')
+		self.write('x.h', '\n')
+		self.write('p.mak', 'mode: exe\nout: prog\nint: objs\nsrc: a.c\n')
+		self.build()
+		os.remove(self.path('objs/p.pdb'))
+		items = []
+		for name in ('a.c', 'x.h'):
+			mtime = os.stat(self.path(name)).st_mtime
+			items.append('%s, %.6f'%(self.path(name), mtime))
+		self.write('objs/p.p', '%s = %s\n'%(self.path('a.c'), ', '.join(items)))
+		self.calls()
+		self.build()
+		self.assertEqual(self.compiled(), [])
+		db = emake.depdb(self.path('objs/p.pdb'))
+		self.assertEqual(db.load(), 0)
+		self.assertTrue(self.path('x.h') in db.rows[self.path('a.c')][0])
+
+
+#----------------------------------------------------------------------
+# header scanner: search_reference must find the same includes as
+# search_reference_legacy
+#----------------------------------------------------------------------
+class ScannerTest (unittest.TestCase):
+
+	CASES = [
+		'/* a\n b */ #include "b.h"\n',
+		'/* a\n b */ x; /* c */ #include "no.h"\n',
+		'/* a\n b **/ #include "b.h"\n',
+		'/* a\n\n b */ /* c\n */ # include "b.h"\n',
+		'/*/\n*/#include "b.h"\n',
+		'int x; /* c */ #include "no.h"\n',
+		'/* c */ #include "b.h"\n',
+		'"str /* " #include "no.h"\n',
+		'// #include "no.h"\n',
+		'  #  include "b.h" // tail\n',
+		'/* open\n#include "no.h"\n',
+		'char c = \'"\'; #include "no.h"\n#include "b.h"\n',
+	]
+
+	def setUp (self):
+		self.root = tempfile.mkdtemp(prefix = 'emake-scan-')
+		self.pst = emake.preprocessor()
+
+	def tearDown (self):
+		shutil.rmtree(self.root, True)
+
+	def compare (self, text):
+		name = os.path.join(self.root, 'source.c')
+		fp = open(name, 'w')
+		fp.write(text)
+		fp.close()
+		heads1, heads2 = [], []
+		self.pst.search_reference_legacy(name, heads1)
+		self.pst.search_reference(name, heads2)
+		self.assertEqual(heads1, heads2, repr(text))
+		return heads2
+
+	def test_cases (self):
+		for text in self.CASES:
+			heads = self.compare(text)
+			self.assertFalse([ n for n in heads if n[0] == 'no.h' ], text)
+
+	def test_comment_before_include (self):
+		heads = self.compare('/* a\n b */ #include "b.h"\n')
+		self.assertEqual([ n[0] for n in heads ], ['b.h'])
+
+	# the legacy scanner only accepts spaces for indentation, tokens are
+	# separated by spaces here, tab indented includes are tested below
+	def test_random (self):
+		import random
+		rand = random.Random(7)
+		parts = [ '/*', '*/', '/* */', '//', '"s"', "'c'", '"/*"', "'\"'",
+				'"\\""', '\n', '\n', 'x', '#', 'include', '"a.h"',
+				'#include "b.h"' ]
+		for i in xrange(5000):
+			text = ' '.join([ rand.choice(parts) for j in xrange(24) ])
+			self.compare(text)
+
+	def test_tab_indent (self):
+		name = os.path.join(self.root, 'source.c')
+		fp = open(name, 'w')
+		fp.write('#ifdef X\n\t#include "b.h"\n#endif\n')
+		fp.close()
+		heads = []
+		self.pst.search_reference(name, heads)
+		self.assertEqual([ n[0] for n in heads ], ['b.h'])
+
+
+#----------------------------------------------------------------------
+# compile times: only successful compiles of current sources are kept
+#----------------------------------------------------------------------
+class TimingTest (BuildCase):
+
+	def setUp (self):
+		BuildCase.setUp(self)
+		self.write('a.c', 'int a(void) { return 0; }\n')
+		self.write('b.c', 'int b(void) { return 0; }\n')
+		self.write('p.mak', 'mode: exe\nout: prog\nint: objs\nsrc: a.c\nsrc: b.c\n')
+
+	def times (self):
+		db = emake.timedb(self.path('objs/p.time'))
+		db.load()
+		return sorted([ os.path.basename(n) for n in db.times ])
+
+	def test_failed (self):
+		self.environ['STUB_FAIL'] = 'b.c'
+		code, output = self.run_emake('--cpu=1')
+		self.assertNotEqual(code, 0)
+		self.assertEqual(self.times(), ['a.c'])
+
+	def test_prune (self):
+		self.build()
+		self.assertEqual(self.times(), ['a.c', 'b.c'])
+		self.write('p.mak', 'mode: exe\nout: prog\nint: objs\nsrc: a.c\n')
+		self.write('a.c', 'int a(void) { return 1; }\n')
+		self.build()
+		self.assertEqual(self.times(), ['a.c'])
+
+
+#----------------------------------------------------------------------
+# unity build
+#----------------------------------------------------------------------
+class UnityTest (BuildCase):
+
+	def setUp (self):
+		BuildCase.setUp(self)
+		for name in ('a.c', 'b.c', 'c.c', 'd.cpp'):
+			self.write(name, 'int %s(void) { return 0; }\n'%name[0])
+
+	def test_plan (self):
+		sources = [ self.path(n) for n in ('a.c', 'b.c', 'c.c', 'd.cpp') ]
+		costs = dict([ (n, 1.0) for n in sources ])
+		build = emake.unity('p', self.path('objs'), 2)
+		batches = build.plan(sources, {}, costs)
+		name = self.path('objs/p.unity1.c')
+		self.assertEqual(batches, { name: sources[:2] })
+		build.write()
+		text = open(name).read()
+		self.assertTrue('#include "%s"\n'%sources[1] in text)
+		self.write('objs/p.unity1.o', '')
+		os.utime(name, (1, 1))
+		build = emake.unity('p', self.path('objs'), 2)
+		self.assertEqual(build.plan(sources, {}, costs), batches)
+		build.write()
+		self.assertEqual(os.stat(name).st_mtime, 1)
+		self.assertTrue(os.path.exists(self.path('objs/p.unity1.o')))
+		build = emake.unity('p', self.path('objs'), 2)
+		self.assertEqual(build.plan(sources[2:], {}, costs), {})
+		build.write()
+		self.assertFalse(os.path.exists(name))
+		self.assertFalse(os.path.exists(self.path('objs/p.unity1.o')))
+
+	# a failed unit is compiled member by member and joined with ld -r
+	def test_fallback (self):
+		self.write('p.mak', 'mode: exe\nout: prog\nint: objs\nsrc: a.c\nsrc: b.c\n')
+		self.environ['STUB_FAIL'] = 'unity1.c'
+		self.build('--unity=on', '--cpu=1')
+		self.assertEqual(self.compiled(), ['a.c', 'b.c', 'p.unity1.c'])
+		self.assertEqual(self.objects(), ['a.o', 'b.o', 'p.unity1.o'])
+		link = [ n for n in self.calls('ld') if n.startswith('-r ') ]
+		self.assertEqual(len(link), 1)
+		self.assertTrue('p.unity1.o' in link[0])
+
+
+#----------------------------------------------------------------------
+# compile_commands.json
+#----------------------------------------------------------------------
+class CompdbTest (BuildCase):
+
+	def entry (self, name, command):
+		filename = self.path(name)
+		return (filename, emake.compdb.format(self.root, filename,
+			filename[:-2] + '.o', command))
+
+	def test_merge (self):
+		self.write('a.c', '')
+		self.write('other.c', '')
+		items = [ {'directory': self.root, 'file': 'other.c',
+			'arguments': ['cc', '-c', 'other.c']},
+			{'directory': self.root, 'file': 'gone.c', 'command': 'cc -c gone.c'},
+			{'directory': self.root, 'file': 'a.c', 'command': 'cc -c a.c'} ]
+		self.write('compile_commands.json', json.dumps(items, indent = 4))
+		db = emake.compdb(self.path('compile_commands.json'))
+		self.assertTrue(db.update([ self.entry('a.c', 'gcc -O2 -c a.c') ]))
+		items = json.load(open(self.path('compile_commands.json')))
+		self.assertEqual([ n['file'] for n in items ],
+				[ self.path('a.c'), self.path('other.c') ])
+		self.assertEqual(items[0]['command'], 'gcc -O2 -c a.c')
+		self.assertEqual(items[1]['command'], 'cc -c other.c')
+		self.assertEqual(db.count, 2)
+
+	def test_unchanged (self):
+		self.write('a.c', '')
+		self.write('b.c', '')
+		name = self.path('compile_commands.json')
+		entries = [ self.entry('a.c', 'gcc -c a.c'), self.entry('b.c', 'gcc -c b.c') ]
+		db = emake.compdb(name)
+		self.assertTrue(db.update(entries))
+		os.utime(name, (1, 1))
+		self.assertFalse(db.update(entries[:1]))
+		self.assertEqual(os.stat(name).st_mtime, 1)
+		self.assertEqual(db.count, 2)
+		self.assertTrue(db.update([ self.entry('a.c', 'gcc -O2 -c a.c') ]))
+
+
+#----------------------------------------------------------------------
+# distributed compile: the loopback worker runs in this process and
+# talks the full protocol over a socketpair
+#----------------------------------------------------------------------
+class RemoteTest (BuildCase):
+
+	def setUp (self):
+		BuildCase.setUp(self)
+		self.saved = (emake.INIPATH, dict(emake.CFG))
+		emake.INIPATH = self.ini
+		emake.CFG['token'] = 'secret'
+		emake.CFG['probe'] = False
+		self.write('a.c', 'int a(void) { return 0; }\n')
+		self.config = emake.configure()
+		self.config.init()
+		self.config.loadcfg()
+
+	def tearDown (self):
+		emake.INIPATH = self.saved[0]
+		emake.CFG.clear()
+		emake.CFG.update(self.saved[1])
+		BuildCase.tearDown(self)
+
+	def test_loopback (self):
+		client = emake.remote(self.config, ['loopback'])
+		client.compile(self.path('a.c'), self.path('a.o'), '-O2')
+		client.close()
+		self.assertEqual(client.counters['remote'], 1)
+		self.assertEqual(open(self.path('a.o')).read(), 'obj\n')
+		calls = self.calls()
+		self.assertTrue([ n for n in calls if '-x cpp-output -O2' in n ], calls)
+
+	def test_bad_token (self):
+		client = emake.remote(self.config, ['loopback'])
+		client.token = 'wrong'
+		client.compile(self.path('a.c'), self.path('a.o'), '')
+		client.close()
+		self.assertEqual(client.counters['remote'], 0)
+		self.assertEqual(client.counters['retry'], 1)
+		self.assertEqual(client.counters['local'], 1)
+		self.assertFalse([ n for n in self.calls() if 'cpp-output' in n ])
+
+	def test_auth (self):
+		server = emake.worker(self.config)
+		sock, peer = socket.socketpair()
+		th = threading.Thread(target = server.session, args = (peer,))
+		th.start()
+		nonce = emake._message_recv(sock)[0]['nonce']
+		emake._message_send(sock, {'auth': emake._worker_sign('wrong', nonce)})
+		self.assertEqual(emake._message_recv(sock)[0]['code'], -1)
+		self.assertEqual(emake._message_recv(sock), None)
+		th.join()
+		sock.close()
+
+	def test_flags (self):
+		for flag in ('-O2', '-g', '-Wall', '-std=c99', '-DNAME="a/b"', '-fPIC'):
+			self.assertTrue(emake._worker_flag(flag), flag)
+		for flag in ('-B', '-Bbin', '-B/usr/bin', '-wrapper', '-fplugin=x.so',
+				'-fplugin=/tmp/x.so', '-fplugin-arg-x-y=1', '-specs=x',
+				'-o', '-Wa,-o,x', '-I/usr/include', 'a.c', None):
+			self.assertFalse(emake._worker_flag(flag), flag)
+
+
+#----------------------------------------------------------------------
+# incremental static library
+#----------------------------------------------------------------------
+class ArchiveTest (BuildCase):
+
+	def setUp (self):
+		BuildCase.setUp(self)
+		self.write('a.c', 'int a(void) { return 0; }\n')
+		self.write('b.c', 'int b(void) { return 0; }\n')
+		self.write('p.mak', 'mode: lib\nout: libp.a\nint: objs\nsrc: a.c\nsrc: b.c\n')
+
+	def archive (self):
+		return [ n.split() for n in self.calls('ar') if n[:2] != 't ' ]
+
+	def test_replace (self):
+		self.build()
+		calls = self.archive()
+		self.assertEqual([ (n[0], sorted(n[2:])) for n in calls ],
+				[ ('crv', ['objs/a.o', 'objs/b.o']) ])
+		time.sleep(0.05)
+		self.write('b.c', 'int b(void) { return 1; }\n')
+		self.build()
+		calls = self.archive()
+		self.assertEqual([ (n[0], n[2:]) for n in calls ], [ ('rv', ['objs/b.o']) ])
+		self.assertEqual(open(self.path('libp.a')).read(), 'a.o\nb.o\n')
+
+	# members which do not match the objects force a full archive
+	def test_members (self):
+		self.build()
+		self.calls('ar')
+		self.write('libp.a', 'a.o\nold.o\n')
+		time.sleep(0.05)
+		self.write('b.c', 'int b(void) { return 1; }\n')
+		self.build()
+		calls = self.archive()
+		self.assertEqual([ (n[0], sorted(n[2:])) for n in calls ],
+				[ ('crv', ['objs/a.o', 'objs/b.o']) ])
+		self.assertEqual(open(self.path('libp.a')).read(), 'a.o\nb.o\n')
+
+
+#----------------------------------------------------------------------
+# benchmark baseline
+#----------------------------------------------------------------------
+class BenchTest (unittest.TestCase):
+
+	def report (self, full, noop, scan):
+		project = { 'sources': 10, 'headers': 2 }
+		phases = { 'full': { 'wall': full, 'spans': { 'dependence.scan': scan } },
+			'noop': { 'wall': noop } }
+		return { 'project': project, 'phases': phases }
+
+	def test_compare (self):
+		stderr = sys.stderr
+		sys.stderr = open(os.devnull, 'w')
+		try:
+			base = self.report(1.0, 0.1, 0.5)
+			compare = emake.benchmark_compare
+			self.assertEqual(compare(self.report(1.1, 0.1, 0.5), base), [])
+			self.assertEqual(compare(self.report(1.0, 0.105, 0.5), base), [])
+			self.assertEqual(compare(self.report(1.5, 0.2, 0.5), base),
+					['full', 'noop'])
+			self.assertEqual(compare(self.report(1.0, 0.1, 0.7), base, 0.5), [])
+			self.assertEqual(compare(self.report(1.0, 0.1, 0.7), base), ['scan'])
+			report = self.report(1.0, 0.1, 0.5)
+			report['project'] = { 'sources': 20, 'headers': 2 }
+			self.assertEqual(compare(report, base), None)
+		finally:
+			sys.stderr.close()
+			sys.stderr = stderr
+
+
+#----------------------------------------------------------------------
+# dirty sources: a changed header only rebuilds the sources using it
+#----------------------------------------------------------------------
+class DirtyTest (BuildCase):
+
+	def setUp (self):
+		BuildCase.setUp(self)
+		self.write('a.h', '#define A 1\n')
+		self.write('b.h', '#include "a.h"\n')
+		self.write('a.c', '#include "a.h"\nint a(void) { return A; }\n')
+		self.write('b.c', '#include "b.h"\nint b(void) { return A; }\n')
+		self.write('c.c', 'int c(void) { return 0; }\n')
+		text = 'mode: exe\nout: prog\nint: objs\nsrc: a.c\nsrc: b.c\nsrc: c.c\n'
+		self.write('p.mak', text)
+
+	def test_header (self):
+		self.build()
+		self.assertEqual(self.compiled(), ['a.c', 'b.c', 'c.c'])
+		time.sleep(0.05)
+		self.write('b.h', '#include "a.h"\n\n')
+		self.build()
+		self.assertEqual(self.compiled(), ['b.c'])
+		time.sleep(0.05)
+		self.write('a.h', '#define A 2\n')
+		self.build()
+		self.assertEqual(self.compiled(), ['a.c', 'b.c'])
+
+	# a missing object is rebuilt even if nothing it depends on changed
+	def test_object (self):
+		self.build()
+		self.calls()
+		os.remove(self.path('objs/c.o'))
+		self.build()
+		self.assertEqual(self.compiled(), ['c.c'])
+
+
+#----------------------------------------------------------------------
+# no-op build stamp
+#----------------------------------------------------------------------
+class StampTest (BuildCase):
+
+	def setUp (self):
+		BuildCase.setUp(self)
+		self.write('a.c', 'int a(void) { return 0; }\n')
+		self.write('main.c', 'int main(void) { return 0; }\n')
+		self.write('p.mak', 'mode: exe\nout: prog\nint: objs\nsrc: *.c\n')
+
+	def test_noop (self):
+		self.build()
+		mtime = os.stat(self.path('prog')).st_mtime
+		time.sleep(0.05)
+		self.assertEqual(self.build().strip(), '')
+		self.assertEqual(os.stat(self.path('prog')).st_mtime, mtime)
+
+	def test_wildcard (self):
+		self.build()
+		self.assertEqual(self.objects(), ['a.o', 'main.o'])
+		self.write('extra.c', 'int extra(void) { return 0; }\n')
+		self.build()
+		self.assertEqual(self.objects(), ['a.o', 'extra.o', 'main.o'])
+
+	def test_wildcard_removed (self):
+		self.build()
+		os.remove(self.path('a.c'))
+		self.assertNotEqual(self.build().strip(), '')
+
+	def test_environ (self):
+		self.build()
+		self.assertEqual(self.build().strip(), '')
+		self.environ = { 'CPATH': self.root }
+		self.assertNotEqual(self.build().strip(), '')
+
+	def test_prune (self):
+		cache = self.path('cache/emake')
+		os.makedirs(cache)
+		for i in xrange(40):
+			name = os.path.join(cache, 'stamp-old%d.bin'%i)
+			open(name, 'w').close()
+			os.utime(name, (1, 1))
+		self.build()
+		names = [ n for n in os.listdir(cache) if n[:6] == 'stamp-' ]
+		self.assertEqual(len(names), 32)
+		self.assertEqual(len([ n for n in names if 'old' not in n ]), 1)
+
+
+#----------------------------------------------------------------------
+# testing
+#----------------------------------------------------------------------
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,238 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#======================================================================
+#
+# test_fasd.py - regression tests for lib/fasd.py (python 2 and 3)
+#
+#   python tools/test/test_fasd.py
+#
+#======================================================================
+import sys
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+LIBDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../lib')
+
+sys.path.insert(0, os.path.abspath(LIBDIR))
+import fasd
+
+
+#----------------------------------------------------------------------
+# common: every test works on its own data file in a temp directory
+#----------------------------------------------------------------------
+class FasdTestCase (unittest.TestCase):
+
+	def setUp (self):
+		self.root = tempfile.mkdtemp(prefix = 'fasd-test-')
+		self.name = os.path.join(self.root, 'fasd.txt')
+		self.now = int(time.time())
+
+	def tearDown (self):
+		shutil.rmtree(self.root, True)
+
+	def mkdir (self, name):
+		path = os.path.join(self.root, name)
+		os.makedirs(path)
+		return path
+
+	def write (self, items):
+		fp = open(self.name, 'w')
+		for path, rank, atime in items:
+			fp.write('%s|%d|%d\n'%(path, rank, atime))
+		fp.close()
+
+	def read (self):
+		fp = open(self.name, 'rb')
+		content = fp.read()
+		fp.close()
+		return content
+
+	def items (self, data):
+		return sorted([ (n[0], n[1], n[2]) for n in data ])
+
+
+#----------------------------------------------------------------------
+# binary index and journal
+#----------------------------------------------------------------------
+class FormatTest (FasdTestCase):
+
+	# entries point to real directories, compact() drops gone paths
+	def setUp (self):
+		FasdTestCase.setUp(self)
+		self.items_ = []
+		for i in range(200):
+			path = self.mkdir('project%03d/src'%i)
+			self.items_.append((path, i % 17 + 1, self.now - i * 60))
+		path = os.path.join(self.root, u'文档')
+		os.mkdir(path.encode('utf-8'))
+		self.items_.append((path, 3, self.now))
+		self.new = self.mkdir('new')
+
+	def sample (self):
+		return sorted(self.items_)
+
+	def path (self, i):
+		return os.path.join(self.root, 'project%03d/src'%i)
+
+	def test_round_trip (self):
+		fd = fasd.FasdData(self.name)
+		fd.save([ [n[0], n[1], n[2], 0] for n in self.sample() ])
+		text = self.read()
+		self.assertFalse(fasd.FasdIndex.detect(self.name))
+		fd.convert(True)
+		self.assertTrue(fasd.FasdIndex.detect(self.name))
+		self.assertEqual(self.items(fd.load()), self.sample())
+		found = fd.candidates(['project01'], 0)
+		self.assertEqual(len(found), 10)
+		fd.convert(False)
+		self.assertFalse(fasd.FasdIndex.detect(self.name))
+		self.assertEqual(sorted(self.read().splitlines()),
+				sorted(text.splitlines()))
+
+	def test_journal_replay (self):
+		fd = fasd.FasdData(self.name)
+		fd.journal = self.name + '.journal'
+		fd.save([ [n[0], n[1], n[2], 0] for n in self.sample() ])
+		fd.journal_append('+', [self.path(0), self.new])
+		fd.journal_append('-', [self.path(1)])
+		data = dict([ (n[0], n) for n in fd.load() ])
+		self.assertEqual(data[self.path(0)][1], 2)
+		self.assertEqual(data[self.new][1], 1)
+		self.assertTrue(self.path(1) not in data)
+		self.assertEqual(len(data), len(self.sample()))
+		# a torn last record is ignored
+		fp = open(fd.journal, 'a')
+		fp.write('+|%d|/torn'%self.now)
+		fp.close()
+		self.assertTrue('/torn' not in [ n[0] for n in fd.load() ])
+
+	def test_journal_compact (self):
+		for binary in (False, True):
+			fd = fasd.FasdData(self.name)
+			fd.binary = binary
+			fd.journal = self.name + '.journal'
+			fd.save([ [n[0], n[1], n[2], 0] for n in self.sample() ])
+			fd.journal_append('+', [self.new, self.new])
+			fd.journal_append('-', [self.path(2)])
+			before = self.items(fd.load())
+			self.assertEqual(fd.compact(), 0)
+			self.assertFalse(os.path.exists(fd.journal))
+			self.assertEqual(fasd.FasdIndex.detect(self.name), binary)
+			self.assertEqual(self.items(fd.load_base()), before)
+			self.assertEqual(self.items(fd.load()), before)
+
+
+#----------------------------------------------------------------------
+# negative cache of gone paths
+#----------------------------------------------------------------------
+class MissingTest (FasdTestCase):
+
+	def setUp (self):
+		FasdTestCase.setUp(self)
+		self.here = self.mkdir('here')
+		self.gone = os.path.join(self.root, 'gone')
+		self.fd = fasd.FasdData(self.name)
+		self.fd.missing_ttl = 60
+
+	def data (self, atime = None):
+		atime = atime or self.now - 10
+		return [ [self.here, 1, atime, 2], [self.gone, 1, atime, 1] ]
+
+	def test_available (self):
+		fd = self.fd
+		self.assertEqual(fd.available(self.data()), [ self.data()[0] ])
+		self.assertTrue(self.gone in fd.missing)
+		fd.missing_save()
+		# the path comes back, but the cache has not expired yet
+		os.mkdir(self.gone)
+		fd = fasd.FasdData(self.name)
+		self.assertEqual(len(fd.available(self.data())), 1)
+		# added again after it was found gone
+		self.assertEqual(len(fd.available(self.data(self.now + 10))), 2)
+		# expired
+		fd.missing[self.gone] = self.now - 120
+		self.assertEqual(len(fd.available(self.data())), 2)
+
+	def test_save (self):
+		fd = self.fd
+		fd.available(self.data())
+		fd.save(self.data())
+		self.assertEqual([ n[0] for n in fd.load() ], [ self.here ])
+		fd.missing[self.gone] = self.now - 120
+		fd.save(self.data())
+		self.assertEqual(len(fd.load()), 2)
+		self.assertFalse(self.gone in fd.missing)
+
+
+#----------------------------------------------------------------------
+# gone paths which are never queried are pruned without the cache
+#----------------------------------------------------------------------
+class PruneTest (FasdTestCase):
+
+	def setUp (self):
+		FasdTestCase.setUp(self)
+		self.here = self.mkdir('here')
+		self.gone = os.path.join(self.root, 'gone')
+		self.fd = fasd.FasdData(self.name)
+		self.fd.missing_ttl = 0
+		self.fd.maxage = 10
+
+	def test_aging (self):
+		data = [ [self.gone, 8, self.now, 0], [self.here, 3, self.now, 0] ]
+		data = self.fd.insert(data, [self.here])
+		# the dead rank is dropped before aging, the live one is kept
+		self.assertEqual(self.items(data), [ (self.here, 4, self.now) ])
+
+	def test_compact (self):
+		fd = self.fd
+		fd.journal = self.name + '.journal'
+		self.write([ (self.gone, 1, self.now), (self.here, 1, self.now) ])
+		fd.journal_append('+', [self.here])
+		self.assertEqual(fd.compact(), 0)
+		self.assertEqual([ n[0] for n in fd.load() ], [ self.here ])
+
+
+#----------------------------------------------------------------------
+# queries through FasdNg
+#----------------------------------------------------------------------
+class SearchTest (FasdTestCase):
+
+	def setUp (self):
+		FasdTestCase.setUp(self)
+		self.environ = dict(os.environ)
+		os.environ['_F_DATA'] = self.name
+		os.environ['_F_SERVER'] = '0'
+		os.environ['_F_MISSING_TTL'] = '60'
+		for name in ('_F_MATCHER', '_F_JOURNAL', '_F_FORMAT', '_F_BACKENDS'):
+			os.environ.pop(name, None)
+
+	def tearDown (self):
+		os.environ.clear()
+		os.environ.update(self.environ)
+		FasdTestCase.tearDown(self)
+
+	# the case sensitive match is gone: fall back to ignoring case
+	def test_nocase_fallback (self):
+		here = self.mkdir('foo')
+		gone = os.path.join(self.root, 'old', 'Foo')
+		self.write([ (gone, 10, self.now - 100), (here, 1, self.now - 100) ])
+		# the second query finds the gone path in the negative cache
+		for i in range(2):
+			fn = fasd.FasdNg()
+			self.assertEqual(fn.query(['Foo'], 'd'), here)
+		self.assertTrue(os.path.exists(self.name + '.missing'))
+		# a case sensitive match which exists still wins
+		path = self.mkdir('Foo')
+		fn = fasd.FasdNg()
+		fn.add(path)
+		self.assertEqual(fn.query(['Foo'], 'd'), path)
+
+
+#----------------------------------------------------------------------
+# testing
+#----------------------------------------------------------------------
+if __name__ == '__main__':
+	unittest.main()